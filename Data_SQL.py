@@ -1,48 +1,499 @@
+import argparse
 import sqlite3
-import pandas as pd
 
+import profiler
+from customers import CUSTOMER_TABLE, has_customers, single_group
+from queries import AGE_GROUP_SQL, sales_query, top_sales_query
+from query_cache import QueryCache, read_sql
+from rollup import ROLLUP_TABLE, has_rollup
 
-def execute_sql_queries(db_file_path='retail_sales.db'):
-    """Выполнение SQL-запросов для анализа данных"""
+# Необязательные движки (backends, partitions, query_runner, single_pass,
+# sketches, streaming_stats) импортируются в ветках, которые их используют:
+# отдельный запрос (cli.py query) не ждёт их импорта
+ENGINES = ('sql', 'single_pass', 'parallel')
+# Совпадает с backends.BACKENDS (продублирован, чтобы не импортировать модуль)
+BACKENDS = ('sqlite', 'duckdb')
 
-    conn = sqlite3.connect(db_file_path)
+# 1. Базовые запросы с фильтрацией WHERE
+# Транзакции по убыванию суммы: имя результата -> (колонки, n, фильтры).
+# SQL выбирает queries.top_sales_query: топ-n читается из лидербордов
+# (leaderboard.py), если они есть в базе (filter_queries)
+TOP_QUERIES = {}
+
+# 1.1 Продажи для женщин старше 30 лет
+TOP_QUERIES['female_over30_top10'] = (
+    ('customer_id', 'age', 'product_category', 'total_amount'),
+    10, {'gender': 'Female', 'min_age': 31})
+
+# 1.2 Продажи в категории Electronics с высокой стоимостью
+TOP_QUERIES['electronics_over1000'] = (
+    ('date', 'customer_id', 'age', 'gender', 'quantity', 'total_amount'),
+    None, {'category': 'Electronics', 'amount_above': 1000})
+
+# Имя результата -> (SQL, параметры) из библиотеки запросов queries.py
+FILTER_QUERIES = {name: top_sales_query(columns, n, **filters)
+                  for name, (columns, n, filters) in TOP_QUERIES.items()}
+
+# 1.3 Продажи за последний квартал 2023 года
+FILTER_QUERIES['q4_2023_sales'] = sales_query(
+    ('date', 'product_category', 'gender', 'total_amount'),
+    order_by='date', start_date='2023-10-01', end_date='2023-12-31')
+
+# 2. АГРЕГАТНЫЕ ФУНКЦИИ И 3. ДОПОЛНИТЕЛЬНЫЕ АНАЛИТИЧЕСКИЕ ЗАПРОСЫ
+# Запросы по имени результата в словаре, который возвращает execute_sql_queries
+AGGREGATE_QUERIES = {}
+
+# 2.1 Продажи по возрасту и полу
+AGGREGATE_QUERIES['age_gender_sales'] = """
+SELECT 
+    CASE 
+        WHEN age BETWEEN 18 AND 25 THEN '18-25'
+        WHEN age BETWEEN 26 AND 35 THEN '26-35'
+        WHEN age BETWEEN 36 AND 45 THEN '36-45'
+        WHEN age BETWEEN 46 AND 55 THEN '46-55'
+        ELSE '55+'
+    END as age_group,
+    gender,
+    COUNT(*) as transaction_count,
+    SUM(total_amount) as total_sales,
+    AVG(total_amount) as avg_transaction_value,
+    SUM(quantity) as total_items
+FROM retail_sales
+GROUP BY age_group, gender
+ORDER BY age_group, gender;
+"""
+
+# 2.2 Продажи по полу в разрезе категорий
+AGGREGATE_QUERIES['category_gender_sales'] = """
+SELECT 
+    product_category,
+    gender,
+    COUNT(*) as transaction_count,
+    SUM(total_amount) as total_sales,
+    AVG(total_amount) as avg_sale,
+    SUM(quantity) as total_quantity
+FROM retail_sales
+GROUP BY product_category, gender
+ORDER BY product_category, gender;
+"""
+
+# 2.3 Динамика продаж по месяцам с разбивкой по полу
+AGGREGATE_QUERIES['monthly_sales'] = """
+SELECT 
+    strftime('%Y-%m', date) as month,
+    gender,
+    COUNT(*) as transactions,
+    SUM(total_amount) as monthly_sales,
+    AVG(total_amount) as avg_transaction,
+    SUM(quantity) as items_sold
+FROM retail_sales
+GROUP BY month, gender
+ORDER BY month, gender;
+"""
+
+# 3.1 Корреляционный анализ (подготовка данных для матрицы)
+AGGREGATE_QUERIES['correlation_data'] = """
+SELECT 
+    age,
+    CASE WHEN gender = 'Male' THEN 1 ELSE 0 END as is_male,
+    quantity,
+    price_per_unit,
+    total_amount,
+    CASE 
+        WHEN product_category = 'Electronics' THEN 1
+        WHEN product_category = 'Clothing' THEN 2
+        WHEN product_category = 'Beauty' THEN 3
+    END as category_code
+FROM retail_sales;
+"""
+
+# 3.2 Сравнение по возрастным группам (вместо топ-10 клиентов)
+AGGREGATE_QUERIES['age_group_comparison'] = """
+WITH age_group_stats AS (
+    SELECT 
+        CASE 
+            WHEN age BETWEEN 18 AND 25 THEN '18-25 (Молодежь)'
+            WHEN age BETWEEN 26 AND 35 THEN '26-35 (Молодые взрослые)'
+            WHEN age BETWEEN 36 AND 45 THEN '36-45 (Средний возраст)'
+            WHEN age BETWEEN 46 AND 55 THEN '46-55 (Зрелые)'
+            ELSE '55+ (Пенсионный)'
+        END as age_group,
+        COUNT(DISTINCT customer_id) as unique_customers,
+        COUNT(*) as total_transactions,
+        SUM(total_amount) as total_revenue,
+        AVG(total_amount) as avg_transaction_value,
+        SUM(quantity) as total_items,
+        AVG(quantity) as avg_items_per_transaction,
+        SUM(total_amount) / COUNT(DISTINCT customer_id) as revenue_per_customer
+    FROM retail_sales
+    GROUP BY age_group
+)
+SELECT 
+    age_group,
+    unique_customers,
+    total_transactions,
+    ROUND(total_revenue, 2) as total_revenue,
+    ROUND(avg_transaction_value, 2) as avg_transaction,
+    total_items,
+    ROUND(avg_items_per_transaction, 2) as avg_items,
+    ROUND(revenue_per_customer, 2) as revenue_per_customer,
+    ROUND(100.0 * total_transactions / SUM(total_transactions) OVER(), 2) as transactions_percentage
+FROM age_group_stats
+ORDER BY 
+    CASE age_group
+        WHEN '18-25 (Молодежь)' THEN 1
+        WHEN '26-35 (Молодые взрослые)' THEN 2
+        WHEN '36-45 (Средний возраст)' THEN 3
+        WHEN '46-55 (Зрелые)' THEN 4
+        ELSE 5
+    END;
+"""
+
+# 3.3 Дополнительная визуализация: Анализ популярности категорий по возрастным группам
+AGGREGATE_QUERIES['category_by_age'] = """
+SELECT 
+    CASE 
+        WHEN age BETWEEN 18 AND 25 THEN '18-25'
+        WHEN age BETWEEN 26 AND 35 THEN '26-35'
+        WHEN age BETWEEN 36 AND 45 THEN '36-45'
+        WHEN age BETWEEN 46 AND 55 THEN '46-55'
+        ELSE '55+'
+    END as age_group,
+    product_category,
+    COUNT(*) as purchases,
+    SUM(total_amount) as category_revenue,
+    AVG(total_amount) as avg_spent,
+    SUM(quantity) as items_bought,
+    ROUND(100.0 * COUNT(*) / SUM(COUNT(*)) OVER (PARTITION BY 
+        CASE 
+            WHEN age BETWEEN 18 AND 25 THEN '18-25'
+            WHEN age BETWEEN 26 AND 35 THEN '26-35'
+            WHEN age BETWEEN 36 AND 45 THEN '36-45'
+            WHEN age BETWEEN 46 AND 55 THEN '46-55'
+            ELSE '55+'
+        END), 2) as category_percentage
+FROM retail_sales
+GROUP BY age_group, product_category
+ORDER BY age_group, category_revenue DESC;
+"""
+
+# 3.4 Сезонность продаж (по месяцам)
+AGGREGATE_QUERIES['seasonality'] = """
+SELECT 
+    strftime('%m', date) as month_num,
+    CASE strftime('%m', date)
+        WHEN '01' THEN 'Январь'
+        WHEN '02' THEN 'Февраль'
+        WHEN '03' THEN 'Март'
+        WHEN '04' THEN 'Апрель'
+        WHEN '05' THEN 'Май'
+        WHEN '06' THEN 'Июнь'
+        WHEN '07' THEN 'Июль'
+        WHEN '08' THEN 'Август'
+        WHEN '09' THEN 'Сентябрь'
+        WHEN '10' THEN 'Октябрь'
+        WHEN '11' THEN 'Ноябрь'
+        WHEN '12' THEN 'Декабрь'
+    END as month_name,
+    COUNT(*) as transactions,
+    SUM(total_amount) as total_sales,
+    AVG(total_amount) as avg_sale,
+    SUM(quantity) as total_items,
+    COUNT(DISTINCT customer_id) as unique_customers
+FROM retail_sales
+GROUP BY month_num
+ORDER BY month_num;
+"""
+
+# Те же агрегаты по сводной таблице rollup.ROLLUP_TABLE (без COUNT(DISTINCT))
+ROLLUP_QUERIES = {}
+
+# 2.1 Продажи по возрасту и полу
+ROLLUP_QUERIES['age_gender_sales'] = f"""
+SELECT 
+    CASE 
+        WHEN age BETWEEN 18 AND 25 THEN '18-25'
+        WHEN age BETWEEN 26 AND 35 THEN '26-35'
+        WHEN age BETWEEN 36 AND 45 THEN '36-45'
+        WHEN age BETWEEN 46 AND 55 THEN '46-55'
+        ELSE '55+'
+    END as age_group,
+    gender,
+    SUM(transactions) as transaction_count,
+    SUM(total_sales) as total_sales,
+    SUM(total_sales) / SUM(transactions) as avg_transaction_value,
+    SUM(total_items) as total_items
+FROM {ROLLUP_TABLE}
+GROUP BY age_group, gender
+ORDER BY age_group, gender;
+"""
+
+# 2.2 Продажи по полу в разрезе категорий
+ROLLUP_QUERIES['category_gender_sales'] = f"""
+SELECT 
+    product_category,
+    gender,
+    SUM(transactions) as transaction_count,
+    SUM(total_sales) as total_sales,
+    SUM(total_sales) / SUM(transactions) as avg_sale,
+    SUM(total_items) as total_quantity
+FROM {ROLLUP_TABLE}
+GROUP BY product_category, gender
+ORDER BY product_category, gender;
+"""
+
+# 2.3 Динамика продаж по месяцам с разбивкой по полу
+ROLLUP_QUERIES['monthly_sales'] = f"""
+SELECT 
+    strftime('%Y-%m', date) as month,
+    gender,
+    SUM(transactions) as transactions,
+    SUM(total_sales) as monthly_sales,
+    SUM(total_sales) / SUM(transactions) as avg_transaction,
+    SUM(total_items) as items_sold
+FROM {ROLLUP_TABLE}
+GROUP BY month, gender
+ORDER BY month, gender;
+"""
+
+# 3.3 Дополнительная визуализация: Анализ популярности категорий по возрастным группам
+ROLLUP_QUERIES['category_by_age'] = f"""
+SELECT 
+    age_group,
+    product_category,
+    SUM(transactions) as purchases,
+    SUM(total_sales) as category_revenue,
+    SUM(total_sales) / SUM(transactions) as avg_spent,
+    SUM(total_items) as items_bought,
+    ROUND(100.0 * SUM(transactions) / SUM(SUM(transactions)) OVER (PARTITION BY age_group), 2)
+        as category_percentage
+FROM (
+    SELECT 
+        CASE 
+            WHEN age BETWEEN 18 AND 25 THEN '18-25'
+            WHEN age BETWEEN 26 AND 35 THEN '26-35'
+            WHEN age BETWEEN 36 AND 45 THEN '36-45'
+            WHEN age BETWEEN 46 AND 55 THEN '46-55'
+            ELSE '55+'
+        END as age_group,
+        product_category, transactions, total_sales, total_items
+    FROM {ROLLUP_TABLE}
+)
+GROUP BY age_group, product_category
+ORDER BY age_group, category_revenue DESC;
+"""
+
+# Агрегаты с числом уникальных покупателей по таблице customers.CUSTOMER_TABLE:
+# строка таблицы - один покупатель, поэтому COUNT(DISTINCT customer_id) = COUNT(*)
+CUSTOMER_QUERIES = {}
+
+# 3.2 Сравнение по возрастным группам; верно, если возраст покупателя не
+# переходит границу группы (customers.single_group)
+CUSTOMER_QUERIES['age_group_comparison'] = f"""
+WITH age_group_stats AS (
+    SELECT 
+        CASE 
+            WHEN min_age BETWEEN 18 AND 25 THEN '18-25 (Молодежь)'
+            WHEN min_age BETWEEN 26 AND 35 THEN '26-35 (Молодые взрослые)'
+            WHEN min_age BETWEEN 36 AND 45 THEN '36-45 (Средний возраст)'
+            WHEN min_age BETWEEN 46 AND 55 THEN '46-55 (Зрелые)'
+            ELSE '55+ (Пенсионный)'
+        END as age_group,
+        COUNT(*) as unique_customers,
+        SUM(transactions) as total_transactions,
+        SUM(total_spend) as total_revenue,
+        SUM(total_spend) / SUM(transactions) as avg_transaction_value,
+        SUM(total_items) as total_items,
+        1.0 * SUM(total_items) / SUM(transactions) as avg_items_per_transaction,
+        SUM(total_spend) / COUNT(*) as revenue_per_customer
+    FROM {CUSTOMER_TABLE}
+    GROUP BY age_group
+)
+SELECT 
+    age_group,
+    unique_customers,
+    total_transactions,
+    ROUND(total_revenue, 2) as total_revenue,
+    ROUND(avg_transaction_value, 2) as avg_transaction,
+    total_items,
+    ROUND(avg_items_per_transaction, 2) as avg_items,
+    ROUND(revenue_per_customer, 2) as revenue_per_customer,
+    ROUND(100.0 * total_transactions / SUM(total_transactions) OVER(), 2) as transactions_percentage
+FROM age_group_stats
+ORDER BY 
+    CASE age_group
+        WHEN '18-25 (Молодежь)' THEN 1
+        WHEN '26-35 (Молодые взрослые)' THEN 2
+        WHEN '36-45 (Средний возраст)' THEN 3
+        WHEN '46-55 (Зрелые)' THEN 4
+        ELSE 5
+    END;
+"""
+
+def aggregate_queries(conn, approx_distinct=False, streaming_stats=False):
+    """Агрегирующие запросы с учётом сводной таблицы: имя результата -> SQL
+
+    При approx_distinct=True запросы с COUNT(DISTINCT customer_id) из
+    sketches.APPROXIMATE_REPORTS не возвращаются: их считает
+    sketches.approximate_reports. При streaming_stats=True вместо всех
+    строк correlation_data запрашиваются только первые 10: саму матрицу
+    считает streaming_stats.py.
+    """
+    queries = dict(AGGREGATE_QUERIES)
+    # Агрегаты без COUNT(DISTINCT) считаются по сводной таблице, если она есть
+    if has_rollup(conn):
+        queries.update(ROLLUP_QUERIES)
+    # Уникальные покупатели - по таблице покупателей, без COUNT(DISTINCT) по транзакциям
+    if has_customers(conn) and single_group(conn, AGE_GROUP_SQL):
+        queries.update(CUSTOMER_QUERIES)
+    if approx_distinct:
+        from sketches import APPROXIMATE_REPORTS
+        for name in APPROXIMATE_REPORTS:
+            del queries[name]
+    if streaming_stats:
+        from streaming_stats import stats_query
+        queries['correlation_data'] = stats_query() + "\nLIMIT 10;"
+    return queries
+
+
+def filter_queries(conn):
+    """FILTER_QUERIES для базы conn: топ по сумме - из лидербордов, если они покрывают запрос"""
+    queries = dict(FILTER_QUERIES)
+    for name, (columns, n, filters) in TOP_QUERIES.items():
+        queries[name] = top_sales_query(columns, n, conn, **filters)
+    return queries
+
+
+def run_aggregate_queries(conn, cache=None, approx_distinct=False, streaming_stats=False):
+    """Агрегаты отдельными SQL-запросами, по одному на результат"""
+    return {name: read_sql(query, conn, cache=cache, name=name)
+            for name, query in aggregate_queries(conn, approx_distinct, streaming_stats).items()}
+
+
+def execute_sql_queries(db_file_path='retail_sales.db', engine='sql', workers=None,
+                        cache=None, columnar_dir=None, partition_dir=None,
+                        approx_distinct=False, streaming_stats=False, backend='sqlite'):
+    """Выполнение SQL-запросов для анализа данных
+
+    engine='sql' считает каждый агрегат своим запросом, engine='single_pass'
+    читает retail_sales один раз и считает все агрегаты в памяти
+    (single_pass.compute_reports), engine='parallel' выполняет все запросы
+    одновременно на пуле из workers read-only соединений
+    (query_runner.run_parallel). Возвращаемый словарь одинаков.
+
+    cache - query_cache.QueryCache: результаты запросов берутся из кэша,
+    пока данные в базе не менялись. columnar_dir - колоночная копия
+    таблицы для engine='single_pass' (columnar.py). partition_dir - месячные
+    партиции (partitions.py) для engine='sql': запросы по периоду дат читают
+    только нужные месяцы, агрегаты из PARTITIONED_REPORTS считаются по всем
+    партициям параллельно, остальные - по db_file_path. approx_distinct -
+    число уникальных покупателей в age_group_comparison и seasonality
+    оценивается по скетчам HyperLogLog (sketches.py), построенным при
+    загрузке, вместо COUNT(DISTINCT). streaming_stats - корреляционная
+    матрица и описательные статистики считаются за один проход порциями
+    (streaming_stats.py, параллельно по диапазонам ключа или по партициям)
+    без выгрузки всех строк: в результате correlation_data содержит только
+    первые строки, а состояние RunningStats - под ключом 'correlation_stats'.
+
+    backend - движок агрегатов для engine='sql' (backends.py): 'duckdb'
+    выполняет AGGREGATE_QUERIES во встроенном колоночном DuckDB на всех
+    ядрах (workers - число потоков), читая Parquet-копию из columnar_dir,
+    если она актуальна; запросы с фильтрацией остаются в SQLite.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Неизвестный способ расчёта: {engine}")
+    if partition_dir and engine != 'sql':
+        raise ValueError("Месячные партиции поддерживаются только для engine='sql'")
+    if approx_distinct and engine == 'single_pass':
+        raise ValueError("Оценка по скетчам не нужна для engine='single_pass'")
+    if streaming_stats and engine == 'single_pass':
+        raise ValueError("Потоковые статистики не нужны для engine='single_pass'")
+    if backend not in BACKENDS:
+        raise ValueError(f"Неизвестный движок: {backend}")
+    if backend != 'sqlite' and (engine != 'sql' or partition_dir or approx_distinct
+                                or streaming_stats or cache is not None):
+        raise ValueError(f"backend='{backend}' работает только с engine='sql', без партиций, "
+                         f"скетчей, потоковых статистик и кэша")
+    if approx_distinct:
+        from sketches import approximate_reports
+    if streaming_stats:
+        from streaming_stats import partition_stats, table_stats
+    if partition_dir:
+        from partitions import PARTITIONED_REPORTS, partitioned_report, select_range
+
+    if engine == 'parallel':
+        from query_runner import ConnectionPool, run_parallel
+
+        # Все запросы независимы: выполняем их одновременно на пуле соединений
+        with ConnectionPool(db_file_path, size=workers) as pool, profiler.stage('все запросы'):
+            with pool.connection() as conn:
+                queries = aggregate_queries(conn, approx_distinct, streaming_stats)
+                filters = filter_queries(conn)
+            frames = run_parallel({**filters, **queries}, pool, cache=cache)
+            results = {name: frames[name] for name in queries}
+            if approx_distinct:
+                with pool.connection() as conn:
+                    results.update(approximate_reports(conn))
+            stats = table_stats(db_file_path, pool=pool) if streaming_stats else None
+    else:
+        conn = sqlite3.connect(db_file_path)
+        with profiler.stage('запросы с фильтрацией'):
+            frames = {}
+            for name, (query, params) in filter_queries(conn).items():
+                if partition_dir and 'start_date' in params:
+                    frames[name] = select_range(partition_dir, query, params['start_date'],
+                                                params.get('end_date'), params, workers)
+                else:
+                    frames[name] = read_sql(query, conn, params, cache, name)
+        with profiler.stage(f'агрегаты ({engine})'):
+            if engine == 'single_pass':
+                from single_pass import compute_reports
+                results = compute_reports(conn, columnar_dir)
+            elif backend != 'sqlite':
+                from backends import connect, read_query
+
+                # Запросы к таблице фактов без сводной таблицы: их считает колоночный движок
+                analytic = connect(db_file_path, backend, columnar_dir, workers)
+                try:
+                    results = {name: read_query(query, analytic, name=name)
+                               for name, query in AGGREGATE_QUERIES.items()}
+                finally:
+                    analytic.close()
+            elif partition_dir:
+                results = {}
+                for name, query in aggregate_queries(conn, approx_distinct,
+                                                     streaming_stats).items():
+                    if name in PARTITIONED_REPORTS:
+                        results[name] = partitioned_report(partition_dir, name, workers)
+                    else:
+                        results[name] = read_sql(query, conn, cache=cache, name=name)
+            else:
+                results = run_aggregate_queries(conn, cache, approx_distinct, streaming_stats)
+            if approx_distinct:
+                results.update(approximate_reports(conn))
+        conn.close()
+        stats = None
+        if streaming_stats:
+            stats = (partition_stats(partition_dir, workers=workers) if partition_dir
+                     else table_stats(db_file_path, workers=workers))
+    results = {name: results[name] for name in AGGREGATE_QUERIES}
+    if stats is not None:
+        results['correlation_stats'] = stats
 
     # 1. Базовые запросы с фильтрацией WHERE
     print("=" * 80)
     print("1. БАЗОВЫЕ ЗАПРОСЫ С ФИЛЬТРАЦИЕЙ")
     print("=" * 80)
 
-    # 1.1 Продажи для женщин старше 30 лет
-    query1 = """
-    SELECT customer_id, age, product_category, total_amount
-    FROM retail_sales
-    WHERE gender = 'Female' AND age > 30
-    ORDER BY total_amount DESC
-    LIMIT 10;
-    """
-    df1 = pd.read_sql_query(query1, conn)
+    df1 = frames['female_over30_top10']
     print("\n1.1 Топ-10 продаж (женщины старше 30 лет):")
     print(df1)
 
-    # 1.2 Продажи в категории Electronics с высокой стоимостью
-    query2 = """
-    SELECT date, customer_id, age, gender, quantity, total_amount
-    FROM retail_sales
-    WHERE product_category = 'Electronics' AND total_amount > 1000
-    ORDER BY total_amount DESC;
-    """
-    df2 = pd.read_sql_query(query2, conn)
+    df2 = frames['electronics_over1000']
     print(f"\n1.2 Продажи Electronics > 1000 (всего {len(df2)} записей):")
     print(df2.head())
 
-    # 1.3 Продажи за последний квартал 2023 года
-    query3 = """
-    SELECT date, product_category, gender, total_amount
-    FROM retail_sales
-    WHERE date BETWEEN '2023-10-01' AND '2023-12-31'
-    ORDER BY date;
-    """
-    df3 = pd.read_sql_query(query3, conn)
+    df3 = frames['q4_2023_sales']
     print(f"\n1.3 Продажи в 4-м квартале 2023 (всего {len(df3)} записей):")
     print(df3.head())
 
@@ -51,212 +502,83 @@ def execute_sql_queries(db_file_path='retail_sales.db'):
     print("2. АГРЕГАТНЫЕ ФУНКЦИИ")
     print("=" * 80)
 
-    # 2.1 Продажи по возрасту и полу
-    query4 = """
-    SELECT 
-        CASE 
-            WHEN age BETWEEN 18 AND 25 THEN '18-25'
-            WHEN age BETWEEN 26 AND 35 THEN '26-35'
-            WHEN age BETWEEN 36 AND 45 THEN '36-45'
-            WHEN age BETWEEN 46 AND 55 THEN '46-55'
-            ELSE '55+'
-        END as age_group,
-        gender,
-        COUNT(*) as transaction_count,
-        SUM(total_amount) as total_sales,
-        AVG(total_amount) as avg_transaction_value,
-        SUM(quantity) as total_items
-    FROM retail_sales
-    GROUP BY age_group, gender
-    ORDER BY age_group, gender;
-    """
-    df4 = pd.read_sql_query(query4, conn)
     print("\n2.1 Продажи по возрастным группам и полу:")
-    print(df4)
+    print(results['age_gender_sales'])
 
-    # 2.2 Продажи по полу в разрезе категорий
-    query5 = """
-    SELECT 
-        product_category,
-        gender,
-        COUNT(*) as transaction_count,
-        SUM(total_amount) as total_sales,
-        AVG(total_amount) as avg_sale,
-        SUM(quantity) as total_quantity
-    FROM retail_sales
-    GROUP BY product_category, gender
-    ORDER BY product_category, gender;
-    """
-    df5 = pd.read_sql_query(query5, conn)
     print("\n2.2 Продажи по полу в категориях:")
-    print(df5)
+    print(results['category_gender_sales'])
 
-    # 2.3 Динамика продаж по месяцам с разбивкой по полу
-    query6 = """
-    SELECT 
-        strftime('%Y-%m', date) as month,
-        gender,
-        COUNT(*) as transactions,
-        SUM(total_amount) as monthly_sales,
-        AVG(total_amount) as avg_transaction,
-        SUM(quantity) as items_sold
-    FROM retail_sales
-    GROUP BY month, gender
-    ORDER BY month, gender;
-    """
-    df6 = pd.read_sql_query(query6, conn)
     print("\n2.3 Динамика продаж по месяцам (по полу):")
-    print(df6)
+    print(results['monthly_sales'])
 
     # 3. ДОПОЛНИТЕЛЬНЫЕ АНАЛИТИЧЕСКИЕ ЗАПРОСЫ
-
-    # 3.1 Корреляционный анализ (подготовка данных для матрицы)
-    query7 = """
-    SELECT 
-        age,
-        CASE WHEN gender = 'Male' THEN 1 ELSE 0 END as is_male,
-        quantity,
-        price_per_unit,
-        total_amount,
-        CASE 
-            WHEN product_category = 'Electronics' THEN 1
-            WHEN product_category = 'Clothing' THEN 2
-            WHEN product_category = 'Beauty' THEN 3
-        END as category_code
-    FROM retail_sales;
-    """
-    df7 = pd.read_sql_query(query7, conn)
+    df7 = results['correlation_data']
     print("\n3.1 Данные для корреляционной матрицы (первые 10 строк):")
     print(df7.head(10))
 
     # Корреляционная матрица
+    stats = results.get('correlation_stats')
     print("\nКорреляционная матрица числовых признаков:")
-    print(df7.corr().round(3))
-
-    # 3.2 Сравнение по возрастным группам (вместо топ-10 клиентов)
-    query8 = """
-    WITH age_group_stats AS (
-        SELECT 
-            CASE 
-                WHEN age BETWEEN 18 AND 25 THEN '18-25 (Молодежь)'
-                WHEN age BETWEEN 26 AND 35 THEN '26-35 (Молодые взрослые)'
-                WHEN age BETWEEN 36 AND 45 THEN '36-45 (Средний возраст)'
-                WHEN age BETWEEN 46 AND 55 THEN '46-55 (Зрелые)'
-                ELSE '55+ (Пенсионный)'
-            END as age_group,
-            COUNT(DISTINCT customer_id) as unique_customers,
-            COUNT(*) as total_transactions,
-            SUM(total_amount) as total_revenue,
-            AVG(total_amount) as avg_transaction_value,
-            SUM(quantity) as total_items,
-            AVG(quantity) as avg_items_per_transaction,
-            SUM(total_amount) / COUNT(DISTINCT customer_id) as revenue_per_customer
-        FROM retail_sales
-        GROUP BY age_group
-    )
-    SELECT 
-        age_group,
-        unique_customers,
-        total_transactions,
-        ROUND(total_revenue, 2) as total_revenue,
-        ROUND(avg_transaction_value, 2) as avg_transaction,
-        total_items,
-        ROUND(avg_items_per_transaction, 2) as avg_items,
-        ROUND(revenue_per_customer, 2) as revenue_per_customer,
-        ROUND(100.0 * total_transactions / SUM(total_transactions) OVER(), 2) as transactions_percentage
-    FROM age_group_stats
-    ORDER BY 
-        CASE age_group
-            WHEN '18-25 (Молодежь)' THEN 1
-            WHEN '26-35 (Молодые взрослые)' THEN 2
-            WHEN '36-45 (Средний возраст)' THEN 3
-            WHEN '46-55 (Зрелые)' THEN 4
-            ELSE 5
-        END;
-    """
-    df8 = pd.read_sql_query(query8, conn)
+    print((df7.corr() if stats is None else stats.corr()).round(3))
+    if stats is not None:
+        print("\nОписательные статистики признаков:")
+        print(stats.describe().round(3))
+
     print("\n3.2 Сравнение показателей по возрастным группам:")
-    print(df8)
+    print(results['age_group_comparison'])
 
-    # 3.3 Дополнительная визуализация: Анализ популярности категорий по возрастным группам
-    query9 = """
-    SELECT 
-        CASE 
-            WHEN age BETWEEN 18 AND 25 THEN '18-25'
-            WHEN age BETWEEN 26 AND 35 THEN '26-35'
-            WHEN age BETWEEN 36 AND 45 THEN '36-45'
-            WHEN age BETWEEN 46 AND 55 THEN '46-55'
-            ELSE '55+'
-        END as age_group,
-        product_category,
-        COUNT(*) as purchases,
-        SUM(total_amount) as category_revenue,
-        AVG(total_amount) as avg_spent,
-        SUM(quantity) as items_bought,
-        ROUND(100.0 * COUNT(*) / SUM(COUNT(*)) OVER (PARTITION BY 
-            CASE 
-                WHEN age BETWEEN 18 AND 25 THEN '18-25'
-                WHEN age BETWEEN 26 AND 35 THEN '26-35'
-                WHEN age BETWEEN 36 AND 45 THEN '36-45'
-                WHEN age BETWEEN 46 AND 55 THEN '46-55'
-                ELSE '55+'
-            END), 2) as category_percentage
-    FROM retail_sales
-    GROUP BY age_group, product_category
-    ORDER BY age_group, category_revenue DESC;
-    """
-    df9 = pd.read_sql_query(query9, conn)
     print("\n3.3 Популярность категорий по возрастным группам:")
-    print(df9)
+    print(results['category_by_age'])
 
-    # 3.4 Сезонность продаж (по месяцам)
-    query10 = """
-    SELECT 
-        strftime('%m', date) as month_num,
-        CASE strftime('%m', date)
-            WHEN '01' THEN 'Январь'
-            WHEN '02' THEN 'Февраль'
-            WHEN '03' THEN 'Март'
-            WHEN '04' THEN 'Апрель'
-            WHEN '05' THEN 'Май'
-            WHEN '06' THEN 'Июнь'
-            WHEN '07' THEN 'Июль'
-            WHEN '08' THEN 'Август'
-            WHEN '09' THEN 'Сентябрь'
-            WHEN '10' THEN 'Октябрь'
-            WHEN '11' THEN 'Ноябрь'
-            WHEN '12' THEN 'Декабрь'
-        END as month_name,
-        COUNT(*) as transactions,
-        SUM(total_amount) as total_sales,
-        AVG(total_amount) as avg_sale,
-        SUM(quantity) as total_items,
-        COUNT(DISTINCT customer_id) as unique_customers
-    FROM retail_sales
-    GROUP BY month_num
-    ORDER BY month_num;
-    """
-    df10 = pd.read_sql_query(query10, conn)
     print("\n3.4 Сезонность продаж по месяцам:")
-    print(df10)
-
-    conn.close()
+    print(results['seasonality'])
 
     # Возвращаем DataFrames для возможной визуализации
-    return {
-        'age_gender_sales': df4,
-        'category_gender_sales': df5,
-        'monthly_sales': df6,
-        'correlation_data': df7,
-        'age_group_comparison': df8,
-        'category_by_age': df9,
-        'seasonality': df10
-    }
+    return results
 
 
 # Выполнение запросов
 if __name__ == "__main__":
-    results = execute_sql_queries()
+    parser = argparse.ArgumentParser(description="SQL-анализ розничных продаж")
+    parser.add_argument("--db", default="retail_sales.db", help="путь к базе данных SQLite")
+    parser.add_argument("--engine", choices=ENGINES, default="sql",
+                        help="способ расчёта агрегатов")
+    parser.add_argument("--backend", choices=BACKENDS, default="sqlite",
+                        help="движок агрегатов для --engine sql (duckdb - колоночный, "
+                             "на всех ядрах)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="число соединений для --engine parallel и потоков для "
+                             "--backend duckdb (по умолчанию - число ядер)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="каталог кэша результатов запросов (по умолчанию кэш выключен)")
+    parser.add_argument("--columnar-dir", default=None,
+                        help="колоночная копия таблицы для --engine single_pass "
+                             "и --backend duckdb")
+    parser.add_argument("--partitions", default=None, metavar="DIR",
+                        help="месячные партиции (partitions.py) для --engine sql")
+    parser.add_argument("--approx-distinct", action="store_true",
+                        help="уникальные покупатели по скетчам HyperLogLog (нужна загрузка "
+                             "с --sketch-error)")
+    parser.add_argument("--streaming-stats", action="store_true",
+                        help="корреляционная матрица за один проход порциями, без выгрузки "
+                             "всех строк")
+    parser.add_argument("--profile", nargs="?", const=profiler.PROFILE_PATH, default=None,
+                        metavar="PATH",
+                        help="профиль запросов и этапов в PATH.txt и PATH.json "
+                             f"(также переменная окружения {profiler.PROFILE_ENV})")
+    args = parser.parse_args()
+    if args.profile:
+        profiler.enable(args.profile)
+
+    cache = QueryCache(args.cache_dir) if args.cache_dir else None
+    results = execute_sql_queries(args.db, engine=args.engine, workers=args.workers,
+                                  cache=cache, columnar_dir=args.columnar_dir,
+                                  partition_dir=args.partitions,
+                                  approx_distinct=args.approx_distinct,
+                                  streaming_stats=args.streaming_stats,
+                                  backend=args.backend)
+    if cache is not None:
+        print(f"\nКэш запросов: {cache.stats()}")
 
     print("\n" + "=" * 80)
     print("АНАЛИТИЧЕСКИЕ ВЫВОДЫ:")
@@ -0,0 +1,217 @@
+"""Движки выполнения агрегатов: SQLite или встроенный колоночный DuckDB.
+
+Одни и те же именованные запросы Data_SQL.py и visual.py выполняются либо
+в SQLite (построчный исполнитель в одном потоке), либо в DuckDB -
+векторном колоночном движке внутри процесса, который распараллеливает
+GROUP BY и оконные функции (SUM(...) OVER (PARTITION BY ...)) по всем
+ядрам без отдельного сервера. Движок выбирается на запуск:
+
+    python Data_SQL.py --backend duckdb --columnar-dir retail_sales_columnar
+    python visual.py --headless --backend duckdb
+    python backends.py --db retail_sales.db      # сверка результатов движков
+
+DuckDB видит retail_sales как представление над одним из источников (по
+порядку): Parquet-копией columnar.py, если она актуальна; файлом SQLite
+через расширение sqlite DuckDB, если оно установлено; иначе таблица один
+раз читается из SQLite в память. Колонка date в представлении имеет тип
+DATE, поэтому strftime('%Y-%m', date) работает так же, как в SQLite.
+Целые колонки результата приводятся к int64, как у pd.read_sql_query
+для SQLite (DuckDB возвращает SUM целых как HUGEINT, а pandas - как float).
+Запросы с фильтрацией остаются в SQLite: их обслуживают индексы.
+"""
+import argparse
+import os
+import re
+import time
+from contextlib import closing
+
+import pandas as pd
+
+import columnar
+import profiler
+from query_cache import read_sql
+from query_runner import connect_readonly
+from schema import COLUMNS, TABLE_NAME
+
+BACKENDS = ('sqlite', 'duckdb')
+
+_INTEGER_TYPES = {'TINYINT', 'SMALLINT', 'INTEGER', 'BIGINT', 'HUGEINT',
+                  'UTINYINT', 'USMALLINT', 'UINTEGER', 'UBIGINT', 'UHUGEINT'}
+
+# Суммы и средние с плавающей точкой, сложенные в другом порядке (параллельно),
+# могут отличаться в последних знаках
+PARITY_RTOL = 1e-9
+PARITY_ATOL = 1e-9
+
+_ROUND_CALL = re.compile(r"\bROUND\s*\(", re.IGNORECASE)
+_ROUND_TAIL = re.compile(r",\s*(\d+)\s*\)\s*as\s+(\w+)", re.IGNORECASE)
+
+
+def _literal(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _duckdb_source(duck, db_path, columnar_dir):
+    """Выражение FROM для retail_sales в DuckDB (см. описание модуля)"""
+    import duckdb
+
+    with closing(connect_readonly(db_path)) as conn:
+        if columnar_dir and columnar.is_fresh(columnar_dir, conn):
+            parquet = columnar.read_meta(columnar_dir)['parquet']
+            if parquet:
+                return f"read_parquet({_literal(os.path.join(columnar_dir, parquet))})"
+        try:
+            duck.execute("LOAD sqlite")
+        except duckdb.Error:
+            pass
+        else:
+            return f"sqlite_scan({_literal(db_path)}, {_literal(TABLE_NAME)})"
+        with profiler.stage('чтение retail_sales в DuckDB'):
+            frame = pd.read_sql_query(f"SELECT {', '.join(COLUMNS)} FROM {TABLE_NAME}", conn)
+    duck.register('retail_sales_source', frame)
+    return 'retail_sales_source'
+
+
+def connect(db_path, backend='sqlite', columnar_dir=None, threads=None):
+    """Соединение для чтения агрегатов: read-only sqlite3 или DuckDB в памяти.
+
+    columnar_dir - Parquet-копия таблицы (columnar.py) для DuckDB, threads -
+    число потоков DuckDB (по умолчанию - все ядра).
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Неизвестный движок: {backend}")
+    if backend == 'sqlite':
+        return connect_readonly(db_path)
+
+    import duckdb
+
+    duck = duckdb.connect(config={'threads': threads} if threads else {})
+    source = _duckdb_source(duck, db_path, columnar_dir)
+    duck.execute(f"CREATE VIEW {TABLE_NAME} AS "
+                 f"SELECT * REPLACE (CAST(date AS DATE) AS date) FROM {source}")
+    return duck
+
+
+def backend_of(conn):
+    """Имя движка соединения из connect()"""
+    return 'sqlite' if type(conn).__module__ == 'sqlite3' else 'duckdb'
+
+
+def read_query(query, conn, params=None, name=None, cache=None):
+    """DataFrame результата запроса на соединении любого движка из BACKENDS"""
+    if backend_of(conn) == 'sqlite':
+        return read_sql(query, conn, params, cache, name)
+    with profiler.stage(f"DuckDB: {name or 'запрос'}"):
+        relation = conn.sql(query, params=params)
+        types = [str(column_type) for column_type in relation.types]
+        frame = relation.df()
+    for column, column_type in zip(frame.columns, types):
+        if column_type in _INTEGER_TYPES:
+            frame[column] = frame[column].astype(
+                'float64' if frame[column].isna().any() else 'int64')
+    return frame
+
+
+def parity_queries():
+    """Агрегаты Data_SQL.py и visual.py, которые могут выполняться на любом движке"""
+    import visual
+    from Data_SQL import AGGREGATE_QUERIES
+
+    queries = dict(AGGREGATE_QUERIES)
+    queries.update({name: query for name, query in visual.QUERIES.items()
+                    if name not in visual.ROW_QUERIES})
+    queries['age_counts'] = visual.AGE_COUNTS_QUERY
+    return queries
+
+
+def rounded_columns(query):
+    """Колонки результата вида ROUND(..., digits) as <колонка>: {колонка: digits}"""
+    columns = {}
+    for call in _ROUND_CALL.finditer(query):
+        depth = 1
+        position = call.end()
+        while depth and position < len(query):
+            depth += {'(': 1, ')': -1}.get(query[position], 0)
+            position += 1
+        # Закрывающая скобка ROUND, число знаков перед ней и псевдоним после
+        match = _ROUND_TAIL.match(query, query.rfind(',', call.end(), position))
+        if match is not None and match.end(1) < position:
+            columns[match.group(2)] = int(match.group(1))
+    return columns
+
+
+def assert_parity(actual, expected, rounded=None, rtol=PARITY_RTOL, atol=PARITY_ATOL,
+                  check_dtype=True):
+    """Сравнение кадров двух движков; AssertionError с описанием расхождения.
+
+    Колонки, типы (кроме check_dtype=False) и порядок строк должны
+    совпадать, дробные значения - с точностью rtol/atol. Колонки rounded
+    ({колонка: digits}, см. rounded_columns) могут отличаться на единицу
+    последнего знака: ROUND(x, 2) на границе половины (16.525) SQLite
+    округляет по десятичной записи числа (16.53), а DuckDB - по двоичному
+    значению (16.52); то же бывает, когда округляемая сумма сложена в другом
+    порядке и оказалась по другую сторону половины.
+    """
+    rounded = rounded or {}
+    pd.testing.assert_index_equal(actual.columns, expected.columns)
+    pd.testing.assert_frame_equal(actual.drop(columns=list(rounded)),
+                                  expected.drop(columns=list(rounded)), check_dtype=check_dtype,
+                                  check_exact=False, rtol=rtol, atol=atol)
+    for column, digits in rounded.items():
+        pd.testing.assert_series_equal(actual[column], expected[column], check_dtype=check_dtype,
+                                       check_exact=False, rtol=rtol, atol=10.0 ** -digits + atol)
+
+
+def parity(db_path, backend='duckdb', columnar_dir=None, threads=None, rtol=PARITY_RTOL,
+           atol=PARITY_ATOL):
+    """Сверка результатов SQLite и backend по parity_queries().
+
+    Возвращает {имя: (секунд SQLite, секунд backend, None или описание
+    расхождения)}. Кадры сравниваются целиком (assert_parity): колонки,
+    типы, порядок строк и значения - дробные с относительной точностью rtol
+    или абсолютной atol, колонки ROUND(..., digits) - с точностью до единицы
+    последнего знака.
+    """
+    results = {}
+    with closing(connect(db_path)) as conn, \
+            closing(connect(db_path, backend, columnar_dir, threads)) as other:
+        for name, query in parity_queries().items():
+            started = time.perf_counter()
+            expected = read_query(query, conn, name=name)
+            middle = time.perf_counter()
+            actual = read_query(query, other, name=name)
+            finished = time.perf_counter()
+            try:
+                assert_parity(actual, expected, rounded_columns(query), rtol, atol)
+                difference = None
+            except AssertionError as error:
+                difference = str(error).strip()
+            results[name] = (middle - started, finished - middle, difference)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сверка результатов SQLite и DuckDB")
+    parser.add_argument("--db", default="retail_sales.db", help="путь к базе данных SQLite")
+    parser.add_argument("--backend", choices=BACKENDS[1:], default="duckdb",
+                        help="движок, сравниваемый с SQLite")
+    parser.add_argument("--columnar-dir", default=None,
+                        help="Parquet-копия таблицы (columnar.py) для DuckDB")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="число потоков DuckDB (по умолчанию - все ядра)")
+    args = parser.parse_args(argv)
+
+    results = parity(args.db, args.backend, args.columnar_dir, args.threads)
+    print(f"{'запрос':<24} {'sqlite, с':>10} {args.backend + ', с':>10}  результат")
+    for name, (sqlite_seconds, backend_seconds, difference) in results.items():
+        status = "совпадает" if difference is None else "РАСХОЖДЕНИЕ"
+        print(f"{name:<24} {sqlite_seconds:>10.3f} {backend_seconds:>10.3f}  {status}")
+        if difference is not None:
+            print("    " + difference.replace("\n", "\n    "))
+    mismatched = [name for name, (_, _, difference) in results.items() if difference]
+    if mismatched:
+        raise SystemExit(f"Результаты различаются: {', '.join(mismatched)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""Замеры производительности расчёта отчётов.
+
+Сравнение способов расчёта агрегатов на готовой базе:
+
+    python benchmark.py engines --db retail_sales.db --repeat 5
+
+Воспроизводимый набор замеров на синтетических данных (generate_data.py):
+загрузка (без необязательных таблиц и с каждой из них), каждый именованный
+запрос Data_SQL.py, этапы visual.py. Для каждого этапа записываются время,
+пиковый RSS и строк/с в JSON, чтобы сравнивать результаты между коммитами:
+
+    python benchmark.py suite --rows 10000 100000 1000000 --out benchmark_results.json
+
+Время холодного старта: импорт модулей и подкоманды cli.py, каждый раз в
+новом процессе Python (в suite записывается для каждого размера данных):
+
+    python benchmark.py startup --db retail_sales.db --repeat 5
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+import pandas as pd
+
+from backends import assert_parity, rounded_columns
+from Data_SQL import AGGREGATE_QUERIES, aggregate_queries, filter_queries, run_aggregate_queries
+from leaderboard import TOP_CAP
+from query_cache import read_sql
+from query_runner import ConnectionPool, run_parallel
+from single_pass import compute_reports
+
+
+def _with_connection(func):
+    def run(db_path):
+        conn = sqlite3.connect(db_path)
+        try:
+            return func(conn)
+        finally:
+            conn.close()
+    return run
+
+
+def _fact_queries(conn):
+    """AGGREGATE_QUERIES по таблице фактов, без сводных таблиц"""
+    return {name: read_sql(query, conn, name=name) for name, query in AGGREGATE_QUERIES.items()}
+
+
+def _parallel(db_path):
+    with ConnectionPool(db_path) as pool:
+        with pool.connection() as conn:
+            queries = aggregate_queries(conn)
+        return run_parallel(queries, pool)
+
+
+# 'sql' и 'parallel' считают агрегаты, как Data_SQL.py: по сводным таблицам
+# rollup.py и customers.py, если они есть в базе; 'sql_fact' - исходные
+# запросы по таблице фактов, относительно них считается ускорение
+ENGINES = {
+    'sql_fact': _with_connection(_fact_queries),
+    'sql': _with_connection(run_aggregate_queries),
+    'single_pass': _with_connection(compute_reports),
+    'parallel': _parallel,
+}
+
+
+def _best_time(func, db_path, repeat):
+    """Лучшее из repeat запусков и результат последнего"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(db_path)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def compare_engines(db_path='retail_sales.db', repeat=5):
+    """Время расчёта всех агрегатов каждым способом и проверка совпадения результатов"""
+    timings = {}
+    results = {}
+    for name, func in ENGINES.items():
+        timings[name], results[name] = _best_time(func, db_path, repeat)
+
+    mismatches = []
+    for name in ENGINES:
+        for key, frame in results['sql_fact'].items():
+            try:
+                assert_parity(results[name][key], frame, rounded_columns(AGGREGATE_QUERIES[key]),
+                              check_dtype=False)
+            except AssertionError:
+                mismatches.append(f"{name}.{key}")
+    return timings, mismatches
+
+
+def _peak_rss_mb():
+    """Пиковый RSS текущего процесса в МБ (ru_maxrss - КБ в Linux, байты в macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _child(func, args, results):
+    try:
+        started = time.perf_counter()
+        value = func(*args)
+        results.put((None, time.perf_counter() - started, _peak_rss_mb(), value))
+    except BaseException:
+        # Без ответа в очереди родитель не узнал бы об ошибке
+        results.put((traceback.format_exc(), None, None, None))
+
+
+def measure(func, *args):
+    """Запуск func(*args) в отдельном процессе: время, пиковый RSS и результат.
+
+    Отдельный процесс нужен, чтобы пиковая память одного этапа не
+    учитывалась в следующих.
+    """
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_child, args=(func, args, results))
+    process.start()
+    while True:
+        try:
+            error, seconds, peak_rss_mb, value = results.get(timeout=1)
+            break
+        except queue.Empty:
+            # Процесс завершился, не ответив (например, убит из-за нехватки памяти)
+            if not process.is_alive():
+                process.join()
+                raise RuntimeError(f"Этап {func.__name__} завершился с кодом "
+                                   f"{process.exitcode} без результата") from None
+    process.join()
+    if error is not None:
+        raise RuntimeError(f"Этап {func.__name__} завершился с ошибкой:\n{error}")
+    return seconds, peak_rss_mb, value
+
+
+# Загрузка без необязательных таблиц и с каждой из них: разница во времени -
+# цена их обновления на каждой порции. Последний вариант пишет базу, на
+# которой замеряются запросы
+INGEST_VARIANTS = {
+    'load_csv_streaming': {},
+    'load --customers': {'track_customers': True},
+    'load --top-cap': {'top_cap': TOP_CAP},
+    'load --customers --top-cap': {'track_customers': True, 'top_cap': TOP_CAP},
+}
+
+
+def _ingest(csv_path, db_path, options=None):
+    from data_load import load_csv_streaming
+    return load_csv_streaming(csv_path, db_path, **(options or {}))['rows']
+
+
+def _named_query(db_path, query):
+    query, params = query if isinstance(query, tuple) else (query, None)
+    conn = sqlite3.connect(db_path)
+    try:
+        return len(pd.read_sql_query(query, conn, params=params))
+    finally:
+        conn.close()
+
+
+def _visual_stage(db_path, out_dir, stage_name):
+    """Этап visual.py вместе со всеми этапами, от которых он зависит"""
+    import visual
+    conn = sqlite3.connect(db_path)
+    data = visual.fetch_datasets(conn)
+    conn.close()
+    if stage_name == 'fetch':
+        return len(data['transactions'])
+    data = visual.derive_frames(data)
+    if stage_name == 'charts':
+        visual.render_figures(data, headless=True, force=True, out_dir=out_dir)
+    elif stage_name == 'export':
+        visual.export_excel(data, db_path, os.path.join(out_dir, 'retail_sales_analysis.xlsx'))
+    return len(data['transactions'])
+
+
+def startup_commands(db_path):
+    """Имя замера -> аргументы нового процесса Python для замера холодного старта"""
+    return {
+        'python': ['-c', 'pass'],
+        'import cli': ['-c', 'import cli'],
+        'import Data_SQL': ['-c', 'import Data_SQL'],
+        'import visual': ['-c', 'import visual'],
+        'cli query --help': ['cli.py', 'query', '--help'],
+        'cli query monthly_sales': ['cli.py', 'query', 'monthly_sales', '--db', db_path,
+                                    '--format', 'csv'],
+    }
+
+
+def cold_start(db_path='retail_sales.db', repeat=5):
+    """Лучшее из repeat время (с) каждой команды startup_commands в новом процессе"""
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    db_path = os.path.abspath(db_path)
+    timings = {}
+    for name, command in startup_commands(db_path).items():
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, *command], cwd=cwd, check=True,
+                           stdout=subprocess.DEVNULL)
+            best = min(best, time.perf_counter() - started)
+        timings[name] = best
+    return timings
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+                              ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(sizes, seed=42, work_dir=None, visual_stages=True):
+    """Замеры всех этапов для каждого размера данных; возвращает список записей"""
+    from generate_data import generate_csv
+
+    records = []
+    work_dir = work_dir or tempfile.mkdtemp(prefix="retail_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    for rows in sizes:
+        csv_path = os.path.join(work_dir, f"retail_sales_{rows}_{seed}.csv")
+        db_path = os.path.join(work_dir, f"retail_sales_{rows}.db")
+        if not os.path.exists(csv_path):
+            generate_csv(csv_path, rows, seed)
+
+        def record(stage, name, func, *args):
+            seconds, peak_rss_mb, _ = measure(func, *args)
+            records.append({
+                'rows': rows,
+                'stage': stage,
+                'name': name,
+                'seconds': round(seconds, 6),
+                'peak_rss_mb': round(peak_rss_mb, 1),
+                'rows_per_sec': round(rows / seconds, 1) if seconds > 0 else None,
+            })
+            print(f"{rows:>12} {stage:>8} {name:<26} {seconds:10.3f} с "
+                  f"{peak_rss_mb:8.1f} МБ")
+
+        for name, options in INGEST_VARIANTS.items():
+            record('ingest', name, _ingest, csv_path, db_path, options)
+
+        conn = sqlite3.connect(db_path)
+        # Те же запросы, что выполняет Data_SQL.py (лидерборды, сводные таблицы)
+        queries = {**filter_queries(conn), **aggregate_queries(conn)}
+        conn.close()
+        for name, query in queries.items():
+            record('query', name, _named_query, db_path, query)
+
+        if visual_stages:
+            for stage_name in ('fetch', 'charts', 'export'):
+                record('visual', stage_name, _visual_stage, db_path, work_dir, stage_name)
+
+        for name, seconds in cold_start(db_path, repeat=3).items():
+            records.append({'rows': rows, 'stage': 'startup', 'name': name,
+                            'seconds': round(seconds, 6), 'peak_rss_mb': None,
+                            'rows_per_sec': None})
+            print(f"{rows:>12} {'startup':>8} {name:<26} {seconds:10.3f} с")
+    return records
+
+
+def _print_engines(args):
+    timings, mismatches = compare_engines(args.db, args.repeat)
+    for name, seconds in timings.items():
+        print(f"{name:>12}: {seconds * 1000:10.1f} мс")
+    for name in ENGINES:
+        if name != 'sql_fact':
+            print(f"Ускорение {name} относительно sql_fact: "
+                  f"{timings['sql_fact'] / timings[name]:.2f}x")
+    if mismatches:
+        print(f"Результаты различаются: {', '.join(mismatches)}")
+
+
+def _print_startup(args):
+    for name, seconds in cold_start(args.db, args.repeat).items():
+        print(f"{name:>24}: {seconds * 1000:10.1f} мс")
+
+
+def _write_suite(args):
+    records = run_suite(args.rows, args.seed, args.work_dir, not args.skip_visual)
+    report = {
+        'commit': _git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': args.seed,
+        'results': records,
+    }
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены: {args.out}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры производительности")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    engines = commands.add_parser("engines", help="сравнение способов расчёта агрегатов")
+    engines.add_argument("--db", default="retail_sales.db", help="путь к базе данных SQLite")
+    engines.add_argument("--repeat", type=int, default=5, help="число повторов каждого замера")
+    engines.set_defaults(func=_print_engines)
+
+    startup = commands.add_parser("startup", help="время холодного старта модулей и cli.py")
+    startup.add_argument("--db", default="retail_sales.db", help="путь к базе данных SQLite")
+    startup.add_argument("--repeat", type=int, default=5, help="число повторов каждого замера")
+    startup.set_defaults(func=_print_startup)
+
+    suite = commands.add_parser("suite", help="замеры всех этапов на синтетических данных")
+    suite.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+                       help="размеры наборов данных (число транзакций)")
+    suite.add_argument("--seed", type=int, default=42, help="зерно генератора данных")
+    suite.add_argument("--work-dir", default=None,
+                       help="каталог для сгенерированных CSV и баз (по умолчанию временный)")
+    suite.add_argument("--skip-visual", action="store_true", help="не замерять этапы visual.py")
+    suite.add_argument("--out", default="benchmark_results.json", help="файл с результатами")
+    suite.set_defaults(func=_write_suite)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
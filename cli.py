@@ -0,0 +1,209 @@
+"""Единая точка входа: загрузка данных, отдельные отчёты, графики и Excel.
+
+    python cli.py load --csv retail_sales_dataset.csv --mode incremental
+    python cli.py query --list
+    python cli.py query monthly_sales --format csv
+    python cli.py charts --headless --format svg
+    python cli.py export --out retail_sales_analysis.xlsx
+
+Модуль импортирует только стандартную библиотеку: pandas, matplotlib,
+seaborn и openpyxl загружаются внутри подкоманд, которым они нужны, поэтому
+разбор аргументов и --help не ждут их импорта, а query не загружает
+графические библиотеки. Время холодного старта замеряет
+`python benchmark.py startup`.
+"""
+import argparse
+import sys
+
+DB_PATH = "retail_sales.db"
+QUERY_FORMATS = ('table', 'csv', 'json')
+# Совпадает с backends.BACKENDS (продублирован, чтобы не импортировать модуль)
+BACKENDS = ('sqlite', 'duckdb')
+
+
+def _load(args, rest):
+    from data_load import main as load_main
+    load_main(rest)
+
+
+def _query_names():
+    from Data_SQL import AGGREGATE_QUERIES, FILTER_QUERIES
+    return list(FILTER_QUERIES) + list(AGGREGATE_QUERIES)
+
+
+def run_named_query(conn, name, approx_distinct=False, analytic=None):
+    """Результат одного именованного запроса Data_SQL.py как DataFrame.
+
+    analytic - соединение backends.connect с колоночным движком для агрегатов.
+    """
+    from Data_SQL import AGGREGATE_QUERIES, FILTER_QUERIES, aggregate_queries, filter_queries
+    from backends import read_query
+    from query_cache import read_sql
+
+    if name in FILTER_QUERIES:
+        query, params = filter_queries(conn)[name]
+        return read_sql(query, conn, params, name=name)
+    if analytic is not None and name in AGGREGATE_QUERIES:
+        return read_query(AGGREGATE_QUERIES[name], analytic, name=name)
+    queries = aggregate_queries(conn, approx_distinct)
+    if name in queries:
+        return read_sql(queries[name], conn, name=name)
+    if approx_distinct:
+        from sketches import APPROXIMATE_REPORTS, approximate_reports
+        if name in APPROXIMATE_REPORTS:
+            return approximate_reports(conn)[name]
+    raise ValueError(f"Неизвестный запрос: {name}")
+
+
+def _query(args, rest):
+    if args.list:
+        print("\n".join(_query_names()))
+        return
+    if args.name is None:
+        raise SystemExit("Укажите имя запроса (список: cli.py query --list)")
+    if args.name not in _query_names():
+        raise SystemExit(f"Неизвестный запрос: {args.name} (список: cli.py query --list)")
+
+    from query_runner import connect_readonly
+
+    conn = connect_readonly(args.db)
+    analytic = _analytic(args)
+    try:
+        frame = run_named_query(conn, args.name, args.approx_distinct, analytic)
+    finally:
+        conn.close()
+        if analytic is not None:
+            analytic.close()
+    if args.limit is not None:
+        frame = frame.head(args.limit)
+    if args.format == 'csv':
+        frame.to_csv(sys.stdout, index=False)
+    elif args.format == 'json':
+        print(frame.to_json(orient='records', force_ascii=False, date_format='iso'))
+    else:
+        print(frame.to_string())
+
+
+def _analytic(args):
+    """Соединение с движком --backend для агрегатов или None для SQLite"""
+    if args.backend == 'sqlite':
+        return None
+    from backends import connect
+    return connect(args.db, args.backend, args.columnar_dir)
+
+
+def _datasets(args, names=None):
+    import sqlite3
+    import visual
+
+    conn = sqlite3.connect(args.db)
+    analytic = _analytic(args)
+    try:
+        data = visual.fetch_datasets(conn, args.approx_distinct,
+                                     getattr(args, 'streaming_stats', False), names, analytic)
+    finally:
+        conn.close()
+        if analytic is not None:
+            analytic.close()
+    return visual.derive_frames(data)
+
+
+def _charts(args, rest):
+    import visual
+
+    data = _datasets(args)
+    figures = visual.render_figures(data, fmt=args.format, dpi=args.dpi, headless=args.headless,
+                                    workers=args.workers, force=args.force,
+                                    out_dir=args.out_dir)
+    for name, (path, rendered) in figures.items():
+        note = "" if rendered else " (без изменений)"
+        print(f"{path} - {visual.FIGURES[name][2]}{note}")
+
+
+def _export(args, rest):
+    import visual
+
+    data = _datasets(args, visual.EXPORT_DATASETS)
+    sheets = visual.export_excel(data, args.db, args.out, overflow_format=args.overflow_format)
+    print(f"{args.out} - Все данные в Excel")
+    for sheet_name, (path, rows) in sheets.items():
+        if path != args.out:
+            print(f"   лист {sheet_name} ({rows} строк) не помещается в Excel, продолжение: {path}")
+
+
+def _add_backend_arguments(parser):
+    parser.add_argument("--backend", choices=BACKENDS, default="sqlite",
+                        help="движок агрегатов (duckdb - колоночный, на всех ядрах)")
+    parser.add_argument("--columnar-dir", default=None,
+                        help="Parquet-копия таблицы (columnar.py) для --backend duckdb")
+
+
+def build_parser():
+    # Списки вариантов совпадают с visual.FIGURE_FORMATS и report_export.OVERFLOW_FORMATS;
+    # они продублированы, чтобы разбор аргументов не импортировал эти модули
+    parser = argparse.ArgumentParser(description="Анализ розничных продаж")
+    parser.add_argument("--profile", nargs="?", const="query_profile", default=None,
+                        metavar="PATH",
+                        help="профиль запросов и этапов в PATH.txt и PATH.json (profiler.py)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    load = commands.add_parser("load", add_help=False,
+                               help="загрузка CSV в базу (аргументы data_load.py, см. load -h)")
+    load.set_defaults(func=_load, passthrough=True)
+
+    query = commands.add_parser("query", help="один именованный запрос Data_SQL.py")
+    query.add_argument("name", nargs="?", help="имя запроса")
+    query.add_argument("--list", action="store_true", help="показать имена запросов")
+    query.add_argument("--db", default=DB_PATH, help="путь к базе данных SQLite")
+    query.add_argument("--format", choices=QUERY_FORMATS, default="table",
+                       help="формат вывода")
+    query.add_argument("--limit", type=int, default=None, help="вывести только первые строки")
+    query.add_argument("--approx-distinct", action="store_true",
+                       help="уникальные покупатели по скетчам HyperLogLog")
+    _add_backend_arguments(query)
+    query.set_defaults(func=_query)
+
+    charts = commands.add_parser("charts", help="графики visual.py")
+    charts.add_argument("--db", default=DB_PATH, help="путь к базе данных SQLite")
+    charts.add_argument("--format", choices=('png', 'svg', 'pdf'), default="png",
+                        help="формат файлов с графиками")
+    charts.add_argument("--dpi", type=int, default=300, help="разрешение графиков")
+    charts.add_argument("--headless", action="store_true",
+                        help="без окон: графики строятся параллельно в фоновых процессах")
+    charts.add_argument("--workers", type=int, default=None,
+                        help="число процессов для --headless (по умолчанию - число ядер)")
+    charts.add_argument("--force", action="store_true",
+                        help="перерисовать графики, даже если данные не менялись")
+    charts.add_argument("--out-dir", default="", help="каталог для файлов с графиками")
+    charts.add_argument("--approx-distinct", action="store_true",
+                        help="уникальные покупатели по скетчам HyperLogLog")
+    charts.add_argument("--streaming-stats", action="store_true",
+                        help="корреляционная матрица за один проход, без чтения всех транзакций")
+    _add_backend_arguments(charts)
+    charts.set_defaults(func=_charts)
+
+    export = commands.add_parser("export", help="Excel-отчёт visual.py")
+    export.add_argument("--db", default=DB_PATH, help="путь к базе данных SQLite")
+    export.add_argument("--out", default="retail_sales_analysis.xlsx", help="файл книги Excel")
+    export.add_argument("--overflow-format", choices=('csv.gz', 'parquet'), default="csv.gz",
+                        help="формат выгрузки листов, не помещающихся в Excel")
+    export.add_argument("--approx-distinct", action="store_true",
+                        help="уникальные покупатели по скетчам HyperLogLog")
+    _add_backend_arguments(export)
+    export.set_defaults(func=_export)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args, rest = parser.parse_known_args(argv)
+    if rest and not getattr(args, 'passthrough', False):
+        parser.error(f"неизвестные аргументы: {' '.join(rest)}")
+    if args.profile:
+        import profiler
+        profiler.enable(args.profile)
+    args.func(args, rest)
+
+
+if __name__ == "__main__":
+    main()
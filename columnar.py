@@ -0,0 +1,208 @@
+"""Колоночная копия retail_sales для быстрой повторной загрузки.
+
+Каждая колонка хранится отдельным файлом .npy и открывается через
+np.load(mmap_mode='r') без разбора текста и без копирования: страницы
+файла читаются по требованию и делятся между процессами через кэш ОС.
+Пол, категория и customer_id кодируются словарём (коды int8/int32 плюс
+список значений в meta.json и customer_id.dict.npy), дата - числом дней
+от 1970-01-01. Если установлен pyarrow, рядом пишется retail_sales.parquet.
+Повторная выгрузка пишет файлы под временными именами и заменяет ими
+прежние (os.replace): процессы, которые уже отобразили прежние файлы в
+память, дочитывают старую версию целиком, а не частично перезаписанную.
+
+    python columnar.py --db retail_sales.db --out retail_sales_columnar
+"""
+import argparse
+import json
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+COLUMNAR_DIR = "retail_sales_columnar"
+META_FILE = "meta.json"
+PARQUET_FILE = "retail_sales.parquet"
+
+# Колонка -> dtype массива на диске
+COLUMN_TYPES = {
+    'transaction_id': np.int64,
+    'date': np.int32,
+    'customer_id': np.int32,
+    'gender': np.int8,
+    'age': np.int16,
+    'product_category': np.int8,
+    'quantity': np.int16,
+    'price_per_unit': np.float64,
+    'total_amount': np.float64,
+}
+DICTIONARY_COLUMNS = ('gender', 'product_category', 'customer_id')
+
+_EXPORT_QUERY = f"SELECT {', '.join(COLUMN_TYPES)} FROM retail_sales ORDER BY transaction_id"
+_EPOCH = np.datetime64('1970-01-01', 'D')
+
+
+def data_version(conn):
+    """Версия данных в базе: число строк, максимальный transaction_id, число
+    записанных загрузчиком строк и время последней загрузки (с миллисекундами).
+
+    Время меняется при каждой загрузке, в том числе при полной перезагрузке
+    исправленного файла с теми же ID и числом строк.
+    """
+    count, max_id = conn.execute(
+        "SELECT COUNT(*), MAX(transaction_id) FROM retail_sales").fetchone()
+    try:
+        written, loaded_at = conn.execute(
+            "SELECT SUM(rows_loaded), MAX(loaded_at) FROM load_watermark").fetchone()
+    except sqlite3.OperationalError:
+        written, loaded_at = None, None
+    return [count, max_id, written, loaded_at]
+
+
+def _encode(values, dictionary):
+    """Коды значений по словарю; новые значения дописываются в конец словаря"""
+    for value in pd.unique(values):
+        if value not in dictionary:
+            dictionary[value] = len(dictionary)
+    return values.map(dictionary).to_numpy()
+
+
+def _tmp_path(out_dir, name):
+    return os.path.join(out_dir, name + ".tmp")
+
+
+def export_columnar(db_path="retail_sales.db", out_dir=COLUMNAR_DIR, chunk_size=100_000):
+    """Потоковая выгрузка retail_sales в колоночный формат; возвращает число строк"""
+    os.makedirs(out_dir, exist_ok=True)
+    files = [f"{column}.npy" for column in COLUMN_TYPES] + ["customer_id.dict.npy"]
+    try:
+        return _export_files(db_path, out_dir, chunk_size, files)
+    except BaseException:
+        # Прежняя копия остаётся нетронутой, недописанные файлы удаляются
+        for name in files:
+            if os.path.exists(_tmp_path(out_dir, name)):
+                os.remove(_tmp_path(out_dir, name))
+        raise
+
+
+def _export_files(db_path, out_dir, chunk_size, files):
+    """Запись файлов копии под временными именами и замена ими прежних"""
+    conn = sqlite3.connect(db_path)
+    # Один снимок данных на всю выгрузку, даже если загрузчик пишет параллельно
+    conn.execute("BEGIN")
+    version = data_version(conn)
+    rows = version[0]
+
+    arrays = {
+        column: np.lib.format.open_memmap(_tmp_path(out_dir, f"{column}.npy"),
+                                          mode='w+', dtype=dtype, shape=(rows,))
+        for column, dtype in COLUMN_TYPES.items()
+    }
+    dictionaries = {column: {} for column in DICTIONARY_COLUMNS}
+    parquet_writer = None
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        pa = pq = None
+
+    start = 0
+    for chunk in pd.read_sql_query(_EXPORT_QUERY, conn, chunksize=chunk_size):
+        stop = start + len(chunk)
+        for column, array in arrays.items():
+            values = chunk[column]
+            if column == 'date':
+                values = (pd.to_datetime(values).to_numpy().astype('datetime64[D]') - _EPOCH)
+                values = values.astype(np.int64)
+            elif column in dictionaries:
+                values = _encode(values, dictionaries[column])
+            array[start:stop] = values
+        if pa is not None:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if parquet_writer is None:
+                files.append(PARQUET_FILE)
+                parquet_writer = pq.ParquetWriter(_tmp_path(out_dir, PARQUET_FILE),
+                                                  table.schema, use_dictionary=True)
+            parquet_writer.write_table(table)
+        start = stop
+    conn.close()
+    if parquet_writer is not None:
+        parquet_writer.close()
+
+    for array in arrays.values():
+        array.flush()
+    del array, arrays
+    customers = np.array(list(dictionaries['customer_id']), dtype=str)
+    with open(_tmp_path(out_dir, "customer_id.dict.npy"), 'wb') as f:
+        np.save(f, customers)
+
+    # Готовые файлы заменяют прежние целиком; meta.json пишется последним:
+    # без него каталог считается неполным, а со старым - устаревшим (is_fresh)
+    for name in files:
+        os.replace(_tmp_path(out_dir, name), os.path.join(out_dir, name))
+    meta = {
+        'rows': rows,
+        'data_version': version,
+        'columns': {column: np.dtype(dtype).name for column, dtype in COLUMN_TYPES.items()},
+        'dictionaries': {column: list(dictionaries[column]) for column in ('gender', 'product_category')},
+        'date_epoch': str(_EPOCH),
+        'parquet': PARQUET_FILE if parquet_writer is not None else None,
+    }
+    with open(_tmp_path(out_dir, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(_tmp_path(out_dir, META_FILE), os.path.join(out_dir, META_FILE))
+    return rows
+
+
+def read_meta(out_dir=COLUMNAR_DIR):
+    try:
+        with open(os.path.join(out_dir, META_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def is_fresh(out_dir, conn):
+    """Совпадает ли колоночная копия с текущими данными в базе"""
+    meta = read_meta(out_dir)
+    return meta is not None and meta['data_version'] == data_version(conn)
+
+
+def open_columnar(out_dir=COLUMNAR_DIR):
+    """Колонки как массивы, отображённые в память (без чтения файлов целиком)"""
+    return {column: np.load(os.path.join(out_dir, f"{column}.npy"), mmap_mode='r')
+            for column in COLUMN_TYPES}
+
+
+def load_frame(out_dir=COLUMNAR_DIR, columns=None):
+    """DataFrame из колоночной копии.
+
+    date возвращается как datetime64, gender и product_category -
+    строками, customer_id - целочисленными кодами словаря (для подсчёта
+    уникальных покупателей значения не нужны).
+    """
+    meta = read_meta(out_dir)
+    arrays = open_columnar(out_dir)
+    data = {}
+    for column in columns or COLUMN_TYPES:
+        values = arrays[column]
+        if column == 'date':
+            values = _EPOCH + values.astype('timedelta64[D]')
+        elif column in meta['dictionaries']:
+            values = np.asarray(meta['dictionaries'][column], dtype=object)[values]
+        data[column] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Колоночная копия retail_sales")
+    parser.add_argument("--db", default="retail_sales.db", help="путь к базе данных SQLite")
+    parser.add_argument("--out", default=COLUMNAR_DIR, help="каталог колоночной копии")
+    args = parser.parse_args(argv)
+
+    rows = export_columnar(args.db, args.out)
+    print(f"Колоночная копия: {rows} строк в {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""Состояние покупателей, поддерживаемое при загрузке.
+
+CUSTOMER_TABLE хранит по строке на customer_id: пол, наименьший и
+наибольший возраст в его транзакциях, даты первой и последней покупки,
+число транзакций, сумму покупок и число товаров; CUSTOMER_CATEGORY_TABLE -
+то же по каждой категории покупателя. Загрузчик обновляет обе таблицы по
+каждой порции из staging, как сводку rollup.py, поэтому показатели
+покупателя - поиск по первичному ключу, а отчёты RFM (давность, частота,
+сумма) и когорты по месяцу первой покупки - просмотр таблицы покупателей
+вместо GROUP BY customer_id по всем транзакциям. По ней же Data_SQL.py
+считает уникальных покупателей в age_group_comparison (COUNT(*) вместо
+COUNT(DISTINCT customer_id)), если возраст ни одного покупателя не
+переходит границу возрастной группы (single_group).
+
+Таблицы включаются при загрузке (--customers): их обновление - две
+группировки каждой порции по customer_id, заметная доля времени загрузки
+(python benchmark.py suite, этап ingest). Созданные таблицы загрузчик
+обновляет и без флага.
+
+    python data_load.py --customers
+    python customers.py show CUST00042
+    python customers.py rfm --out rfm.csv
+    python customers.py cohorts
+"""
+import argparse
+import sqlite3
+
+import pandas as pd
+
+CUSTOMER_TABLE = "retail_sales_customers"
+CUSTOMER_CATEGORY_TABLE = "retail_sales_customer_categories"
+
+CUSTOMER_DDL = f"""
+CREATE TABLE IF NOT EXISTS {CUSTOMER_TABLE} (
+    customer_id TEXT NOT NULL PRIMARY KEY,
+    gender TEXT NOT NULL,
+    min_age INTEGER NOT NULL,
+    max_age INTEGER NOT NULL,
+    first_purchase TEXT NOT NULL,
+    last_purchase TEXT NOT NULL,
+    transactions INTEGER NOT NULL,
+    total_spend REAL NOT NULL,
+    total_items INTEGER NOT NULL
+) WITHOUT ROWID
+"""
+
+CUSTOMER_CATEGORY_DDL = f"""
+CREATE TABLE IF NOT EXISTS {CUSTOMER_CATEGORY_TABLE} (
+    customer_id TEXT NOT NULL,
+    product_category TEXT NOT NULL,
+    transactions INTEGER NOT NULL,
+    total_spend REAL NOT NULL,
+    total_items INTEGER NOT NULL,
+    PRIMARY KEY (customer_id, product_category)
+) WITHOUT ROWID
+"""
+
+# Давность покупок (RFM) и когорты по месяцу первой покупки; создаются после загрузки
+CUSTOMER_INDEXES = {
+    "idx_customers_last_purchase": "last_purchase",
+    "idx_customers_first_purchase": "first_purchase",
+}
+
+# Таблица -> (ключ, SELECT показателей по строкам источника {rows}, обновление при конфликте)
+_STATE = {
+    CUSTOMER_TABLE: (
+        "customer_id",
+        """SELECT customer_id, gender, MIN(age), MAX(age), MIN(date), MAX(date),
+                  COUNT(*), SUM(total_amount), SUM(quantity)
+           FROM ({rows}) GROUP BY customer_id""",
+        """gender = CASE WHEN excluded.last_purchase >= last_purchase
+                         THEN excluded.gender ELSE gender END,
+           min_age = MIN(min_age, excluded.min_age),
+           max_age = MAX(max_age, excluded.max_age),
+           first_purchase = MIN(first_purchase, excluded.first_purchase),
+           last_purchase = MAX(last_purchase, excluded.last_purchase),
+           transactions = transactions + excluded.transactions,
+           total_spend = total_spend + excluded.total_spend,
+           total_items = total_items + excluded.total_items""",
+    ),
+    CUSTOMER_CATEGORY_TABLE: (
+        "customer_id, product_category",
+        """SELECT customer_id, product_category, COUNT(*), SUM(total_amount), SUM(quantity)
+           FROM ({rows}) GROUP BY customer_id, product_category""",
+        """transactions = transactions + excluded.transactions,
+           total_spend = total_spend + excluded.total_spend,
+           total_items = total_items + excluded.total_items""",
+    ),
+}
+
+_ROW_COLUMNS = "transaction_id, customer_id, gender, age, date, product_category, total_amount, quantity"
+
+
+def create_customers(conn, fact):
+    """Создание таблиц покупателей; для уже загруженной fact они сразу заполняются"""
+    exists = has_customers(conn)
+    conn.execute(CUSTOMER_DDL)
+    conn.execute(CUSTOMER_CATEGORY_DDL)
+    if not exists:
+        for table in _STATE:
+            _upsert(conn, table, f"SELECT {_ROW_COLUMNS} FROM {fact}")
+
+
+def create_indexes(conn):
+    """Индексы по датам покупок: после массовой загрузки, а не при каждом обновлении"""
+    for name, column in CUSTOMER_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {CUSTOMER_TABLE} ({column})")
+
+
+def has_customers(conn):
+    """Есть ли в базе таблица покупателей (базы старых загрузок её не содержат)"""
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (CUSTOMER_TABLE,)
+    ).fetchone()
+    return row is not None
+
+
+def _upsert(conn, table, rows):
+    key, select, update = _STATE[table]
+    conn.execute(f"INSERT INTO {table} {select.format(rows=rows)} "
+                 f"ON CONFLICT ({key}) DO UPDATE SET {update}")
+
+
+def apply_staging(conn, staging, fact, on_duplicate):
+    """Добавление порции из staging в состояние покупателей до её записи в fact.
+
+    Новые транзакции добавляются к состоянию. В режиме 'update'
+    покупатели, чьи транзакции заменяются (старый и новый customer_id),
+    пересчитываются по своим транзакциям в fact и staging: первую и
+    последнюю дату покупки нельзя вычесть, как суммы в rollup.py.
+    """
+    new_rows = (f"SELECT {_ROW_COLUMNS} FROM {staging} s WHERE NOT EXISTS "
+                f"(SELECT 1 FROM {fact} f WHERE f.transaction_id = s.transaction_id)")
+    for table in _STATE:
+        _upsert(conn, table, new_rows)
+    if on_duplicate == 'skip':
+        return
+
+    affected = [row[0] for row in conn.execute(f"""
+        SELECT s.customer_id FROM {staging} s JOIN {fact} f USING (transaction_id)
+        UNION
+        SELECT f.customer_id FROM {staging} s JOIN {fact} f USING (transaction_id)
+    """)]
+    if not affected:
+        return
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS affected_customers "
+                 "(customer_id TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM affected_customers")
+    conn.executemany("INSERT INTO affected_customers VALUES (?)", [(c,) for c in affected])
+    rows = f"""
+        SELECT {_ROW_COLUMNS} FROM {fact}
+        WHERE customer_id IN affected_customers
+          AND transaction_id NOT IN (SELECT transaction_id FROM {staging})
+        UNION ALL
+        SELECT {_ROW_COLUMNS} FROM {staging} WHERE customer_id IN affected_customers
+    """
+    for table in _STATE:
+        conn.execute(f"DELETE FROM {table} WHERE customer_id IN affected_customers")
+        _upsert(conn, table, rows)
+
+
+def customer(conn, customer_id):
+    """Состояние одного покупателя: (Series показателей, DataFrame по категориям) или None"""
+    cursor = conn.execute(f"SELECT * FROM {CUSTOMER_TABLE} WHERE customer_id = ?",
+                          (customer_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    state = pd.Series(row, index=[column[0] for column in cursor.description])
+    cursor = conn.execute(
+        f"SELECT product_category, transactions, total_spend, total_items "
+        f"FROM {CUSTOMER_CATEGORY_TABLE} WHERE customer_id = ? ORDER BY total_spend DESC",
+        (customer_id,))
+    categories = pd.DataFrame.from_records(
+        cursor.fetchall(), columns=[column[0] for column in cursor.description])
+    return state, categories
+
+
+def rfm(conn, as_of=None, bins=5):
+    """Давность (дней до as_of), частота и сумма покупок каждого покупателя с баллами 1..bins.
+
+    as_of - дата 'YYYY-MM-DD', по умолчанию день после последней покупки в
+    базе. Баллы - квантильные группы: 5 - недавние, частые, крупные покупатели.
+    """
+    frame = pd.read_sql_query(
+        f"SELECT customer_id, last_purchase, transactions AS frequency, "
+        f"total_spend AS monetary FROM {CUSTOMER_TABLE}", conn)
+    last = pd.to_datetime(frame.pop('last_purchase'))
+    as_of = pd.Timestamp(as_of) if as_of else last.max() + pd.Timedelta(days=1)
+    frame.insert(1, 'recency_days', (as_of - last).dt.days)
+
+    def score(values, ascending):
+        # Ранги вместо значений: квантили не ломаются на повторяющихся значениях
+        ranks = values.rank(method='first', ascending=ascending)
+        return pd.qcut(ranks, bins, labels=range(1, bins + 1)).astype(int)
+
+    if len(frame) >= bins:
+        frame['r_score'] = score(frame['recency_days'], ascending=False)
+        frame['f_score'] = score(frame['frequency'], ascending=True)
+        frame['m_score'] = score(frame['monetary'], ascending=True)
+        frame['rfm'] = (frame['r_score'].astype(str) + frame['f_score'].astype(str)
+                        + frame['m_score'].astype(str))
+    return frame
+
+
+COHORT_QUERY = f"""
+SELECT
+    substr(first_purchase, 1, 7) as cohort,
+    COUNT(*) as customers,
+    SUM(transactions > 1) as repeat_customers,
+    ROUND(100.0 * SUM(transactions > 1) / COUNT(*), 2) as repeat_percentage,
+    SUM(transactions) as transactions,
+    SUM(total_spend) as revenue,
+    ROUND(SUM(total_spend) / COUNT(*), 2) as revenue_per_customer
+FROM {CUSTOMER_TABLE}
+GROUP BY cohort
+ORDER BY cohort
+"""
+
+
+def cohorts(conn):
+    """Когорты по месяцу первой покупки: покупатели, повторные покупатели, выручка"""
+    return pd.read_sql_query(COHORT_QUERY, conn)
+
+
+def top_customers(conn, n=10):
+    """Топ-n покупателей по сумме покупок"""
+    return pd.read_sql_query(
+        f"SELECT * FROM {CUSTOMER_TABLE} ORDER BY total_spend DESC LIMIT ?", conn,
+        params=(n,))
+
+
+def single_group(conn, group_sql):
+    """Попадают ли наименьший и наибольший возраст каждого покупателя в одну группу.
+
+    group_sql - выражение SQL над колонкой age (CASE с возрастными
+    группами). Если да, число уникальных покупателей группы - число строк
+    CUSTOMER_TABLE в ней, без COUNT(DISTINCT) по транзакциям.
+    """
+    row = conn.execute(f"""
+        SELECT 1 FROM {CUSTOMER_TABLE} c
+        WHERE (SELECT {group_sql} FROM (SELECT c.min_age AS age))
+           != (SELECT {group_sql} FROM (SELECT c.max_age AS age))
+        LIMIT 1
+    """).fetchone()
+    return row is None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Показатели покупателей")
+    parser.add_argument("--db", default="retail_sales.db", help="путь к базе данных SQLite")
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("show", help="состояние одного покупателя")
+    show.add_argument("customer_id")
+    rfm_parser = commands.add_parser("rfm", help="давность, частота и сумма покупок")
+    rfm_parser.add_argument("--as-of", default=None, help="дата отсчёта давности YYYY-MM-DD")
+    rfm_parser.add_argument("--out", default=None, help="сохранить в CSV")
+    commands.add_parser("cohorts", help="когорты по месяцу первой покупки")
+    top = commands.add_parser("top", help="покупатели с наибольшей суммой покупок")
+    top.add_argument("-n", type=int, default=10, help="число покупателей")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        if not has_customers(conn):
+            raise SystemExit("В базе нет таблицы покупателей: загрузите данные с "
+                             "data_load.py --customers")
+        if args.command == 'show':
+            result = customer(conn, args.customer_id)
+            if result is None:
+                raise SystemExit(f"Покупатель не найден: {args.customer_id}")
+            state, categories = result
+            print(state.to_string())
+            print(categories.to_string(index=False))
+        elif args.command == 'rfm':
+            frame = rfm(conn, args.as_of)
+            if args.out:
+                frame.to_csv(args.out, index=False)
+                print(f"RFM для {len(frame)} покупателей сохранён: {args.out}")
+            else:
+                print(frame)
+        elif args.command == 'cohorts':
+            print(cohorts(conn).to_string(index=False))
+        else:
+            print(top_customers(conn, args.n).to_string(index=False))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,374 @@
+import argparse
+import csv
+import hashlib
+import os
 import sqlite3
+import time
+
 import pandas as pd
-import os
 
-# Загружаем данные из CSV
-df = pd.read_csv("retail_sales_dataset.csv")
-print(f"Загружено {len(df)} записей из CSV")
+import columnar
+import customers
+import leaderboard
+import rollup
+import sketches
+from schema import COLUMNS, INDEXES, KEY_COLUMN, SCHEMA, TABLE_NAME
+
+CSV_PATH = "retail_sales_dataset.csv"
+DB_PATH = "retail_sales.db"
+# Временная таблица, через которую каждая порция попадает в retail_sales,
+# в сводную таблицу rollup.ROLLUP_TABLE, в состояние покупателей customers.py
+# и в лидерборды leaderboard.py
+STAGING_TABLE = "staging_retail_sales"
+WATERMARK_TABLE = "load_watermark"
+# Отпечаток прочитанной части файла хранится рядом с водяным знаком:
+# SHA-256 первых и последних FINGERPRINT_BYTES байт до смещения. Если файл
+# на том же пути переписан, отпечаток не совпадает и файл читается с начала
+FINGERPRINT_BYTES = 1 << 20
+
+# Размер порции при потоковом чтении CSV: пиковая память определяется им,
+# а не размером файла
+CHUNK_SIZE = 100_000
+
+# PRAGMA для массовой загрузки: журнал WAL, без fsync на каждую запись,
+# временные структуры в памяти и увеличенный кэш страниц (~256 МБ)
+LOADER_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -262144",
+)
+
+
+def _create_table(conn, table, temp=False):
+    """Создание таблицы по явной схеме SCHEMA"""
+    columns = ",\n    ".join(f"{column} {sql_type}" for column, sql_type, _ in SCHEMA.values())
+    kind = "TEMP TABLE" if temp else "TABLE"
+    conn.execute(f'CREATE {kind} IF NOT EXISTS "{table}" (\n    {columns}\n)')
+
+
+def _create_indexes(conn, table):
+    """Индексы создаются после массовой вставки: так быстрее, чем поддерживать их построчно"""
+    for name, columns in INDEXES.items():
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON "{table}" ({", ".join(columns)})')
+    conn.execute(f'ANALYZE "{table}"')
+
+
+def _normalize_chunk(chunk):
+    """Приведение порции CSV к схеме: snake_case имена, типы, даты ISO"""
+    chunk = chunk.rename(columns={name: column for name, (column, _, _) in SCHEMA.items()})
+    chunk['date'] = pd.to_datetime(chunk['date']).dt.strftime('%Y-%m-%d').astype(object)
+    return chunk[COLUMNS]
+
+
+def _staging_insert_sql(on_duplicate):
+    """INSERT порции в staging; повтор ключа внутри порции решается так же, как в таблице"""
+    names = ", ".join(COLUMNS)
+    placeholders = ", ".join("?" * len(COLUMNS))
+    if on_duplicate == 'skip':
+        return f"INSERT OR IGNORE INTO {STAGING_TABLE} ({names}) VALUES ({placeholders})"
+    return f"INSERT OR REPLACE INTO {STAGING_TABLE} ({names}) VALUES ({placeholders})"
+
+
+def _merge_sql(table, on_duplicate):
+    """Перенос staging в таблицу: дубликаты по ключу пропускаются или обновляются"""
+    names = ", ".join(COLUMNS)
+    select = f"SELECT {names} FROM {STAGING_TABLE} WHERE true"
+    if on_duplicate == 'skip':
+        return f'INSERT OR IGNORE INTO "{table}" ({names}) {select}'
+    updates = ", ".join(f"{name} = excluded.{name}" for name in COLUMNS if name != KEY_COLUMN)
+    return (f'INSERT INTO "{table}" ({names}) {select} '
+            f'ON CONFLICT({KEY_COLUMN}) DO UPDATE SET {updates}')
+
+
+def _read_watermark(conn, source):
+    """Смещение в байтах и отпечаток прочитанной части файла прошлой загрузки"""
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+            source TEXT PRIMARY KEY,
+            byte_offset INTEGER NOT NULL,
+            fingerprint TEXT,
+            rows_loaded INTEGER NOT NULL,
+            loaded_at TEXT NOT NULL
+        )
+    """)
+    columns = {name for (name,) in conn.execute(
+        f"SELECT name FROM pragma_table_info('{WATERMARK_TABLE}')")}
+    if "fingerprint" not in columns:
+        # База старой загрузки: без отпечатка смещению нельзя доверять
+        conn.execute(f"ALTER TABLE {WATERMARK_TABLE} ADD COLUMN fingerprint TEXT")
+    row = conn.execute(
+        f"SELECT byte_offset, fingerprint FROM {WATERMARK_TABLE} WHERE source = ?",
+        (source,),
+    ).fetchone()
+    return row if row else (0, None)
+
+
+def _write_watermark(conn, source, byte_offset, fingerprint, rows):
+    conn.execute(f"""
+        INSERT INTO {WATERMARK_TABLE} (source, byte_offset, fingerprint, rows_loaded, loaded_at)
+        VALUES (?, ?, ?, ?, strftime('%Y-%m-%d %H:%M:%f', 'now'))
+        ON CONFLICT(source) DO UPDATE SET
+            byte_offset = excluded.byte_offset,
+            fingerprint = excluded.fingerprint,
+            rows_loaded = rows_loaded + excluded.rows_loaded,
+            loaded_at = excluded.loaded_at
+    """, (source, byte_offset, fingerprint, rows))
+
+
+def _fingerprint(f, offset):
+    """SHA-256 первых и последних FINGERPRINT_BYTES байт файла до смещения offset"""
+    digest = hashlib.sha256(str(offset).encode())
+    f.seek(0)
+    digest.update(f.read(min(offset, FINGERPRINT_BYTES)))
+    tail = max(offset - FINGERPRINT_BYTES, FINGERPRINT_BYTES)
+    if tail < offset:
+        f.seek(tail)
+        digest.update(f.read(offset - tail))
+    f.seek(0)
+    return digest.hexdigest()
+
+
+def _iter_chunks(f, offset, chunk_size, dtype=None):
+    """Порции CSV начиная с байтового смещения offset.
+
+    При offset > 0 заголовок берётся из первой строки файла, а чтение
+    продолжается с места, где остановилась прошлая загрузка. dtype - типы
+    колонок для pd.read_csv, по умолчанию из SCHEMA.
+    """
+    if dtype is None:
+        dtype = {name: pandas_type for name, (_, _, pandas_type) in SCHEMA.items()}
+    if offset == 0:
+        return pd.read_csv(f, dtype=dtype, chunksize=chunk_size)
+    header = next(csv.reader([f.readline().decode('utf-8-sig')]))
+    f.seek(offset)
+    return pd.read_csv(f, header=None, names=header, dtype=dtype, chunksize=chunk_size)
+
+
+def load_csv_streaming(csv_path=CSV_PATH, db_path=DB_PATH, table=TABLE_NAME,
+                       chunk_size=CHUNK_SIZE, mode='full', on_duplicate='skip',
+                       partition_dir=None, sketch_error=None, validate=True, top_cap=None,
+                       track_customers=False):
+    """Потоковая загрузка CSV в SQLite порциями по chunk_size строк.
+
+    Каждая порция вставляется через executemany, вся загрузка идёт в одной
+    транзакции. В режиме 'full' база пересоздаётся, в режиме 'incremental'
+    читается только часть файла после сохранённого водяного знака (если
+    прочитанная часть с тех пор изменилась, файл читается с начала), а строки
+    с уже известным Transaction ID пропускаются (on_duplicate='skip') или
+    обновляются (on_duplicate='update'). Если задан partition_dir, те же
+    строки пишутся и в месячные партиции (partitions.py). sketch_error -
+    допустимая ошибка скетчей уникальных покупателей (sketches.py); если
+    скетчи в базе уже есть, они дополняются и без этого параметра.
+    validate - каждая порция проверяется правилами validation.RULES, а
+    отбракованные строки пишутся в карантин (validation.QUARANTINE_TABLE).
+    top_cap - вести лидерборды (leaderboard.py) с top_cap лучшими
+    транзакциями каждого сегмента; если они в базе уже есть, они
+    обновляются и без этого параметра (другое значение перестраивает их).
+    track_customers - вести таблицы покупателей (customers.py); если они в
+    базе уже есть, они обновляются и без этого параметра.
+    Возвращает словарь со статистикой.
+    """
+    if mode not in ('full', 'incremental'):
+        raise ValueError(f"Неизвестный режим загрузки: {mode}")
+    if on_duplicate not in ('skip', 'update'):
+        raise ValueError(f"Неизвестный режим обработки дубликатов: {on_duplicate}")
+    if mode == 'full' and os.path.exists(db_path):
+        os.remove(db_path)
+    partition_writer = None
+    if partition_dir:
+        import partitions
+        if mode == 'full':
+            for path in partitions.partition_paths(partition_dir).values():
+                os.remove(path)
+        partition_writer = partitions.PartitionWriter(partition_dir, on_duplicate)
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    for pragma in LOADER_PRAGMAS:
+        conn.execute(pragma)
+    replayed = []
+    if partition_writer is not None:
+        # Партиции, отставшие от базы после загрузки, прерванной между коммитами
+        replayed = partitions.replay(conn, partition_dir)
+
+    source = os.path.abspath(csv_path)
+    validator = None
+    restarted = False
+    rows = 0
+    chunks = 0
+    started = time.perf_counter()
+    conn.execute("BEGIN")
+    try:
+        offset, fingerprint = _read_watermark(conn, source)
+        _create_table(conn, table)
+        _create_table(conn, STAGING_TABLE, temp=True)
+        rollup.create_rollup(conn)
+        track_customers = track_customers or customers.has_customers(conn)
+        if track_customers:
+            customers.create_customers(conn, table)
+        track_leaderboard = top_cap is not None or leaderboard.leaderboard_cap(conn) is not None
+        if track_leaderboard:
+            leaderboard.create_leaderboard(conn, table, top_cap)
+        sketch_builder = None
+        if sketch_error is not None or sketches.has_sketches(conn):
+            precision = sketches.precision_for_error(sketch_error) if sketch_error else None
+            if not sketches.has_sketches(conn):
+                # Скетчи включаются для уже загруженных данных: сначала строим их по таблице
+                sketches.build_sketches(conn, precision)
+            sketch_builder = sketches.SketchBuilder(conn, precision)
+        dtype = None
+        if validate:
+            import validation
+            validator = validation.ChunkValidator(conn, source)
+            dtype = validation.read_dtypes()
+        staging_sql = _staging_insert_sql(on_duplicate)
+        merge_sql = _merge_sql(table, on_duplicate)
+        written = 0
+
+        with open(csv_path, 'rb') as f:
+            if offset and _fingerprint(f, offset) != fingerprint:
+                # Файл на этом пути заменён или переписан: читаем его
+                # заново, повторы отсекаются первичным ключом
+                offset = 0
+                restarted = True
+            for chunk in _iter_chunks(f, offset, chunk_size, dtype):
+                rows += len(chunk)
+                if validator is not None:
+                    chunk = validator.check(conn, chunk)
+                else:
+                    chunk = _normalize_chunk(chunk)
+                conn.execute(f"DELETE FROM {STAGING_TABLE}")
+                conn.executemany(staging_sql, chunk.itertuples(index=False, name=None))
+                if partition_writer is not None:
+                    # До слияния: партициям нужен месяц, под которым строка уже загружена
+                    partition_writer.write(
+                        chunk, partitions.stored_months(conn, STAGING_TABLE, table))
+                rollup.apply_staging(conn, STAGING_TABLE, table, on_duplicate)
+                if track_customers:
+                    customers.apply_staging(conn, STAGING_TABLE, table, on_duplicate)
+                if track_leaderboard:
+                    leaderboard.apply_staging(conn, STAGING_TABLE, table, on_duplicate)
+                if sketch_builder is not None:
+                    sketch_builder.add_staging(conn, STAGING_TABLE, table, on_duplicate)
+                written += conn.execute(merge_sql).rowcount
+                chunks += 1
+            offset = f.tell()
+            fingerprint = _fingerprint(f, offset)
+
+        if sketch_builder is not None:
+            sketch_builder.flush(conn)
+        _create_indexes(conn, table)
+        if track_customers:
+            customers.create_indexes(conn)
+        _write_watermark(conn, source, offset, fingerprint, written)
+        if partition_writer is not None:
+            load_id = partitions.expect(conn, partition_writer.months())
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        if partition_writer is not None:
+            partition_writer.rollback()
+        raise
+    finally:
+        conn.close()
+
+    if partition_writer is not None:
+        partition_writer.commit(load_id)
+    elapsed = time.perf_counter() - started
+    return {
+        'mode': mode,
+        'rows': rows,
+        'written': written,
+        'chunks': chunks,
+        'byte_offset': offset,
+        'restarted': restarted,
+        'partitions_replayed': replayed,
+        'validation': validator.report() if validator is not None else None,
+        'seconds': elapsed,
+        'rows_per_sec': rows / elapsed if elapsed > 0 else float('inf'),
+    }
+
+
+def print_table_summary(db_path=DB_PATH, table=TABLE_NAME):
+    """Вывод структуры таблицы, числа записей и примеров данных"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT name, type FROM pragma_table_info('{table}')")
+    columns = cursor.fetchall()
+
+    print(f"\nСоздана таблица {table} с колонками:")
+    for col in columns:
+        print(f"  - {col[0]}: {col[1]}")
+
+    cursor.execute(f'SELECT COUNT(*) FROM "{table}"')
+    count = cursor.fetchone()[0]
+    print(f"\nИмпортировано записей: {count}")
+
+    # Показываем пример данных
+    cursor.execute(f'SELECT * FROM "{table}" LIMIT 3')
+    samples = cursor.fetchall()
+    print("\nПримеры данных:")
+    for sample in samples:
+        print(sample)
 
-# Создаем базу данных
-db_path = "retail_sales.db"
-if os.path.exists(db_path):
-    os.remove(db_path)
+    conn.close()
 
-conn = sqlite3.connect(db_path)
 
-# Сохраняем DataFrame в SQLite таблицу
-# pandas автоматически определит типы данных
-df.to_sql('retail_sales', conn, if_exists='replace', index=False)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Загрузка CSV с продажами в SQLite")
+    parser.add_argument("--csv", default=CSV_PATH, help="путь к CSV файлу")
+    parser.add_argument("--db", default=DB_PATH, help="путь к базе данных SQLite")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="число строк в одной порции")
+    parser.add_argument("--mode", choices=("full", "incremental"), default="full",
+                        help="full - пересоздать базу, incremental - дописать новые строки")
+    parser.add_argument("--on-duplicate", choices=("skip", "update"), default="skip",
+                        help="что делать со строками с уже загруженным Transaction ID")
+    parser.add_argument("--columnar", nargs="?", const=columnar.COLUMNAR_DIR, default=None,
+                        metavar="DIR",
+                        help="также записать колоночную копию таблицы (по умолчанию в "
+                             f"{columnar.COLUMNAR_DIR})")
+    parser.add_argument("--partitions", default=None, metavar="DIR",
+                        help="также писать строки в месячные партиции (partitions.py)")
+    parser.add_argument("--sketch-error", type=float, default=None, metavar="ERROR",
+                        help="строить скетчи уникальных покупателей с относительной "
+                             "ошибкой ERROR, например 0.02 (sketches.py)")
+    parser.add_argument("--top-cap", type=int, nargs="?", const=leaderboard.TOP_CAP,
+                        default=None, metavar="N",
+                        help="вести лидерборды топ-N транзакций каждого сегмента "
+                             f"(leaderboard.py, по умолчанию N = {leaderboard.TOP_CAP})")
+    parser.add_argument("--customers", dest="track_customers", action="store_true",
+                        help="вести таблицы покупателей для поиска, RFM и когорт (customers.py)")
+    parser.add_argument("--no-validate", dest="validate", action="store_false",
+                        help="не проверять строки (validation.py) перед записью")
+    args = parser.parse_args(argv)
 
-# Проверяем результат
-cursor = conn.cursor()
-cursor.execute("SELECT name, type FROM pragma_table_info('retail_sales')")
-columns = cursor.fetchall()
+    stats = load_csv_streaming(args.csv, args.db, chunk_size=args.chunk_size,
+                               mode=args.mode, on_duplicate=args.on_duplicate,
+                               partition_dir=args.partitions,
+                               sketch_error=args.sketch_error, validate=args.validate,
+                               top_cap=args.top_cap, track_customers=args.track_customers)
+    if stats['partitions_replayed']:
+        print(f"Партиции догнали базу после прерванной загрузки: "
+              f"{', '.join(stats['partitions_replayed'])}")
+    if stats['restarted']:
+        print("Файл изменился после прошлой загрузки: он прочитан с начала")
+    print(f"Загружено {stats['rows']} записей из CSV "
+          f"({stats['chunks']} порций, {stats['seconds']:.2f} с, "
+          f"{stats['rows_per_sec']:,.0f} строк/с)")
+    print(f"Записано/обновлено строк: {stats['written']}, "
+          f"водяной знак: байт {stats['byte_offset']}")
+    if stats['validation'] is not None:
+        from validation import format_report
+        print(format_report(stats['validation']))
 
-print("\nСоздана таблица retail_sales с колонками:")
-for col in columns:
-    print(f"  - {col[0]}: {col[1]}")
+    if args.columnar:
+        rows = columnar.export_columnar(args.db, args.columnar, chunk_size=args.chunk_size)
+        print(f"Колоночная копия: {rows} строк в {args.columnar}")
 
-cursor.execute("SELECT COUNT(*) FROM retail_sales")
-count = cursor.fetchone()[0]
-print(f"\nИмпортировано записей: {count}")
+    print_table_summary(args.db)
+    print(f"\nБаза данных сохранена: {args.db}")
 
-# Показываем пример данных
-cursor.execute("SELECT * FROM retail_sales LIMIT 3")
-samples = cursor.fetchall()
-print("\nПримеры данных:")
-for sample in samples:
-    print(sample)
 
-conn.close()
-print(f"\nБаза данных сохранена: {db_path}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
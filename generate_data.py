@@ -0,0 +1,88 @@
+"""Генератор синтетических данных о продажах в формате retail_sales_dataset.csv.
+
+Данные генерируются порциями, поэтому память не зависит от числа строк
+(от 10^4 до 10^8). При одинаковых seed и rows файл получается одинаковым.
+Распределения повторяют исходный датасет: пол примерно 50/50, возраст
+18-64, три категории, 1-4 единицы товара по цене 25/30/50/300/500, даты
+2023-2024. Покупатели повторяются: часть из них совершает много покупок,
+а пол и возраст покупателя одинаковы во всех его транзакциях.
+
+    python generate_data.py --rows 1000000 --out retail_sales_1m.csv
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+HEADER = ["Transaction ID", "Date", "Customer ID", "Gender", "Age", "Product Category",
+          "Quantity", "Price per Unit", "Total Amount"]
+
+CATEGORIES = np.array(['Clothing', 'Electronics', 'Beauty'], dtype=object)
+CATEGORY_WEIGHTS = [0.351, 0.342, 0.307]
+PRICES = np.array([25, 30, 50, 300, 500])
+PRICE_WEIGHTS = [0.21, 0.19, 0.21, 0.19, 0.20]
+GENDERS = np.array(['Male', 'Female'], dtype=object)
+START_DATE = np.datetime64('2023-01-01')
+DAYS = 731  # 2023-01-01 .. 2024-12-31
+
+# В среднем транзакций на одного покупателя
+TRANSACTIONS_PER_CUSTOMER = 3
+CHUNK_SIZE = 1_000_000
+
+
+def _mix(values, salt):
+    """Детерминированное перемешивание целых (splitmix64) для атрибутов покупателя"""
+    x = values.astype(np.uint64) + np.uint64(salt)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def generate_chunk(rng, first_id, size, customers, id_width):
+    """Порция из size транзакций с номерами от first_id"""
+    # Квадрат равномерной величины смещает выбор к первым покупателям:
+    # они становятся постоянными клиентами с большим числом покупок
+    customer = (customers * rng.random(size) ** 2).astype(np.int64) + 1
+    quantity = rng.integers(1, 5, size)
+    price = rng.choice(PRICES, size, p=PRICE_WEIGHTS)
+    dates = START_DATE + rng.integers(0, DAYS, size).astype('timedelta64[D]')
+    return pd.DataFrame({
+        "Transaction ID": np.arange(first_id, first_id + size),
+        "Date": dates.astype(str),
+        "Customer ID": 'CUST' + pd.Series(customer).astype(str).str.zfill(id_width),
+        "Gender": GENDERS[(_mix(customer, 1) % np.uint64(2)).astype(np.int64)],
+        "Age": 18 + (_mix(customer, 2) % np.uint64(47)).astype(np.int64),
+        "Product Category": rng.choice(CATEGORIES, size, p=CATEGORY_WEIGHTS),
+        "Quantity": quantity,
+        "Price per Unit": price,
+        "Total Amount": quantity * price,
+    })
+
+
+def generate_csv(path, rows, seed=42, chunk_size=CHUNK_SIZE):
+    """Запись rows синтетических транзакций в CSV"""
+    rng = np.random.default_rng(seed)
+    customers = max(1, rows // TRANSACTIONS_PER_CUSTOMER)
+    id_width = max(3, len(str(customers)))
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        f.write(",".join(HEADER) + "\n")
+        for start in range(0, rows, chunk_size):
+            size = min(chunk_size, rows - start)
+            chunk = generate_chunk(rng, start + 1, size, customers, id_width)
+            chunk.to_csv(f, header=False, index=False)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Синтетические данные о продажах")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="число транзакций")
+    parser.add_argument("--seed", type=int, default=42, help="зерно генератора")
+    parser.add_argument("--out", default=None, help="путь к CSV (по умолчанию retail_sales_<rows>.csv)")
+    args = parser.parse_args(argv)
+
+    path = generate_csv(args.out or f"retail_sales_{args.rows}.csv", args.rows, args.seed)
+    print(f"Сгенерировано {args.rows} транзакций: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""Лидерборды: транзакции с наибольшей суммой в каждом сегменте, поддерживаемые при загрузке.
+
+Сегмент - (пол, возраст, категория). Возраст хранится точным значением, как
+в сводке rollup.py, поэтому из сегментов собирается любой фильтр по
+диапазону возраста. LEADERBOARD_TABLE хранит для каждого сегмента до cap
+транзакций с наибольшей суммой (при равной сумме - с меньшим
+transaction_id) и их место rank; загрузчик обновляет таблицу по каждой
+порции из staging. Топ-n при n <= cap с фильтрами по полу, возрасту,
+категории и порогу суммы (top_query) читает только места rank <= n - не
+больше n строк на сегмент, сколько бы транзакций ни подходило под фильтр, -
+и берёт из retail_sales n строк по первичному ключу. Сегментов по месяцу
+было бы больше, чем транзакций в месяце, поэтому топ-n за период
+по-прежнему считается по таблице фактов.
+
+Лидерборды включаются при загрузке (--top-cap): пока сегменты не
+заполнены, почти каждая строка порции попадает в ранжирование, и
+обновление занимает заметную долю времени загрузки (python benchmark.py
+suite, этап ingest); в заполненный сегмент проходят только строки лучше
+места cap. Созданные лидерборды загрузчик обновляет и без флага.
+
+    python data_load.py --top-cap
+    python leaderboard.py --gender Female --min-age 31 -n 10
+"""
+import argparse
+import sqlite3
+
+LEADERBOARD_TABLE = "retail_sales_leaderboard"
+SETTINGS_TABLE = "retail_sales_leaderboard_settings"
+
+# Наибольшее n, на которое отвечают лидерборды (по умолчанию)
+TOP_CAP = 100
+
+LEADERBOARD_DDL = f"""
+CREATE TABLE IF NOT EXISTS {LEADERBOARD_TABLE} (
+    rank INTEGER NOT NULL,
+    gender TEXT NOT NULL,
+    age INTEGER NOT NULL,
+    product_category TEXT NOT NULL,
+    total_amount REAL NOT NULL,
+    transaction_id INTEGER NOT NULL,
+    PRIMARY KEY (rank, gender, age, product_category)
+) WITHOUT ROWID
+"""
+
+SETTINGS_DDL = f"CREATE TABLE IF NOT EXISTS {SETTINGS_TABLE} (cap INTEGER NOT NULL)"
+
+_SEGMENT = "gender, age, product_category"
+
+# Фильтры queries.FILTERS, которые проверяются по самим лидербордам
+FILTERS = {
+    'gender': "t.gender = :gender",
+    'category': "t.product_category = :category",
+    'min_age': "t.age >= :min_age",
+    'max_age': "t.age <= :max_age",
+    'amount_above': "t.total_amount > :amount_above",
+}
+
+
+def _ranked(rows, cap):
+    """Первые cap строк каждого сегмента из {rows} с их местами"""
+    return f"""
+        SELECT rank, {_SEGMENT}, total_amount, transaction_id FROM (
+            SELECT {_SEGMENT}, total_amount, transaction_id,
+                   ROW_NUMBER() OVER (PARTITION BY {_SEGMENT}
+                                      ORDER BY total_amount DESC, transaction_id) AS rank
+            FROM ({rows})
+        )
+        WHERE rank <= {int(cap)}
+    """
+
+
+def leaderboard_cap(conn):
+    """cap лидербордов в базе или None, если их нет (базы старых загрузок)"""
+    try:
+        row = conn.execute(f"SELECT cap FROM {SETTINGS_TABLE}").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row is not None else None
+
+
+def create_leaderboard(conn, fact, cap=None):
+    """Создание лидербордов; для уже загруженной fact и при смене cap они строятся заново"""
+    current = leaderboard_cap(conn)
+    if current is not None and cap in (None, current):
+        return
+    cap = cap or TOP_CAP
+    conn.execute(LEADERBOARD_DDL)
+    conn.execute(SETTINGS_DDL)
+    conn.execute(f"DELETE FROM {SETTINGS_TABLE}")
+    conn.execute(f"INSERT INTO {SETTINGS_TABLE} (cap) VALUES (?)", (cap,))
+    conn.execute(f"DELETE FROM {LEADERBOARD_TABLE}")
+    conn.execute(f"INSERT INTO {LEADERBOARD_TABLE} "
+                 + _ranked(f"SELECT {_SEGMENT}, total_amount, transaction_id FROM {fact}", cap))
+
+
+def apply_staging(conn, staging, fact, on_duplicate):
+    """Обновление лидербордов порцией из staging до её записи в fact.
+
+    Кандидаты сегмента - новые строки, которые попадают в первые cap, и
+    прежние места, кроме заменяемых строк; места затронутого сегмента
+    занимают первые cap кандидатов.
+    В режиме 'update' сегменты, из которых уходит старая версия
+    заменяемой строки, заполняются заново из fact: освободившееся место
+    может занять строка, которая раньше в лидерборд не входила.
+    """
+    cap = leaderboard_cap(conn)
+    if cap is None:
+        return
+    conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS leaderboard_candidates "
+                 f"({_SEGMENT}, total_amount, transaction_id)")
+    conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS leaderboard_refill "
+                 f"({_SEGMENT}, PRIMARY KEY ({_SEGMENT}))")
+    conn.execute("DELETE FROM leaderboard_candidates")
+    conn.execute("DELETE FROM leaderboard_refill")
+
+    # Заменяемые строки (режим 'update') остаются кандидатами только в новой версии
+    kept = "true"
+    if on_duplicate != 'skip':
+        kept = f"transaction_id NOT IN (SELECT transaction_id FROM {staging})"
+        conn.execute(f"""
+            INSERT OR IGNORE INTO leaderboard_refill
+            SELECT {_SEGMENT} FROM {LEADERBOARD_TABLE}
+            WHERE transaction_id IN (SELECT transaction_id FROM {staging})
+        """)
+        conn.execute(f"""
+            INSERT INTO leaderboard_candidates
+            SELECT {_SEGMENT}, total_amount, transaction_id FROM {fact}
+            WHERE ({_SEGMENT}) IN (SELECT {_SEGMENT} FROM leaderboard_refill) AND {kept}
+        """)
+
+    # Новая строка - кандидат, только если её сегмент не заполнен или она
+    # лучше строки на месте cap (поиск по первичному ключу лидербордов);
+    # в сегментах, заполняемых заново, строка на месте cap может уйти
+    new_rows = f"""
+        SELECT {_SEGMENT}, total_amount, transaction_id FROM {staging} s
+        WHERE (NOT EXISTS (
+            SELECT 1 FROM {LEADERBOARD_TABLE} t
+            WHERE t.rank = {int(cap)} AND t.gender = s.gender AND t.age = s.age
+              AND t.product_category = s.product_category
+              AND (t.total_amount > s.total_amount
+                   OR (t.total_amount = s.total_amount AND t.transaction_id < s.transaction_id)))
+          OR ({_SEGMENT}) IN (SELECT {_SEGMENT} FROM leaderboard_refill))
+    """
+    if on_duplicate == 'skip':
+        new_rows += (f" AND NOT EXISTS "
+                     f"(SELECT 1 FROM {fact} f WHERE f.transaction_id = s.transaction_id)")
+    conn.execute(f"INSERT INTO leaderboard_candidates {new_rows}")
+
+    touched = (f"SELECT {_SEGMENT} FROM leaderboard_candidates "
+               f"UNION SELECT {_SEGMENT} FROM leaderboard_refill")
+    conn.execute(f"""
+        INSERT INTO leaderboard_candidates
+        SELECT {_SEGMENT}, total_amount, transaction_id FROM {LEADERBOARD_TABLE}
+        WHERE ({_SEGMENT}) IN ({touched})
+          AND ({_SEGMENT}) NOT IN (SELECT {_SEGMENT} FROM leaderboard_refill)
+          AND {kept}
+    """)
+    # Сегменты, заполняемые заново, могли стать короче: их места пишутся с нуля
+    conn.execute(f"DELETE FROM {LEADERBOARD_TABLE} "
+                 f"WHERE ({_SEGMENT}) IN (SELECT {_SEGMENT} FROM leaderboard_refill)")
+    # Остальные места переписываются на месте: строки, чьё место не изменилось, не трогаются
+    conn.execute(f"""
+        INSERT INTO {LEADERBOARD_TABLE} {_ranked("SELECT * FROM leaderboard_candidates", cap)}
+        ON CONFLICT (rank, {_SEGMENT}) DO UPDATE SET
+            total_amount = excluded.total_amount,
+            transaction_id = excluded.transaction_id
+        WHERE transaction_id != excluded.transaction_id
+    """)
+
+
+def covers(conn, n, filters):
+    """Отвечают ли лидерборды базы на топ-n с такими фильтрами"""
+    used = {name for name, value in filters.items() if value is not None}
+    if n is None or used - set(FILTERS):
+        return False
+    cap = leaderboard_cap(conn)
+    return cap is not None and n <= cap
+
+
+def top_query(columns, n, fact, **filters):
+    """SQL и параметры топ-n транзакций fact по сумме из лидербордов: (sql, params).
+
+    Порядок строк тот же, что у queries.sales_query(order_by='amount').
+    """
+    params = {name: value for name, value in filters.items() if value is not None}
+    conditions = ["t.rank <= :limit"] + [FILTERS[name] for name in FILTERS if name in params]
+    params['limit'] = n
+    select = ", ".join(f"f.{column} AS {column}" for column in columns)
+    sql = (f"SELECT {select}\nFROM {LEADERBOARD_TABLE} t JOIN {fact} f USING (transaction_id)"
+           f"\nWHERE {' AND '.join(conditions)}"
+           f"\nORDER BY t.total_amount DESC, t.transaction_id\nLIMIT :limit")
+    return sql, params
+
+
+def main(argv=None):
+    from queries import top_sales
+
+    parser = argparse.ArgumentParser(description="Топ транзакций по сумме из лидербордов")
+    parser.add_argument("--db", default="retail_sales.db", help="путь к базе данных SQLite")
+    parser.add_argument("-n", type=int, default=10, help="число транзакций")
+    parser.add_argument("--gender", default=None, help="пол: Male или Female")
+    parser.add_argument("--category", default=None, help="категория товара")
+    parser.add_argument("--min-age", type=int, default=None, help="возраст от (включительно)")
+    parser.add_argument("--max-age", type=int, default=None, help="возраст до (включительно)")
+    parser.add_argument("--amount-above", type=float, default=None,
+                        help="только суммы больше порога")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        filters = {'gender': args.gender, 'category': args.category, 'min_age': args.min_age,
+                   'max_age': args.max_age, 'amount_above': args.amount_above}
+        if leaderboard_cap(conn) is None:
+            print("В базе нет лидербордов (data_load.py --top-cap): "
+                  "топ считается по таблице транзакций")
+        elif not covers(conn, args.n, filters):
+            print(f"Лидерборды не покрывают запрос (cap {leaderboard_cap(conn)}): "
+                  f"топ считается по таблице транзакций")
+        print(top_sales(conn, args.n, **filters).to_string(index=False))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,511 @@
+"""Хранение retail_sales по месяцам: один файл SQLite на месяц.
+
+Каталог партиций содержит файлы retail_sales_YYYY-MM.db с таблицей
+retail_sales той же схемы и с теми же индексами, что и основная база
+(schema.SCHEMA, schema.INDEXES). Загрузчик пишет каждую порцию в
+файлы тех месяцев, к которым относятся её строки, поэтому старые месяцы
+при загрузке новых данных не открываются и их можно сжать (compact) или
+перенести в архив (archive), не мешая загрузке.
+
+Партиции фиксируются после основной базы. Чтобы прерванная между этими
+коммитами загрузка не оставила их отставшими, в основной базе в той же
+транзакции записывается номер загрузки, до которой должна дойти партиция
+каждого изменённого месяца, а в файле партиции - до которой она дошла
+(таблица partition_watermark). Следующая загрузка с партициями заново
+копирует отставшие месяцы из основной базы (replay), check их показывает.
+
+Запросы по периоду дат читают только партиции, пересекающиеся с
+периодом. Агрегаты по всей таблице выполняются в каждой партиции
+параллельно, а частичные результаты объединяются: COUNT и SUM
+складываются, AVG считается как сумма SUM / сумма COUNT, MIN/MAX
+берутся от частичных, COUNT(DISTINCT) - по объединению различных
+значений из партиций.
+
+    python data_load.py --partitions retail_sales_partitions
+    python partitions.py split --db retail_sales.db --dir retail_sales_partitions
+    python partitions.py check --db retail_sales.db --dir retail_sales_partitions
+    python partitions.py archive --dir retail_sales_partitions --before 2024-01 --to archive
+"""
+import argparse
+import os
+import re
+import shutil
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import profiler
+from data_load import LOADER_PRAGMAS, _create_indexes, _create_table
+from queries import AGE_GROUP_SQL
+from query_runner import connect_readonly
+from schema import COLUMNS, KEY_COLUMN, TABLE_NAME
+from single_pass import MONTH_NAMES
+
+PARTITION_DIR = "retail_sales_partitions"
+_PARTITION_FILE = re.compile(r"^retail_sales_(\d{4}-\d{2})\.db$")
+
+# В основной базе - ожидаемый номер загрузки каждой партиции, в файле
+# партиции - одна строка с её месяцем и достигнутым номером
+WATERMARK_TABLE = "partition_watermark"
+_WATERMARK_DDL = f"""CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+    month TEXT PRIMARY KEY,
+    load_id INTEGER NOT NULL
+)"""
+
+# Агрегаты Data_SQL.py, которые складываются из частичных результатов партиций:
+# имя -> (ключи {колонка: SQL}, показатели {колонка: (функция, SQL)})
+PARTITIONED_REPORTS = {
+    'age_gender_sales': (
+        {'age_group': AGE_GROUP_SQL, 'gender': "gender"},
+        {'transaction_count': ('count', "*"), 'total_sales': ('sum', "total_amount"),
+         'avg_transaction_value': ('avg', "total_amount"), 'total_items': ('sum', "quantity")},
+    ),
+    'category_gender_sales': (
+        {'product_category': "product_category", 'gender': "gender"},
+        {'transaction_count': ('count', "*"), 'total_sales': ('sum', "total_amount"),
+         'avg_sale': ('avg', "total_amount"), 'total_quantity': ('sum', "quantity")},
+    ),
+    'monthly_sales': (
+        {'month': "strftime('%Y-%m', date)", 'gender': "gender"},
+        {'transactions': ('count', "*"), 'monthly_sales': ('sum', "total_amount"),
+         'avg_transaction': ('avg', "total_amount"), 'items_sold': ('sum', "quantity")},
+    ),
+    'seasonality': (
+        {'month_num': "strftime('%m', date)"},
+        {'transactions': ('count', "*"), 'total_sales': ('sum', "total_amount"),
+         'avg_sale': ('avg', "total_amount"), 'total_items': ('sum', "quantity"),
+         'unique_customers': ('count_distinct', "customer_id")},
+    ),
+}
+AGGREGATES = ('count', 'sum', 'avg', 'min', 'max', 'count_distinct')
+
+
+def partition_path(partition_dir, month):
+    return os.path.join(partition_dir, f"{TABLE_NAME}_{month}.db")
+
+
+def partition_paths(partition_dir=PARTITION_DIR):
+    """{'YYYY-MM': путь к файлу} по возрастанию месяцев"""
+    if not os.path.isdir(partition_dir):
+        return {}
+    months = {}
+    for name in os.listdir(partition_dir):
+        match = _PARTITION_FILE.match(name)
+        if match:
+            months[match.group(1)] = os.path.join(partition_dir, name)
+    return dict(sorted(months.items()))
+
+
+def months_in_range(partition_dir, start_date=None, end_date=None):
+    """Месяцы партиций, пересекающиеся с периодом [start_date, end_date]"""
+    return [month for month in partition_paths(partition_dir)
+            if (start_date is None or month >= start_date[:7])
+            and (end_date is None or month <= end_date[:7])]
+
+
+class PartitionWriter:
+    """Запись порций (DataFrame со схемой schema.COLUMNS) в партиции по месяцам.
+
+    Соединение с партицией открывается при первой строке её месяца, все
+    записи в партицию идут одной транзакцией до commit(). Строки с ID, уже
+    загруженными в основную таблицу, разбираются по месяцу, который для
+    них там хранится (stored_months): в режиме 'skip' они не пишутся, в
+    режиме 'update' старая копия удаляется из партиции своего месяца, если
+    дата строки перешла в другой месяц.
+    """
+
+    def __init__(self, partition_dir=PARTITION_DIR, on_duplicate='skip'):
+        if on_duplicate not in ('skip', 'update'):
+            raise ValueError(f"Неизвестный режим обработки дубликатов: {on_duplicate}")
+        os.makedirs(partition_dir, exist_ok=True)
+        self.partition_dir = partition_dir
+        self._connections = {}
+        names = ", ".join(COLUMNS)
+        placeholders = ", ".join("?" * len(COLUMNS))
+        verb = "INSERT OR IGNORE" if on_duplicate == 'skip' else "INSERT OR REPLACE"
+        self._insert_sql = f"{verb} INTO {TABLE_NAME} ({names}) VALUES ({placeholders})"
+        self.on_duplicate = on_duplicate
+        self.rows = 0
+
+    def _connection(self, month):
+        conn = self._connections.get(month)
+        if conn is None:
+            conn = _open_partition(self.partition_dir, month)
+            self._connections[month] = conn
+        return conn
+
+    def months(self):
+        """Месяцы, партиции которых изменены с начала транзакции"""
+        return sorted(self._connections)
+
+    def write(self, chunk, stored=None):
+        """Запись порции; stored - {transaction_id: 'YYYY-MM'} для ID, которые уже
+        есть в основной таблице (stored_months до слияния порции с ней)"""
+        # Повторы ID внутри порции разрешаются так же, как при записи в staging
+        keep = 'first' if self.on_duplicate == 'skip' else 'last'
+        chunk = chunk.drop_duplicates(KEY_COLUMN, keep=keep)
+        if stored:
+            existing = chunk[KEY_COLUMN].map(stored)
+            if self.on_duplicate == 'skip':
+                chunk = chunk[existing.isna()]
+            else:
+                moved = existing.notna() & (existing != chunk['date'].str[:7])
+                for month, ids in chunk.loc[moved, KEY_COLUMN].groupby(existing[moved]):
+                    self._delete(month, ids)
+        for month, rows in chunk.groupby(chunk['date'].str[:7], sort=False):
+            conn = self._connection(month)
+            conn.executemany(self._insert_sql, rows[COLUMNS].itertuples(index=False, name=None))
+            self.rows += len(rows)
+
+    def _delete(self, month, ids):
+        # Партицию месяца, перенесённую в архив, заново не создаём
+        if month not in self._connections and not os.path.exists(
+                partition_path(self.partition_dir, month)):
+            return
+        self._connection(month).executemany(
+            f"DELETE FROM {TABLE_NAME} WHERE {KEY_COLUMN} = ?", ((int(i),) for i in ids))
+
+    def commit(self, load_id=None):
+        """Индексы и фиксация; возвращает список изменённых месяцев.
+
+        load_id - номер загрузки из expect(): он записывается в водяной знак
+        каждой партиции в её же транзакции.
+        """
+        months = self.months()
+        try:
+            for month in months:
+                _commit_partition(self._connections.pop(month), month, load_id)
+        except BaseException:
+            # Незафиксированные партиции отстанут и будут восстановлены replay
+            self.rollback()
+            raise
+        return months
+
+    def rollback(self):
+        for conn in self._connections.values():
+            conn.execute("ROLLBACK")
+            conn.close()
+        self._connections.clear()
+
+
+def _open_partition(partition_dir, month):
+    """Соединение с партицией месяца в открытой транзакции записи"""
+    conn = sqlite3.connect(partition_path(partition_dir, month), isolation_level=None)
+    for pragma in LOADER_PRAGMAS:
+        conn.execute(pragma)
+    # Таблица создаётся до транзакции: новая партиция прерванной загрузки
+    # остаётся пустой (behind покажет её отставшей), а не файлом без таблицы
+    _create_table(conn, TABLE_NAME)
+    conn.execute("BEGIN")
+    return conn
+
+
+def _commit_partition(conn, month, load_id):
+    _create_indexes(conn, TABLE_NAME)
+    if load_id is not None:
+        conn.execute(_WATERMARK_DDL)
+        conn.execute(f"INSERT OR REPLACE INTO {WATERMARK_TABLE} (month, load_id) VALUES (?, ?)",
+                     (month, load_id))
+    conn.execute("COMMIT")
+    conn.close()
+
+
+def expect(conn, months):
+    """Новый номер загрузки, записанный в основную базу conn как ожидаемый для
+    партиций months; вызывается в транзакции загрузки до её фиксации"""
+    conn.execute(_WATERMARK_DDL)
+    load_id = conn.execute(
+        f"SELECT COALESCE(MAX(load_id), 0) + 1 FROM {WATERMARK_TABLE}").fetchone()[0]
+    conn.executemany(f"INSERT OR REPLACE INTO {WATERMARK_TABLE} (month, load_id) VALUES (?, ?)",
+                     ((month, load_id) for month in months))
+    return load_id
+
+
+def _reached(path):
+    conn = connect_readonly(path)
+    try:
+        row = conn.execute(f"SELECT load_id FROM {WATERMARK_TABLE}").fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    finally:
+        conn.close()
+    return row[0] if row else 0
+
+
+def behind(conn, partition_dir=PARTITION_DIR):
+    """{месяц: (ожидаемая загрузка, достигнутая)} для партиций, отставших от основной
+    базы conn; месяцы без файла в partition_dir (перенесённые в архив) не проверяются"""
+    try:
+        expected = conn.execute(f"SELECT month, load_id FROM {WATERMARK_TABLE}").fetchall()
+    except sqlite3.OperationalError:
+        return {}
+    paths = partition_paths(partition_dir)
+    months = {}
+    for month, load_id in expected:
+        if month in paths:
+            reached = _reached(paths[month])
+            if reached < load_id:
+                months[month] = (load_id, reached)
+    return months
+
+
+def replay(conn, partition_dir=PARTITION_DIR):
+    """Отставшие партиции (behind) заново копируются из основной базы conn;
+    возвращает список таких месяцев"""
+    months = behind(conn, partition_dir)
+    names = ", ".join(COLUMNS)
+    insert_sql = f"INSERT INTO {TABLE_NAME} ({names}) VALUES ({', '.join('?' * len(COLUMNS))})"
+    for month, (load_id, _) in months.items():
+        partition = _open_partition(partition_dir, month)
+        try:
+            partition.execute(f"DELETE FROM {TABLE_NAME}")
+            partition.executemany(insert_sql, conn.execute(
+                f"SELECT {names} FROM {TABLE_NAME} WHERE date BETWEEN ? AND ?",
+                (f"{month}-01", f"{month}-31")))
+        except BaseException:
+            partition.execute("ROLLBACK")
+            partition.close()
+            raise
+        _commit_partition(partition, month, load_id)
+    return list(months)
+
+
+def stored_months(conn, staging, fact):
+    """{transaction_id: 'YYYY-MM'} строк staging, которые уже есть в fact"""
+    return dict(conn.execute(f"""
+        SELECT f.{KEY_COLUMN}, substr(f.date, 1, 7)
+        FROM {staging} s JOIN {fact} f ON f.{KEY_COLUMN} = s.{KEY_COLUMN}
+    """))
+
+
+def split_database(db_path="retail_sales.db", partition_dir=PARTITION_DIR,
+                   chunk_size=100_000, on_duplicate='skip'):
+    """Раскладка существующей таблицы retail_sales по месячным партициям"""
+    writer = PartitionWriter(partition_dir, on_duplicate)
+    conn = sqlite3.connect(db_path)
+    try:
+        query = f"SELECT {', '.join(COLUMNS)} FROM {TABLE_NAME} ORDER BY date, {KEY_COLUMN}"
+        for chunk in pd.read_sql_query(query, conn, chunksize=chunk_size):
+            writer.write(chunk)
+        load_id = expect(conn, writer.months())
+        conn.commit()
+    except BaseException:
+        writer.rollback()
+        raise
+    finally:
+        conn.close()
+    writer.commit(load_id)
+    return writer.rows
+
+
+def fan_out(partition_dir, query, params=None, months=None, workers=None):
+    """Запрос в каждой партиции параллельно (по read-only соединению на поток);
+    результат - список DataFrame в порядке месяцев"""
+    paths = partition_paths(partition_dir)
+    months = list(paths) if months is None else [month for month in months if month in paths]
+
+    def run(month):
+        conn = connect_readonly(paths[month])
+        try:
+            return profiler.read_sql_query(query, conn, params, f'partition {month}')
+        finally:
+            conn.close()
+
+    if not months:
+        return []
+    workers = workers or min(len(months), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run, months))
+
+
+def select_range(partition_dir, query, start_date=None, end_date=None, params=None,
+                 workers=None):
+    """Запрос к строкам retail_sales только в партициях периода.
+
+    query фильтрует по периоду сам (например, через :start_date/:end_date);
+    результаты партиций склеиваются в порядке месяцев, поэтому сортировка
+    по дате внутри партиции даёт общий порядок по дате.
+    """
+    frames = fan_out(partition_dir, query, params,
+                     months_in_range(partition_dir, start_date, end_date), workers)
+    if not frames:
+        # Нет партиций за период: пустой результат с колонками запроса
+        conn = sqlite3.connect(":memory:")
+        _create_table(conn, TABLE_NAME)
+        try:
+            return pd.read_sql_query(query, conn, params=params)
+        finally:
+            conn.close()
+    return pd.concat(frames, ignore_index=True)
+
+
+def _partial_sql(keys, measures, where):
+    columns = [f"{sql} AS {name}" for name, sql in keys.items()]
+    for name, (func, sql) in measures.items():
+        if func not in AGGREGATES:
+            raise ValueError(f"Неизвестная агрегатная функция: {func}")
+        if func in ('count', 'sum', 'min', 'max'):
+            columns.append(f"{func.upper()}({sql}) AS {name}")
+        elif func == 'avg':
+            columns.append(f"SUM({sql}) AS {name}__sum")
+            columns.append(f"COUNT({sql}) AS {name}__count")
+    query = f"SELECT {', '.join(columns)} FROM {TABLE_NAME}"
+    if where:
+        query += f" WHERE {where}"
+    return query + f" GROUP BY {', '.join(keys)}"
+
+
+def aggregate(partition_dir, keys, measures, where=None, params=None, months=None,
+              workers=None):
+    """GROUP BY по всем партициям с объединением частичных результатов.
+
+    keys - {колонка: SQL-выражение}, measures - {колонка: (функция, SQL)},
+    функции: count, sum, avg, min, max, count_distinct. Результат
+    отсортирован по ключам, колонки - в порядке keys и measures.
+    """
+    key_names = list(keys)
+    partials = fan_out(partition_dir, _partial_sql(keys, measures, where), params, months,
+                       workers)
+    if not partials:
+        return pd.DataFrame(columns=key_names + list(measures))
+    grouped = pd.concat(partials, ignore_index=True).groupby(key_names, sort=True)
+
+    merge = {'count': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max'}
+    result = pd.DataFrame(index=grouped.size().index)
+    for name, (func, sql) in measures.items():
+        if func in merge:
+            result[name] = grouped[name].agg(merge[func])
+        elif func == 'avg':
+            result[name] = grouped[f"{name}__sum"].sum() / grouped[f"{name}__count"].sum()
+        else:
+            # Одно и то же значение может встречаться в разных партициях
+            distinct_sql = (f"SELECT DISTINCT {', '.join(f'{s} AS {k}' for k, s in keys.items())}, "
+                            f"{sql} AS value FROM {TABLE_NAME}"
+                            + (f" WHERE {where}" if where else ""))
+            values = pd.concat(fan_out(partition_dir, distinct_sql, params, months, workers),
+                               ignore_index=True)
+            result[name] = values.groupby(key_names)['value'].nunique()
+    return result.reset_index()
+
+
+def partitioned_report(partition_dir, name, workers=None):
+    """Агрегат Data_SQL.py из PARTITIONED_REPORTS, посчитанный по партициям"""
+    keys, measures = PARTITIONED_REPORTS[name]
+    result = aggregate(partition_dir, keys, measures, workers=workers)
+    if name == 'seasonality':
+        result.insert(1, 'month_name', result['month_num'].map(MONTH_NAMES))
+    return result
+
+
+def check(db_path="retail_sales.db", partition_dir=PARTITION_DIR):
+    """Сверка партиций с основной таблицей: COUNT(*) и SUM(total_amount) по месяцам.
+
+    Возвращает {месяц: (строк в базе, сумма в базе, строк в партиции,
+    сумма в партиции)} для месяцев, где они различаются (месяцы,
+    перенесённые в архив, тоже попадают сюда - их нет в partition_dir).
+    """
+    query = (f"SELECT substr(date, 1, 7) AS month, COUNT(*) AS rows, "
+             f"SUM(total_amount) AS amount FROM {TABLE_NAME} GROUP BY month")
+    conn = connect_readonly(db_path)
+    try:
+        expected = {month: (rows, amount) for month, rows, amount in conn.execute(query)}
+    finally:
+        conn.close()
+    actual = {}
+    for frame in fan_out(partition_dir, query):
+        for month, rows, amount in frame.itertuples(index=False, name=None):
+            stored_rows, stored_amount = actual.get(month, (0, 0.0))
+            actual[month] = (stored_rows + rows, stored_amount + amount)
+    differences = {}
+    for month in sorted(set(expected) | set(actual)):
+        rows, amount = expected.get(month, (0, 0.0))
+        partition_rows, partition_amount = actual.get(month, (0, 0.0))
+        if rows != partition_rows or abs(amount - partition_amount) > 1e-6 * max(1.0, abs(amount)):
+            differences[month] = (rows, amount, partition_rows, partition_amount)
+    return differences
+
+
+def compact(partition_dir=PARTITION_DIR, before=None):
+    """VACUUM партиций месяцев раньше before ('YYYY-MM') и перевод их в обычный
+    журнал: после этого каждая партиция - один файл без -wal/-shm"""
+    compacted = []
+    for month, path in partition_paths(partition_dir).items():
+        if before is not None and month >= before:
+            continue
+        conn = sqlite3.connect(path, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.execute("VACUUM")
+        conn.close()
+        compacted.append(month)
+    return compacted
+
+
+def archive(partition_dir=PARTITION_DIR, before=None, archive_dir="retail_sales_archive"):
+    """Перенос сжатых партиций месяцев раньше before в archive_dir.
+
+    Перенесённые месяцы больше не участвуют в запросах к partition_dir;
+    каталог архива - такой же каталог партиций, к нему можно обращаться
+    теми же функциями.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    moved = []
+    for month in compact(partition_dir, before):
+        shutil.move(partition_path(partition_dir, month), partition_path(archive_dir, month))
+        moved.append(month)
+    return moved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Месячные партиции retail_sales")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    split = commands.add_parser("split", help="разложить базу по месячным партициям")
+    split.add_argument("--db", default="retail_sales.db", help="путь к базе данных SQLite")
+    split.add_argument("--dir", default=PARTITION_DIR, help="каталог партиций")
+
+    check_command = commands.add_parser("check", help="сверить партиции с основной таблицей")
+    check_command.add_argument("--db", default="retail_sales.db",
+                               help="путь к базе данных SQLite")
+    check_command.add_argument("--dir", default=PARTITION_DIR, help="каталог партиций")
+
+    for name, help_text in (("compact", "сжать партиции старых месяцев"),
+                            ("archive", "перенести партиции старых месяцев в архив")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("--dir", default=PARTITION_DIR, help="каталог партиций")
+        command.add_argument("--before", required=name == "archive", default=None,
+                             help="месяц YYYY-MM: обрабатываются партиции до него")
+        if name == "archive":
+            command.add_argument("--to", default="retail_sales_archive", help="каталог архива")
+
+    args = parser.parse_args(argv)
+    if args.command == "split":
+        rows = split_database(args.db, args.dir)
+        print(f"Разложено {rows} строк по {len(partition_paths(args.dir))} партициям в {args.dir}")
+    elif args.command == "check":
+        conn = connect_readonly(args.db)
+        try:
+            lagging = behind(conn, args.dir)
+        finally:
+            conn.close()
+        for month, (load_id, reached) in lagging.items():
+            print(f"{month}: партиция дошла до загрузки {reached} из {load_id} "
+                  f"(её восстановит следующая загрузка с --partitions)")
+        differences = check(args.db, args.dir)
+        for month, (rows, amount, partition_rows, partition_amount) in differences.items():
+            print(f"{month}: в базе {rows} строк на {amount:.2f}, "
+                  f"в партициях {partition_rows} строк на {partition_amount:.2f}")
+        if lagging or differences:
+            raise SystemExit(f"Партиции расходятся с базой в "
+                             f"{len(set(lagging) | set(differences))} месяцах")
+        print(f"Партиции {args.dir} совпадают с {args.db}")
+    elif args.command == "compact":
+        months = compact(args.dir, args.before)
+        print(f"Сжато партиций: {len(months)}")
+    else:
+        months = archive(args.dir, args.before, args.to)
+        print(f"Перенесено в {args.to}: {', '.join(months) or 'нет партиций'}")
+
+
+if __name__ == "__main__":
+    main()
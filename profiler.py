@@ -0,0 +1,212 @@
+"""Профилирование запросов и этапов анализа.
+
+Все запросы скриптов проходят через read_sql_query. Пока профилирование
+выключено, это прямой вызов pd.read_sql_query (одна проверка глобальной
+переменной). Включённый профилировщик для каждого запроса записывает
+время выполнения в SQLite, время построения DataFrame, число строк и
+план EXPLAIN QUERY PLAN с отметками полного сканирования таблиц и
+временных B-деревьев для сортировки/группировки. Этапы скриптов
+замеряются через stage(). В конце работы пишется отчёт в двух видах:
+<путь>.txt и <путь>.json.
+
+Включение: переменная окружения RETAIL_PROFILE=1 (или путь к отчёту
+без расширения) либо флаг --profile у Data_SQL.py и visual.py.
+"""
+import atexit
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+PROFILE_ENV = "RETAIL_PROFILE"
+PROFILE_PATH = "query_profile"
+
+# "SCAN retail_sales" - полный проход по таблице; "SCAN t USING INDEX" - по индексу
+_FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?! USING)(?:\s|$)")
+_TEMP_BTREE = re.compile(r"USE TEMP B-TREE FOR (.+)")
+
+_profiler = None
+
+
+def _tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def _plan(conn, query, params):
+    """Строки EXPLAIN QUERY PLAN с отступами по вложенности"""
+    try:
+        rows = conn.execute("EXPLAIN QUERY PLAN " + query, params or ()).fetchall()
+    except Exception as error:  # план не критичен для отчёта
+        return [f"<план недоступен: {error}>"]
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return lines
+
+
+class Profiler:
+    """Накопитель замеров запросов и этапов одного запуска"""
+
+    def __init__(self, path=PROFILE_PATH):
+        self.path = path
+        self.queries = []
+        self.stages = []
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._written = False
+
+    def read_sql_query(self, query, conn, params=None, name=None):
+        """pd.read_sql_query с замером: SQLite (execute+fetchall) отдельно от pandas"""
+        plan = _plan(conn, query, params)
+        tables = _tables(conn)
+
+        started = time.perf_counter()
+        cursor = conn.execute(query, params or ())
+        rows = cursor.fetchall()
+        fetched = time.perf_counter()
+        # То же построение, что и в pd.read_sql_query для sqlite3
+        frame = pd.DataFrame.from_records(
+            rows, columns=[column[0] for column in cursor.description], coerce_float=True)
+        finished = time.perf_counter()
+
+        record = {
+            'name': name,
+            'sql': " ".join(query.split()),
+            'params': repr(params) if params is not None else None,
+            'rows': len(frame),
+            'sql_seconds': fetched - started,
+            'pandas_seconds': finished - fetched,
+            'total_seconds': finished - started,
+            'plan': plan,
+            # Проходы по CTE и подзапросам - не полное сканирование таблиц
+            'full_scans': sorted({m.group(1) for line in plan
+                                  if (m := _FULL_SCAN.match(line.strip()))
+                                  and m.group(1) in tables}),
+            'temp_btrees': [m.group(1) for line in plan if (m := _TEMP_BTREE.search(line))],
+            'thread': threading.current_thread().name,
+        }
+        with self._lock:
+            self.queries.append(record)
+        return frame
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.stages.append({'name': name, 'seconds': time.perf_counter() - started})
+
+    def report(self):
+        """Отчёт как словарь: итоги, этапы и запросы от самых долгих"""
+        with self._lock:
+            queries = sorted(self.queries, key=lambda q: q['total_seconds'], reverse=True)
+            stages = list(self.stages)
+        return {
+            'pid': os.getpid(),
+            'wall_seconds': time.perf_counter() - self.started,
+            'queries_total': len(queries),
+            'sql_seconds': sum(q['sql_seconds'] for q in queries),
+            'pandas_seconds': sum(q['pandas_seconds'] for q in queries),
+            'full_scan_queries': sum(1 for q in queries if q['full_scans']),
+            'stages': stages,
+            'queries': queries,
+        }
+
+    def format_report(self, report=None):
+        report = report or self.report()
+        lines = [
+            "ПРОФИЛЬ ЗАПРОСОВ",
+            f"Всего: {report['wall_seconds']:.3f} с, запросов {report['queries_total']}, "
+            f"SQLite {report['sql_seconds']:.3f} с, pandas {report['pandas_seconds']:.3f} с, "
+            f"с полным сканированием {report['full_scan_queries']}",
+        ]
+        if report['stages']:
+            lines.append("")
+            lines.append("Этапы:")
+            for item in report['stages']:
+                lines.append(f"  {item['name']:<30} {item['seconds']:10.3f} с")
+        lines.append("")
+        lines.append(f"{'запрос':<28} {'строк':>10} {'SQLite, с':>10} {'pandas, с':>10}  отметки")
+        for query in report['queries']:
+            flags = [f"SCAN {table}" for table in query['full_scans']]
+            flags += [f"TEMP B-TREE {what}" for what in query['temp_btrees']]
+            label = query['name'] or query['sql'][:28]
+            lines.append(f"{label:<28} {query['rows']:>10} {query['sql_seconds']:>10.4f} "
+                         f"{query['pandas_seconds']:>10.4f}  {', '.join(flags)}")
+        lines.append("")
+        lines.append("Планы запросов:")
+        for query in report['queries']:
+            lines.append(f"-- {query['name'] or ''} {query['sql'][:100]}")
+            lines.extend("   " + line for line in query['plan'])
+        return "\n".join(lines)
+
+    def write(self):
+        """Запись отчёта в <path>.txt и <path>.json; возвращает пути"""
+        report = self.report()
+        text_path, json_path = self.path + ".txt", self.path + ".json"
+        with open(text_path, 'w', encoding='utf-8') as f:
+            f.write(self.format_report(report) + "\n")
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        self._written = True
+        return text_path, json_path
+
+
+def _write_at_exit(profiler):
+    # Дочерние процессы multiprocessing завершаются без atexit, отчёт пишет только
+    # процесс, включивший профилирование
+    if profiler._written or profiler is not _profiler:
+        return
+    text_path, json_path = profiler.write()
+    print(f"\nПрофиль запросов: {text_path}, {json_path}")
+
+
+def enable(path=None):
+    """Включение профилирования; отчёт пишется при завершении процесса"""
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler(path or PROFILE_PATH)
+        atexit.register(_write_at_exit, _profiler)
+    elif path:
+        _profiler.path = path
+    return _profiler
+
+
+def disable():
+    global _profiler
+    _profiler = None
+
+
+def active():
+    """Текущий профилировщик или None, если профилирование выключено"""
+    return _profiler
+
+
+def read_sql_query(query, conn, params=None, name=None):
+    """pd.read_sql_query, замеряемый при включённом профилировании"""
+    if _profiler is None:
+        return pd.read_sql_query(query, conn, params=params)
+    return _profiler.read_sql_query(query, conn, params, name)
+
+
+@contextmanager
+def stage(name):
+    """Замер этапа; без профилирования ничего не делает"""
+    if _profiler is None:
+        yield
+        return
+    with _profiler.stage(name):
+        yield
+
+
+if os.environ.get(PROFILE_ENV, "") not in ("", "0"):
+    _value = os.environ[PROFILE_ENV]
+    enable(None if _value.lower() in ("1", "true", "yes", "on") else _value)
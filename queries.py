@@ -0,0 +1,154 @@
+"""Библиотека параметризованных запросов к retail_sales.
+
+Отчёты с фильтрами - функции с параметрами (пол, диапазон возраста,
+категория, порог суммы, период дат, топ-N) вместо SQL с зашитыми
+значениями. Значения передаются связанными параметрами (:gender, :min_age
+и т.д.), поэтому текст запроса зависит только от набора фильтров, а не от
+их значений: sqlite3 хранит подготовленные запросы в кэше соединения
+(sqlite3.connect(cached_statements=...)), и повторный отчёт с другими
+значениями не разбирается заново. batch() выполняет один отчёт для многих
+наборов параметров, например топ-10 продаж за каждый месяц. Топ-n по сумме
+читается из лидербордов leaderboard.py, если они есть в базе и покрывают
+n и фильтры (top_sales_query).
+
+    top_sales(conn, gender='Female', min_age=31, n=10)
+    batch(top_sales, conn, month_windows('2023-01', '2023-12'), n=5)
+"""
+import pandas as pd
+
+import leaderboard
+from query_cache import read_sql
+from schema import COLUMNS, TABLE_NAME
+
+SALES_COLUMNS = ('date', 'customer_id', 'age', 'gender', 'product_category', 'quantity',
+                 'total_amount')
+
+# Фильтр -> условие WHERE; границы возраста и периода включительно, порог суммы строгий
+FILTERS = {
+    'gender': "gender = :gender",
+    'category': "product_category = :category",
+    'min_age': "age >= :min_age",
+    'max_age': "age <= :max_age",
+    'amount_above': "total_amount > :amount_above",
+    'start_date': "date >= :start_date",
+    'end_date': "date <= :end_date",
+}
+
+# Возрастные группы отчётов Data_SQL.py (age_gender_sales, category_by_age):
+# по ним же складываются партиции (partitions.py) и проверяется таблица
+# покупателей (customers.single_group)
+AGE_GROUP_SQL = """CASE
+        WHEN age BETWEEN 18 AND 25 THEN '18-25'
+        WHEN age BETWEEN 26 AND 35 THEN '26-35'
+        WHEN age BETWEEN 36 AND 45 THEN '36-45'
+        WHEN age BETWEEN 46 AND 55 THEN '46-55'
+        ELSE '55+'
+    END"""
+
+# При равной сумме - по transaction_id: порядок не зависит от плана запроса
+# и совпадает с лидербордами leaderboard.py
+ORDERS = {
+    'amount': "total_amount DESC, transaction_id",
+    'date': "date",
+    'age': "age",
+}
+
+
+def sales_query(columns=SALES_COLUMNS, order_by=None, limit=None, **filters):
+    """SQL и параметры выборки транзакций: (sql, params).
+
+    Фильтры со значением None не участвуют в запросе. Имена колонок и
+    сортировок проверяются по спискам, значения только связываются.
+    """
+    unknown = set(columns) - set(COLUMNS)
+    if unknown:
+        raise ValueError(f"Неизвестные колонки: {', '.join(sorted(unknown))}")
+    unknown = set(filters) - set(FILTERS)
+    if unknown:
+        raise ValueError(f"Неизвестные фильтры: {', '.join(sorted(unknown))}")
+    if order_by is not None and order_by not in ORDERS:
+        raise ValueError(f"Неизвестная сортировка: {order_by}")
+
+    params = {name: value for name, value in filters.items() if value is not None}
+    sql = f"SELECT {', '.join(columns)}\nFROM {TABLE_NAME}"
+    if params:
+        # Порядок условий фиксирован, чтобы текст запроса не зависел от порядка аргументов
+        sql += "\nWHERE " + " AND ".join(FILTERS[name] for name in FILTERS if name in params)
+    if order_by is not None:
+        sql += f"\nORDER BY {ORDERS[order_by]}"
+    if limit is not None:
+        sql += "\nLIMIT :limit"
+        params['limit'] = limit
+    return sql, params
+
+
+def top_sales_query(columns=SALES_COLUMNS, n=10, conn=None, **filters):
+    """SQL и параметры транзакций по убыванию суммы, не больше n (None - все): (sql, params).
+
+    Если передан conn и лидерборды базы покрывают n и фильтры, запрос
+    читает не больше n строк на сегмент вместо сортировки всех подходящих.
+    """
+    # sales_query заодно проверяет имена колонок и фильтров
+    query = sales_query(columns, 'amount', n, **filters)
+    if conn is not None and leaderboard.covers(conn, n, filters):
+        return leaderboard.top_query(columns, n, TABLE_NAME, **filters)
+    return query
+
+
+def sales(conn, columns=SALES_COLUMNS, order_by=None, limit=None, cache=None, name=None,
+          **filters):
+    """Транзакции, отобранные фильтрами, как DataFrame"""
+    sql, params = sales_query(columns, order_by, limit, **filters)
+    return read_sql(sql, conn, params, cache, name)
+
+
+def top_sales(conn, n=10, columns=SALES_COLUMNS, cache=None, **filters):
+    """Топ-n транзакций по сумме"""
+    sql, params = top_sales_query(columns, n, conn, **filters)
+    return read_sql(sql, conn, params, cache, 'top_sales')
+
+
+def high_value_sales(conn, amount_above=1000, columns=SALES_COLUMNS, cache=None, **filters):
+    """Транзакции с суммой больше amount_above, от крупных к мелким"""
+    return sales(conn, columns, 'amount', None, cache, 'high_value_sales',
+                 amount_above=amount_above, **filters)
+
+
+def sales_in_window(conn, start_date, end_date, columns=SALES_COLUMNS, cache=None, **filters):
+    """Транзакции за период [start_date, end_date] (даты 'YYYY-MM-DD') по дате"""
+    return sales(conn, columns, 'date', None, cache, 'sales_in_window',
+                 start_date=start_date, end_date=end_date, **filters)
+
+
+def batch(report, conn, param_sets, **common):
+    """report(conn, **common, **params) для каждого набора параметров.
+
+    Наборы с одинаковыми именами фильтров дают один и тот же текст SQL,
+    поэтому запрос готовится один раз. Возвращает список DataFrame в
+    порядке param_sets.
+    """
+    return [report(conn, **common, **params) for params in param_sets]
+
+
+def month_windows(first_month, last_month):
+    """Наборы параметров start_date/end_date для каждого месяца 'YYYY-MM' .. 'YYYY-MM'"""
+    starts = pd.period_range(first_month, last_month, freq='M')
+    return [{'start_date': str(month.start_time.date()), 'end_date': str(month.end_time.date())}
+            for month in starts]
+
+
+def top_sales_per_month(conn, first_month, last_month, n=10, cache=None, **filters):
+    """Топ-n транзакций за каждый месяц: {'YYYY-MM': DataFrame}"""
+    windows = month_windows(first_month, last_month)
+    frames = batch(top_sales, conn, windows, n=n, cache=cache, **filters)
+    return {window['start_date'][:7]: frame for window, frame in zip(windows, frames)}
+
+
+def top_sales_per_category(conn, categories=None, n=10, cache=None, **filters):
+    """Топ-n транзакций в каждой категории: {категория: DataFrame}"""
+    if categories is None:
+        categories = [row[0] for row in conn.execute(
+            f"SELECT DISTINCT product_category FROM {TABLE_NAME} ORDER BY product_category")]
+    frames = batch(top_sales, conn, [{'category': category} for category in categories],
+                   n=n, cache=cache, **filters)
+    return dict(zip(categories, frames))
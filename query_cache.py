@@ -0,0 +1,182 @@
+"""Кэш результатов аналитических запросов на диске.
+
+Ключ кэша - нормализованный текст SQL, параметры и отпечаток версии
+данных: columnar.data_version (число строк и максимальный transaction_id
+в retail_sales, число записанных строк и время последней загрузки из
+load_watermark - оно меняется при каждой загрузке, в том числе в режиме
+update) и, дополнительно, время изменения и размеры файла базы и её
+WAL-журнала. Отпечаток пересчитывается, когда меняется PRAGMA data_version
+соединения. Пока данные не менялись, повторный запрос читает готовый
+DataFrame из файла, не обращаясь к SQLite. Размер кэша ограничен, при переполнении удаляются
+давно не использованные записи (LRU по времени последнего обращения).
+"""
+import hashlib
+import json
+import os
+import pickle
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+import columnar
+import profiler
+
+CACHE_DIR = ".query_cache"
+MAX_BYTES = 256 * 1024 * 1024
+# Сколько последних соединений помнит QueryCache.data_version
+MAX_CONNECTIONS = 64
+
+# Строковые литералы оставляем как есть, остальные пробелы схлопываем
+_SQL_TOKENS = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\s+")
+
+
+def normalize_sql(query):
+    """Текст запроса без лишних пробелов, переводов строк и завершающей ';'"""
+    normalized = _SQL_TOKENS.sub(
+        lambda m: m.group(0) if m.group(0)[0] in "'\"" else " ", query)
+    return normalized.strip().rstrip(";").strip()
+
+
+def _database_file(conn):
+    row = conn.execute("PRAGMA database_list").fetchone()
+    return row[2] if row else ""
+
+
+def _file_signature(path):
+    """Время изменения и размер файла базы и размер WAL-журнала.
+
+    Записи сначала попадают в WAL, поэтому учитывается и его размер. Время
+    изменения WAL не учитывается: пустой журнал пересоздаётся при каждом
+    открытии базы. Одного этого отпечатка мало: запись в WAL того же размера
+    после checkpoint может не изменить ни одно из значений.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    try:
+        wal_size = os.stat(path + "-wal").st_size
+    except OSError:
+        wal_size = 0
+    return stat.st_mtime_ns, stat.st_size, wal_size
+
+
+class QueryCache:
+    """LRU-кэш DataFrame-результатов pd.read_sql_query в каталоге directory"""
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._versions = OrderedDict()
+        os.makedirs(directory, exist_ok=True)
+
+    def data_version(self, conn):
+        """Отпечаток версии данных (см. описание модуля).
+
+        Он пересчитывается, только если у соединения изменилась PRAGMA
+        data_version (коммит другого соединения) или total_changes (запись
+        через само соединение). Значения PRAGMA data_version разных
+        соединений несравнимы, поэтому запомненный отпечаток хранится вместе
+        с соединением: id() закрытого соединения может достаться новому.
+        """
+        state = (conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes)
+        with self._lock:
+            cached = self._versions.get(id(conn))
+        if cached is not None and cached[0] is conn and cached[1] == state:
+            return cached[2]
+        try:
+            content = columnar.data_version(conn)
+        except sqlite3.Error:
+            content = None
+        path = _database_file(conn)
+        signature = _file_signature(path) if path else None
+        version = f"{json.dumps(content)}:{signature}"
+        with self._lock:
+            self._versions[id(conn)] = (conn, state, version)
+            self._versions.move_to_end(id(conn))
+            while len(self._versions) > MAX_CONNECTIONS:
+                self._versions.popitem(last=False)
+        return version
+
+    def key(self, query, conn, params=None):
+        payload = "\n".join((normalize_sql(query), repr(params), self.data_version(conn)))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pkl")
+
+    def read_sql(self, query, conn, params=None, name=None):
+        """pd.read_sql_query с кэшированием результата"""
+        path = self._path(self.key(query, conn, params))
+        try:
+            frame = pd.read_pickle(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            frame = None
+        if frame is not None:
+            # Обновляем время обращения: по нему выбираются кандидаты на вытеснение
+            os.utime(path)
+            with self._lock:
+                self.hits += 1
+            return frame
+
+        frame = profiler.read_sql_query(query, conn, params, name)
+        with self._lock:
+            self.misses += 1
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        frame.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+        self._evict()
+        return frame
+
+    def _evict(self):
+        """Удаление давно не использованных записей, пока кэш больше max_bytes"""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".pkl"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pkl"):
+                os.remove(entry.path)
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / requests if requests else 0.0,
+        }
+
+
+def read_sql(query, conn, params=None, cache=None, name=None):
+    """pd.read_sql_query через кэш, если он передан; name - имя запроса в профиле"""
+    if cache is None:
+        return profiler.read_sql_query(query, conn, params, name)
+    return cache.read_sql(query, conn, params, name)
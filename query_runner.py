@@ -0,0 +1,98 @@
+"""Параллельное выполнение независимых запросов отчёта.
+
+Каждый поток берёт своё read-only соединение из ConnectionPool. SQLite
+отпускает GIL на время выполнения запроса, а база загружается в режиме
+WAL (см. data_load.LOADER_PRAGMAS), поэтому читатели не блокируют друг
+друга и время отчёта приближается ко времени самого медленного запроса.
+"""
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from query_cache import read_sql
+
+
+def connect_readonly(db_path):
+    """Read-only соединение, которое можно передавать между потоками"""
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True,
+                           check_same_thread=False)
+    conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+class ConnectionPool:
+    """Пул read-only соединений к одной базе; соединения создаются по мере надобности"""
+
+    def __init__(self, db_path, size=None):
+        self.db_path = db_path
+        self.size = size or os.cpu_count() or 1
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    def _release(self, conn):
+        # Соединение, занятое во время close(), закрывается при возврате
+        with self._lock:
+            if not self._closed:
+                self._idle.put(conn)
+                return
+        conn.close()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            return connect_readonly(self.db_path)
+        # Все соединения заняты: ждём, пока одно из них вернут
+        return self._idle.get()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        self._created = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def run_query(pool, query, params=None, cache=None, name=None):
+    with pool.connection() as conn:
+        return read_sql(query, conn, params, cache, name)
+
+
+def run_parallel(queries, pool, max_workers=None, cache=None):
+    """Выполнение словаря {имя: SQL или (SQL, параметры)} в пуле потоков;
+    результат - {имя: DataFrame}"""
+    max_workers = max_workers or pool.size
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for name, query in queries.items():
+            query, params = query if isinstance(query, tuple) else (query, None)
+            futures[name] = executor.submit(run_query, pool, query, params, cache, name)
+        return {name: future.result() for name, future in futures.items()}
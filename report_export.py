@@ -0,0 +1,154 @@
+"""Потоковая выгрузка отчёта в Excel с постоянным расходом памяти.
+
+Листы, заданные SQL-запросом, пишутся прямо из курсора SQLite порциями
+по batch_size строк в книгу openpyxl в режиме write_only, поэтому ни
+результат запроса, ни книга целиком в памяти не собираются. Каждый
+запрос выполняется один раз: когда лист доходит до предела Excel
+(EXCEL_MAX_ROWS строк), последней строкой листа пишется ссылка на файл
+продолжения, и остальные строки того же курсора уходят в отдельный сжатый
+CSV (или Parquet, если установлен pyarrow). Файл продолжения дописывается
+в отдельном потоке вместе со своим соединением, пока основной поток
+заполняет книгу следующими листами через другие соединения пула.
+"""
+import csv
+import gzip
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from itertools import chain, islice
+
+import pandas as pd
+
+from query_runner import ConnectionPool
+
+EXCEL_MAX_ROWS = 1_048_576
+BATCH_SIZE = 10_000
+OVERFLOW_FORMATS = ('csv.gz', 'parquet')
+
+
+def _statement(source):
+    """SQL-источник листа: строка или пара (SQL, параметры)"""
+    return source if isinstance(source, tuple) else (source, ())
+
+
+def _iter_rows(cursor, batch_size):
+    """Строки курсора, читаемые порциями по batch_size"""
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def _write_sheet(workbook, sheet_name, source, conn, batch_size, overflow_path):
+    """Лист книги; возвращает число строк на листе и (заголовок, итератор
+    оставшихся строк) для файла продолжения или None, если лист поместился"""
+    sheet = workbook.create_sheet(sheet_name)
+    if isinstance(source, pd.DataFrame):
+        sheet.append(list(source.columns))
+        # Пропуски пишутся пустыми ячейками, как в DataFrame.to_excel
+        source = source.astype(object).where(source.notna(), None)
+        for row in source.itertuples(index=False, name=None):
+            sheet.append(row)
+        return len(source), None
+
+    cursor = conn.execute(*_statement(source))
+    header = [column[0] for column in cursor.description]
+    sheet.append(header)
+    rows = _iter_rows(cursor, batch_size)
+    # Одна строка листа - заголовок, ещё одна остаётся под ссылку на продолжение
+    written = 0
+    for row in islice(rows, EXCEL_MAX_ROWS - 2):
+        sheet.append(row)
+        written += 1
+    tail = list(islice(rows, 2))
+    if len(tail) < 2:
+        # Не больше одной строки сверх этого: она встаёт на место ссылки
+        for row in tail:
+            sheet.append(row)
+        return written + len(tail), None
+    sheet.append([f"Лист не помещается в Excel, продолжение выгружено в файл: "
+                  f"{os.path.basename(overflow_path)}"])
+    return written, (header, chain(tail, rows))
+
+
+def _overflow_path(path, sheet_name, fmt):
+    base = os.path.splitext(path)[0]
+    safe_name = re.sub(r'[^\w+-]+', '_', sheet_name)
+    return f"{base}_{safe_name}.{fmt}"
+
+
+def _write_overflow(connection, header, remainder, out_path, fmt, batch_size):
+    """Продолжение листа в отдельном файле; возвращает число строк.
+
+    connection - ExitStack, который возвращает в пул соединение курсора remainder.
+    """
+    rows = 0
+    with connection:
+        batches = iter(lambda: list(islice(remainder, batch_size)), [])
+        if fmt == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            writer = None
+            for batch in batches:
+                table = pa.Table.from_pandas(pd.DataFrame.from_records(batch, columns=header),
+                                             preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(out_path, table.schema)
+                writer.write_table(table)
+                rows += len(batch)
+            if writer is not None:
+                writer.close()
+            return rows
+
+        with gzip.open(out_path, 'wt', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for batch in batches:
+                writer.writerows(batch)
+                rows += len(batch)
+    return rows
+
+
+def export_report(sheets, db_path, path, batch_size=BATCH_SIZE, overflow_format='csv.gz',
+                  workers=None):
+    """Выгрузка листов {имя листа: SQL-запрос, (SQL, параметры) или DataFrame} в книгу path.
+
+    Возвращает {имя листа: (файл, число строк)}; для листов, не
+    поместившихся в Excel, файл - выгрузка продолжения рядом с книгой,
+    а число строк - всего на листе и в продолжении.
+    """
+    if overflow_format not in OVERFLOW_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {overflow_format}")
+
+    # openpyxl нужен только здесь: импорт модуля его не загружает
+    from openpyxl import Workbook
+
+    outputs = {}
+    # Одно соединение занято книгой, остальные - продолжениями больших листов
+    with ConnectionPool(db_path, size=max(2, workers or os.cpu_count() or 1)) as pool:
+        with ThreadPoolExecutor(max_workers=pool.size) as executor:
+            futures = {}
+            workbook = Workbook(write_only=True)
+            for name, source in sheets.items():
+                overflow_path = _overflow_path(path, name, overflow_format)
+                with ExitStack() as stack:
+                    conn = None
+                    if not isinstance(source, pd.DataFrame):
+                        conn = stack.enter_context(pool.connection())
+                    rows, overflow = _write_sheet(workbook, name, source, conn, batch_size,
+                                                  overflow_path)
+                    outputs[name] = (path, rows)
+                    if overflow is not None:
+                        # Курсор уходит в поток выгрузки вместе со своим соединением
+                        futures[name] = executor.submit(
+                            _write_overflow, stack.pop_all(), *overflow, overflow_path,
+                            overflow_format, batch_size)
+            workbook.save(path)
+
+            for name, future in futures.items():
+                outputs[name] = (_overflow_path(path, name, overflow_format),
+                                 outputs[name][1] + future.result())
+
+    return outputs
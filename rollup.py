@@ -0,0 +1,73 @@
+"""Сводная таблица продаж, поддерживаемая при загрузке.
+
+Зерно сводки - (день, пол, возраст, категория). Возраст хранится точным
+значением, а не группой: Data_SQL.py и visual.py делят покупателей на
+возрастные группы по-разному, и из точного возраста собираются обе
+разбивки. Отчёты, которым хватает COUNT/SUM/AVG по этим измерениям,
+читают сводку вместо таблицы транзакций.
+"""
+
+ROLLUP_TABLE = "retail_sales_daily_rollup"
+
+ROLLUP_DDL = f"""
+CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+    date TEXT NOT NULL,
+    gender TEXT NOT NULL,
+    age INTEGER NOT NULL,
+    product_category TEXT NOT NULL,
+    transactions INTEGER NOT NULL,
+    total_sales REAL NOT NULL,
+    total_items INTEGER NOT NULL,
+    PRIMARY KEY (date, gender, age, product_category)
+) WITHOUT ROWID
+"""
+
+_DIMENSIONS = "date, gender, age, product_category"
+
+
+def create_rollup(conn):
+    conn.execute(ROLLUP_DDL)
+
+
+def has_rollup(conn):
+    """Есть ли в базе сводная таблица (базы старых загрузок её не содержат)"""
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (ROLLUP_TABLE,)
+    ).fetchone()
+    return row is not None
+
+
+def apply_staging(conn, staging, fact, on_duplicate):
+    """Добавление в сводку вклада порции из staging до её записи в fact.
+
+    Новые строки добавляются в сводку. В режиме 'update' строки с уже
+    известным transaction_id сначала вычитаются со старыми значениями,
+    затем добавляются с новыми. В режиме 'skip' такие строки не
+    попадут в fact и в сводку не добавляются.
+    """
+    if on_duplicate == 'skip':
+        delta = f"""
+            SELECT {_DIMENSIONS}, 1 AS sign, total_amount, quantity
+            FROM {staging} s
+            WHERE NOT EXISTS (SELECT 1 FROM {fact} f WHERE f.transaction_id = s.transaction_id)
+        """
+    else:
+        delta = f"""
+            SELECT {_DIMENSIONS}, 1 AS sign, total_amount, quantity
+            FROM {staging}
+            UNION ALL
+            SELECT f.date, f.gender, f.age, f.product_category, -1, f.total_amount, f.quantity
+            FROM {fact} f JOIN {staging} s ON s.transaction_id = f.transaction_id
+        """
+    conn.execute(f"""
+        INSERT INTO {ROLLUP_TABLE} ({_DIMENSIONS}, transactions, total_sales, total_items)
+        SELECT {_DIMENSIONS}, SUM(sign), SUM(sign * total_amount), SUM(sign * quantity)
+        FROM ({delta})
+        GROUP BY {_DIMENSIONS}
+        ON CONFLICT ({_DIMENSIONS}) DO UPDATE SET
+            transactions = transactions + excluded.transactions,
+            total_sales = total_sales + excluded.total_sales,
+            total_items = total_items + excluded.total_items
+    """)
+    if on_duplicate != 'skip':
+        conn.execute(f"DELETE FROM {ROLLUP_TABLE} WHERE transactions = 0")
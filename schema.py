@@ -0,0 +1,33 @@
+"""Схема таблицы retail_sales: имя, ключ, колонки и индексы.
+
+Отдельный модуль без зависимостей, чтобы библиотека запросов, движки и
+проверки получали константы схемы, не импортируя загрузчик data_load.py
+со всеми модулями, которые он обновляет при загрузке.
+"""
+
+TABLE_NAME = "retail_sales"
+KEY_COLUMN = "transaction_id"
+
+# Явная схема: колонка CSV -> (колонка таблицы, тип SQLite, dtype pandas).
+# Дата хранится как TEXT в формате ISO (YYYY-MM-DD): такие строки
+# сортируются как даты и понимаются strftime() в запросах
+SCHEMA = {
+    "Transaction ID": ("transaction_id", "INTEGER PRIMARY KEY", "int64"),
+    "Date": ("date", "TEXT NOT NULL", "object"),
+    "Customer ID": ("customer_id", "TEXT NOT NULL", "object"),
+    "Gender": ("gender", "TEXT NOT NULL", "object"),
+    "Age": ("age", "INTEGER NOT NULL", "int64"),
+    "Product Category": ("product_category", "TEXT NOT NULL", "object"),
+    "Quantity": ("quantity", "INTEGER NOT NULL", "int64"),
+    "Price per Unit": ("price_per_unit", "REAL NOT NULL", "float64"),
+    "Total Amount": ("total_amount", "REAL NOT NULL", "float64"),
+}
+COLUMNS = [column for column, _, _ in SCHEMA.values()]
+
+# Индексы под фильтры и группировки Data_SQL.py и visual.py
+INDEXES = {
+    "idx_retail_sales_gender_age": ("gender", "age"),
+    "idx_retail_sales_category_amount": ("product_category", "total_amount"),
+    "idx_retail_sales_date": ("date",),
+    "idx_retail_sales_customer": ("customer_id",),
+}
@@ -0,0 +1,281 @@
+"""HTTP-сервис с отчётами по retail_sales.db в формате JSON.
+
+Долгоживущий процесс на asyncio (только стандартная библиотека): запросы к
+SQLite выполняются в ограниченном пуле потоков, каждый поток берёт
+read-only соединение из query_runner.ConnectionPool. Готовый ответ
+хранится уже сериализованным в JSON и отдаётся из памяти, пока не
+изменилась версия данных (PRAGMA data_version отдельного соединения-
+наблюдателя и номер файла базы - полная перезагрузка создаёт новый
+файл). Одинаковые запросы, пришедшие одновременно, ждут одного и того же
+вычисления.
+
+    python service.py --db retail_sales.db --port 8080 --workers 4
+
+    GET /reports                  список отчётов и версия данных
+    GET /reports/<имя>            отчёт из Data_SQL.py (строки JSON)
+    GET /sales/top?n=10&gender=Female&min_age=31
+                                  топ-N продаж с фильтрами queries.py
+    GET /health                   состояние, версия данных, статистика кэша
+"""
+import argparse
+import asyncio
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+
+from Data_SQL import aggregate_queries
+from queries import FILTERS, top_sales
+from query_cache import read_sql
+from query_runner import ConnectionPool, connect_readonly
+
+# Отчёты-агрегаты execute_sql_queries (без построчных correlation_data)
+REPORTS = ('age_gender_sales', 'category_gender_sales', 'monthly_sales',
+           'age_group_comparison', 'category_by_age', 'seasonality')
+
+# Типы параметров /sales/top; остальные фильтры queries.FILTERS - строки
+PARAM_TYPES = {'n': int, 'min_age': int, 'max_age': int, 'amount_above': float}
+MAX_TOP_N = 10_000
+
+CACHE_ENTRIES = 1024
+MAX_HEADER_BYTES = 16 * 1024
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           431: "Request Header Fields Too Large", 500: "Internal Server Error",
+           503: "Service Unavailable"}
+
+
+def _frame_json(frame):
+    return frame.to_json(orient='records', force_ascii=False, date_format='iso')
+
+
+class ReportService:
+    """Отчёты с кэшем по версии данных и объединением одинаковых запросов"""
+
+    def __init__(self, db_path, workers=None, cache_entries=CACHE_ENTRIES):
+        self.db_path = db_path
+        self.workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        self.cache_entries = cache_entries
+        self.executor = ThreadPoolExecutor(max_workers=self.workers,
+                                           thread_name_prefix="report")
+        self.pool = None
+        self._watcher = None
+        self._inode = None
+        self._cache = OrderedDict()
+        self._queries = None
+        self._queries_lock = threading.Lock()
+        self._in_flight = {}
+        self.stats = {'requests': 0, 'hits': 0, 'misses': 0, 'coalesced': 0}
+
+    def data_version(self):
+        """(номер файла базы, PRAGMA data_version); при новом файле пул пересоздаётся"""
+        try:
+            inode = os.stat(self.db_path).st_ino
+        except OSError:
+            raise HTTPError(503, "база данных недоступна")
+        if inode != self._inode:
+            self._reopen(inode)
+        return inode, self._watcher.execute("PRAGMA data_version").fetchone()[0]
+
+    def _reopen(self, inode):
+        if self._watcher is not None:
+            self._watcher.close()
+        if self.pool is not None:
+            # Соединения, занятые сейчас, закроются, когда их вернут в старый пул
+            self.pool.close()
+        self._watcher = connect_readonly(self.db_path)
+        self.pool = ConnectionPool(self.db_path, size=self.workers)
+        self._inode = inode
+
+    async def get(self, key, compute):
+        """JSON-ответ для key: из кэша, из уже идущего вычисления или новый"""
+        self.stats['requests'] += 1
+        version = self.data_version()
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == version:
+            self._cache.move_to_end(key)
+            self.stats['hits'] += 1
+            return cached[1]
+
+        in_flight = self._in_flight.get((key, version))
+        if in_flight is not None:
+            self.stats['coalesced'] += 1
+            return await asyncio.shield(in_flight)
+
+        self.stats['misses'] += 1
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, self._run, self.pool, compute)
+        self._in_flight[(key, version)] = future
+        try:
+            body = await asyncio.shield(future)
+        finally:
+            self._in_flight.pop((key, version), None)
+        self._cache[key] = (version, body)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_entries:
+            self._cache.popitem(last=False)
+        return body
+
+    @staticmethod
+    def _run(pool, compute):
+        with pool.connection() as conn:
+            return compute(conn).encode('utf-8')
+
+    def _report_queries(self, conn, version):
+        """aggregate_queries (проверки сводных таблиц и таблицы покупателей) -
+        один раз на версию данных, а не на каждый промах кэша"""
+        with self._queries_lock:
+            if self._queries is None or self._queries[0] != version:
+                self._queries = (version, aggregate_queries(conn))
+            return self._queries[1]
+
+    async def report(self, name):
+        if name not in REPORTS:
+            raise HTTPError(404, f"неизвестный отчёт: {name}")
+        version = self.data_version()
+        return await self.get(('report', name), lambda conn: _frame_json(
+            read_sql(self._report_queries(conn, version)[name], conn, name=name)))
+
+    async def top(self, query):
+        params = {}
+        for name, value in parse_qsl(query, keep_blank_values=False):
+            if name != 'n' and name not in FILTERS:
+                raise HTTPError(400, f"неизвестный параметр: {name}")
+            try:
+                params[name] = PARAM_TYPES.get(name, str)(value)
+            except ValueError:
+                raise HTTPError(400, f"неверное значение {name}: {value}")
+        n = params.pop('n', 10)
+        if not 0 < n <= MAX_TOP_N:
+            raise HTTPError(400, f"n должно быть от 1 до {MAX_TOP_N}")
+        key = ('top', n, tuple(sorted(params.items())))
+        return await self.get(key, lambda conn: _frame_json(top_sales(conn, n, **params)))
+
+    def health(self):
+        version = self.data_version()
+        return json.dumps({'status': 'ok', 'data_version': list(version),
+                           'workers': self.workers, 'cached': len(self._cache),
+                           'in_flight': len(self._in_flight), **self.stats}).encode('utf-8')
+
+    async def dispatch(self, method, target):
+        if method != 'GET':
+            raise HTTPError(405, "поддерживается только GET")
+        url = urlsplit(target)
+        path = url.path.rstrip('/') or '/'
+        if path == '/health':
+            return self.health()
+        if path == '/reports':
+            return json.dumps({'reports': REPORTS, 'data_version': list(self.data_version())},
+                              ensure_ascii=False).encode('utf-8')
+        if path.startswith('/reports/'):
+            return await self.report(path[len('/reports/'):])
+        if path == '/sales/top':
+            return await self.top(url.query)
+        raise HTTPError(404, f"неизвестный адрес: {path}")
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        if self.pool is not None:
+            self.pool.close()
+        if self._watcher is not None:
+            self._watcher.close()
+
+
+async def _read_request(reader):
+    """Метод, путь и заголовки очередного запроса; None, если клиент закрыл соединение"""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError:
+        return None
+    except asyncio.LimitOverrunError:
+        raise HTTPError(431, "слишком длинные заголовки")
+    lines = head.decode('latin-1').split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ")
+    except ValueError:
+        raise HTTPError(400, "неверная строка запроса")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0) or 0)
+    if length:
+        await reader.readexactly(length)
+    keep_alive = (headers.get('connection', '').lower() != 'close'
+                  if version == 'HTTP/1.1' else
+                  headers.get('connection', '').lower() == 'keep-alive')
+    return method, target, keep_alive
+
+
+def _response(status, body, keep_alive):
+    head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode('latin-1') + body
+
+
+async def serve(service, host='127.0.0.1', port=8080):
+    async def handle(reader, writer):
+        try:
+            while True:
+                keep_alive = False
+                try:
+                    request = await _read_request(reader)
+                    if request is None:
+                        break
+                    method, target, keep_alive = request
+                    status, body = 200, await service.dispatch(method, target)
+                except HTTPError as error:
+                    status = error.status
+                    body = json.dumps({'error': str(error)}, ensure_ascii=False).encode('utf-8')
+                except Exception as error:  # ошибка одного запроса не останавливает сервис
+                    status = 500
+                    body = json.dumps({'error': str(error)}, ensure_ascii=False).encode('utf-8')
+                writer.write(_response(status, body, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port, limit=MAX_HEADER_BYTES,
+                                        backlog=1024)
+    print(f"Сервис отчётов: http://{host}:{port}/reports (база {service.db_path}, "
+          f"потоков {service.workers})")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP-сервис отчётов по продажам")
+    parser.add_argument("--db", default="retail_sales.db", help="путь к базе данных SQLite")
+    parser.add_argument("--host", default="127.0.0.1", help="адрес для входящих соединений")
+    parser.add_argument("--port", type=int, default=8080, help="порт")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="число потоков и соединений с базой")
+    args = parser.parse_args(argv)
+
+    service = ReportService(args.db, args.workers)
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
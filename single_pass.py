@@ -0,0 +1,212 @@
+"""Однопроходный расчёт агрегатов execute_sql_queries.
+
+Таблица retail_sales читается один раз, после чего все результаты
+(age_gender_sales, category_gender_sales, monthly_sales, correlation_data,
+age_group_comparison, category_by_age, seasonality) считаются в памяти
+из одних и тех же колонок. Возрастная группа вычисляется один раз, а
+группировки строятся из одной мелкой агрегации по
+(возрастная группа, пол, категория, месяц).
+"""
+import sqlite3
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+import columnar
+import profiler
+
+AGE_BINS = (
+    (18, 25, '18-25', 'Молодежь'),
+    (26, 35, '26-35', 'Молодые взрослые'),
+    (36, 45, '36-45', 'Средний возраст'),
+    (46, 55, '46-55', 'Зрелые'),
+)
+AGE_OTHER = ('55+', 'Пенсионный')
+
+MONTH_NAMES = {
+    '01': 'Январь', '02': 'Февраль', '03': 'Март', '04': 'Апрель',
+    '05': 'Май', '06': 'Июнь', '07': 'Июль', '08': 'Август',
+    '09': 'Сентябрь', '10': 'Октябрь', '11': 'Ноябрь', '12': 'Декабрь',
+}
+
+CATEGORY_CODES = {'Electronics': 1, 'Clothing': 2, 'Beauty': 3}
+
+BASE_COLUMNS = ['date', 'customer_id', 'gender', 'age', 'product_category',
+                'quantity', 'price_per_unit', 'total_amount']
+BASE_QUERY = f"SELECT {', '.join(BASE_COLUMNS)} FROM retail_sales"
+
+
+def age_groups(age):
+    """Возрастные группы как в CASE запросов Data_SQL.py (всё вне диапазонов - '55+')"""
+    age = np.asarray(age)
+    conditions = [(age >= low) & (age <= high) for low, high, _, _ in AGE_BINS]
+    return np.select(conditions, [label for _, _, label, _ in AGE_BINS], default=AGE_OTHER[0])
+
+
+def _sql_round(values, digits=2):
+    """ROUND(x, digits) самой SQLite для Series значений.
+
+    Половину SQLite округляет по десятичной записи числа, а не по двоичному
+    значению (16.525 - это 16.52499... в double, но ROUND даёт 16.53),
+    поэтому формула на numpy расходится с запросами Data_SQL.py. Групп в
+    отчётах немного: значения округляет SQLite в базе в памяти.
+    """
+    with closing(sqlite3.connect(":memory:")) as conn:
+        conn.execute("CREATE TABLE v (x REAL)")
+        conn.executemany("INSERT INTO v VALUES (?)", ((float(x),) for x in values))
+        rounded = [x for (x,) in conn.execute("SELECT ROUND(x, ?) FROM v ORDER BY rowid",
+                                              (digits,))]
+    return pd.Series(rounded, index=values.index, dtype='float64')
+
+
+def month_labels(dates):
+    """'YYYY-MM' по датам-строкам ISO или по datetime64 (колоночная копия)"""
+    if dates.dtype == object or pd.api.types.is_string_dtype(dates):
+        return dates.str[:7]
+    months, inverse = np.unique(dates.to_numpy().astype('datetime64[M]'), return_inverse=True)
+    return pd.Series(months.astype(str)[inverse], index=dates.index)
+
+
+def _totals(grouped):
+    """COUNT/SUM/AVG по сгруппированной мелкой агрегации"""
+    totals = grouped[['count', 'sales', 'items']].sum()
+    totals['avg'] = totals['sales'] / totals['count']
+    return totals.reset_index()
+
+
+def age_group_comparison_frame(by_age):
+    """Результат age_group_comparison из итогов по группам _totals() с unique_customers"""
+    labels = {label: f'{label} ({title})' for _, _, label, title in AGE_BINS}
+    labels[AGE_OTHER[0]] = f'{AGE_OTHER[0]} ({AGE_OTHER[1]})'
+    by_age = by_age.sort_values('age_group', kind='stable', ignore_index=True)
+    return pd.DataFrame({
+        'age_group': by_age['age_group'].map(labels),
+        'unique_customers': by_age['unique_customers'],
+        'total_transactions': by_age['count'],
+        'total_revenue': _sql_round(by_age['sales']),
+        'avg_transaction': _sql_round(by_age['avg']),
+        'total_items': by_age['items'],
+        'avg_items': _sql_round(by_age['items'] / by_age['count']),
+        'revenue_per_customer': _sql_round(by_age['sales'] / by_age['unique_customers']),
+        'transactions_percentage': _sql_round(100.0 * by_age['count'] / by_age['count'].sum()),
+    })
+
+
+def seasonality_frame(by_month):
+    """Результат seasonality из итогов по month_num с unique_customers"""
+    return pd.DataFrame({
+        'month_num': by_month['month_num'],
+        'month_name': by_month['month_num'].map(MONTH_NAMES),
+        'transactions': by_month['count'],
+        'total_sales': by_month['sales'],
+        'avg_sale': by_month['avg'],
+        'total_items': by_month['items'],
+        'unique_customers': by_month['unique_customers'],
+    })
+
+
+def compute_reports(conn, columnar_dir=None):
+    """Все агрегированные результаты execute_sql_queries за одно чтение таблицы
+
+    Если columnar_dir указывает на актуальную колоночную копию
+    (columnar.export_columnar), данные читаются из неё, а не из SQLite.
+    """
+    if columnar_dir and columnar.is_fresh(columnar_dir, conn):
+        df = columnar.load_frame(columnar_dir, BASE_COLUMNS)
+    else:
+        df = profiler.read_sql_query(BASE_QUERY, conn, name='single_pass_base')
+
+    df['age_group'] = age_groups(df['age'].to_numpy())
+    df['month'] = month_labels(df['date'])
+
+    # Мелкая агрегация, из которой собираются все группировки без DISTINCT
+    base = (df.groupby(['age_group', 'gender', 'product_category', 'month'], sort=False)
+              .agg(count=('total_amount', 'size'),
+                   sales=('total_amount', 'sum'),
+                   items=('quantity', 'sum'))
+              .reset_index())
+
+    # 2.1 Продажи по возрастным группам и полу
+    age_gender = _totals(base.groupby(['age_group', 'gender']))
+    age_gender_sales = pd.DataFrame({
+        'age_group': age_gender['age_group'],
+        'gender': age_gender['gender'],
+        'transaction_count': age_gender['count'],
+        'total_sales': age_gender['sales'],
+        'avg_transaction_value': age_gender['avg'],
+        'total_items': age_gender['items'],
+    })
+
+    # 2.2 Продажи по полу в категориях
+    category_gender = _totals(base.groupby(['product_category', 'gender']))
+    category_gender_sales = pd.DataFrame({
+        'product_category': category_gender['product_category'],
+        'gender': category_gender['gender'],
+        'transaction_count': category_gender['count'],
+        'total_sales': category_gender['sales'],
+        'avg_sale': category_gender['avg'],
+        'total_quantity': category_gender['items'],
+    })
+
+    # 2.3 Динамика продаж по месяцам
+    month_gender = _totals(base.groupby(['month', 'gender']))
+    monthly_sales = pd.DataFrame({
+        'month': month_gender['month'],
+        'gender': month_gender['gender'],
+        'transactions': month_gender['count'],
+        'monthly_sales': month_gender['sales'],
+        'avg_transaction': month_gender['avg'],
+        'items_sold': month_gender['items'],
+    })
+
+    # 3.1 Данные для корреляционной матрицы
+    correlation_data = pd.DataFrame({
+        'age': df['age'],
+        'is_male': (df['gender'] == 'Male').astype('int64'),
+        'quantity': df['quantity'],
+        'price_per_unit': df['price_per_unit'],
+        'total_amount': df['total_amount'],
+        'category_code': df['product_category'].map(CATEGORY_CODES),
+    })
+
+    # 3.2 Сравнение по возрастным группам
+    by_age = _totals(base.groupby('age_group'))
+    by_age['unique_customers'] = by_age['age_group'].map(
+        df.drop_duplicates(['age_group', 'customer_id'])['age_group'].value_counts())
+    age_group_comparison = age_group_comparison_frame(by_age)
+
+    # 3.3 Популярность категорий по возрастным группам
+    age_category = _totals(base.groupby(['age_group', 'product_category']))
+    group_total = age_category.groupby('age_group')['count'].transform('sum')
+    age_category = age_category.assign(share=_sql_round(100.0 * age_category['count'] / group_total))
+    age_category = age_category.sort_values(['age_group', 'sales'], ascending=[True, False],
+                                            kind='stable', ignore_index=True)
+    category_by_age = pd.DataFrame({
+        'age_group': age_category['age_group'],
+        'product_category': age_category['product_category'],
+        'purchases': age_category['count'],
+        'category_revenue': age_category['sales'],
+        'avg_spent': age_category['avg'],
+        'items_bought': age_category['items'],
+        'category_percentage': age_category['share'],
+    })
+
+    # 3.4 Сезонность продаж
+    base['month_num'] = base['month'].str[5:7]
+    by_month = _totals(base.groupby('month_num'))
+    month_num = df['month'].str[5:7]
+    by_month['unique_customers'] = by_month['month_num'].map(
+        df.assign(month_num=month_num).drop_duplicates(['month_num', 'customer_id'])['month_num']
+          .value_counts())
+    seasonality = seasonality_frame(by_month)
+
+    return {
+        'age_gender_sales': age_gender_sales,
+        'category_gender_sales': category_gender_sales,
+        'monthly_sales': monthly_sales,
+        'correlation_data': correlation_data,
+        'age_group_comparison': age_group_comparison,
+        'category_by_age': category_by_age,
+        'seasonality': seasonality,
+    }
@@ -0,0 +1,367 @@
+"""Приближённый подсчёт уникальных покупателей (HyperLogLog).
+
+COUNT(DISTINCT customer_id) по группам заставляет SQLite строить
+временное B-дерево на каждый запрос. Вместо этого при загрузке для каждой
+ячейки (месяц, пол, возраст, категория) хранится скетч HyperLogLog по
+customer_id: 2^precision однобайтовых регистров, сжатых zlib. Скетчи
+объединяются поэлементным максимумом регистров, поэтому число уникальных
+покупателей для любой комбинации возрастной группы, месяца, пола и
+категории получается из уже посчитанных ячеек, без чтения транзакций.
+
+Относительная стандартная ошибка оценки - 1.04 / sqrt(2^precision):
+precision=12 даёт ~1.6%, 14 - ~0.8%. Скетч умеет только добавлять
+значения: при загрузке с on_duplicate='update' строка, перенесённая в
+другую ячейку, остаётся учтённой и в старой, пока скетчи не пересобраны
+(build_sketches).
+"""
+import math
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from rollup import ROLLUP_TABLE
+from single_pass import age_group_comparison_frame, age_groups, seasonality_frame
+
+SKETCH_TABLE = "retail_sales_customer_sketch"
+SKETCH_META_TABLE = "retail_sales_customer_sketch_meta"
+DEFAULT_PRECISION = 12
+MIN_PRECISION, MAX_PRECISION = 4, 16
+# Сколько изменений регистров SketchBuilder копит до первой свёртки
+COMPACT_UPDATES = 1_000_000
+
+SKETCH_DDL = f"""
+CREATE TABLE IF NOT EXISTS {SKETCH_TABLE} (
+    month TEXT NOT NULL,
+    gender TEXT NOT NULL,
+    age INTEGER NOT NULL,
+    product_category TEXT NOT NULL,
+    registers BLOB NOT NULL,
+    PRIMARY KEY (month, gender, age, product_category)
+) WITHOUT ROWID
+"""
+CELL_COLUMNS = ['month', 'gender', 'age', 'product_category']
+
+
+def standard_error(precision):
+    return 1.04 / math.sqrt(1 << precision)
+
+
+def precision_for_error(error):
+    """Наименьшая точность, при которой стандартная ошибка не больше error"""
+    precision = math.ceil(math.log2((1.04 / error) ** 2))
+    return min(MAX_PRECISION, max(MIN_PRECISION, precision))
+
+
+def has_sketches(conn):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (SKETCH_META_TABLE,)
+    ).fetchone()
+    return row is not None
+
+
+def read_precision(conn):
+    """Точность скетчей в базе или None, если их нет"""
+    if not has_sketches(conn):
+        return None
+    row = conn.execute(f"SELECT precision FROM {SKETCH_META_TABLE}").fetchone()
+    return row[0] if row else None
+
+
+def _leading_zeros(values):
+    """Число ведущих нулевых битов uint64 (для нуля - 64)"""
+    values = values.astype(np.uint64)
+    zeros = np.zeros(len(values), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        empty = values < (np.uint64(1) << np.uint64(64 - shift))
+        zeros += np.where(empty, shift, 0)
+        values = np.where(empty, values << np.uint64(shift), values)
+    zeros += (values == 0)
+    return zeros
+
+
+def register_updates(customer_ids, precision):
+    """Номера регистров и ранги для значений (хэш - pandas.util.hash_array)"""
+    hashes = pd.util.hash_array(np.asarray(customer_ids, dtype=object))
+    index = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    rest = hashes << np.uint64(precision)
+    rank = np.minimum(_leading_zeros(rest) + 1, 64 - precision + 1)
+    return index, rank.astype(np.uint8)
+
+
+def _pack(registers):
+    return zlib.compress(registers.tobytes(), 1)
+
+
+def _unpack(blobs, precision):
+    """Матрица регистров (ячейка x регистр) из сжатых BLOB"""
+    size = 1 << precision
+    if not len(blobs):
+        return np.zeros((0, size), dtype=np.uint8)
+    return np.frombuffer(b"".join(zlib.decompress(blob) for blob in blobs),
+                         dtype=np.uint8).reshape(-1, size)
+
+
+def estimate(registers):
+    """Оценка HyperLogLog по строкам матрицы регистров (с линейным подсчётом
+    для малых значений)"""
+    registers = np.atleast_2d(registers)
+    size = registers.shape[1]
+    alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(size, 0.7213 / (1 + 1.079 / size))
+    raw = alpha * size * size / np.power(2.0, -registers.astype(np.float64)).sum(axis=1)
+    zeros = (registers == 0).sum(axis=1)
+    with np.errstate(divide='ignore'):
+        linear = size * np.log(size / np.maximum(zeros, 1))
+    return np.where((raw <= 2.5 * size) & (zeros > 0), linear, raw)
+
+
+class SketchBuilder:
+    """Накопление скетчей за загрузку; в базу они пишутся одним flush().
+
+    До flush() хранятся только изменения регистров - пары (ячейка и номер
+    регистра, ранг), свёрнутые до максимального ранга: их не больше, чем
+    строк в загрузке, тогда как полные скетчи всех ячеек при precision=16
+    заняли бы сотни мегабайт.
+    """
+
+    def __init__(self, conn, precision=None):
+        stored = read_precision(conn)
+        if stored is not None and precision is not None and stored != precision:
+            raise ValueError(f"Скетчи в базе построены с точностью {stored}, а не {precision}; "
+                             "пересоздайте базу полной загрузкой")
+        self.precision = stored or precision or DEFAULT_PRECISION
+        self.size = 1 << self.precision
+        # Ячейка -> номер; изменение регистра - номер ячейки * size + номер регистра
+        self._cell_ids = {}
+        self._keys = []
+        self._ranks = []
+        self._pending = 0
+        self._compacted = 0
+        conn.execute(SKETCH_DDL)
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {SKETCH_META_TABLE} "
+                     "(precision INTEGER NOT NULL)")
+        if stored is None:
+            conn.execute(f"INSERT INTO {SKETCH_META_TABLE} (precision) VALUES (?)",
+                         (self.precision,))
+
+    def add(self, rows):
+        """rows - DataFrame с колонками CELL_COLUMNS и customer_id"""
+        if not len(rows):
+            return
+        index, rank = register_updates(rows['customer_id'].to_numpy(), self.precision)
+        codes, cells = pd.MultiIndex.from_frame(rows[CELL_COLUMNS]).factorize()
+        ids = np.array([self._cell_ids.setdefault((month, gender, int(age), category),
+                                                  len(self._cell_ids))
+                        for month, gender, age, category in cells], dtype=np.int64)
+        self._keys.append(ids[codes] * self.size + index)
+        self._ranks.append(rank)
+        self._pending += len(rank)
+        # Свёртка, когда несвёрнутых изменений стало больше, чем свёрнутых
+        if self._pending > max(COMPACT_UPDATES, self._compacted):
+            self._compact()
+
+    def _compact(self):
+        """Свёртка изменений: по одному (максимальному) рангу на регистр ячейки"""
+        if not self._keys:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+        keys = np.concatenate(self._keys)
+        ranks = np.concatenate(self._ranks)
+        order = np.lexsort((ranks, keys))
+        keys, ranks = keys[order], ranks[order]
+        # После сортировки по ключу и рангу последний ранг ключа - максимальный
+        last = np.r_[keys[1:] != keys[:-1], True]
+        keys, ranks = keys[last], ranks[last]
+        self._keys, self._ranks = [keys], [ranks]
+        self._pending = 0
+        self._compacted = len(keys)
+        return keys, ranks
+
+    def add_staging(self, conn, staging, fact, on_duplicate):
+        """Покупатели порции из staging до её записи в fact (как rollup.apply_staging)"""
+        query = f"""
+            SELECT substr(date, 1, 7) AS month, gender, age, product_category, customer_id
+            FROM {staging} s
+        """
+        if on_duplicate == 'skip':
+            query += (f" WHERE NOT EXISTS (SELECT 1 FROM {fact} f "
+                      "WHERE f.transaction_id = s.transaction_id)")
+        cursor = conn.execute(query)
+        self.add(pd.DataFrame.from_records(cursor.fetchall(),
+                                           columns=CELL_COLUMNS + ['customer_id']))
+
+    def flush(self, conn):
+        """Объединение накопленных скетчей с хранимыми и запись в SKETCH_TABLE.
+
+        Скетчи распаковываются и собираются по одной ячейке.
+        """
+        keys, ranks = self._compact()
+        if not len(keys):
+            return 0
+        cells = list(self._cell_ids)
+        cursor = conn.execute(f"SELECT {', '.join(CELL_COLUMNS)}, registers FROM {SKETCH_TABLE}")
+        stored = {tuple(row[:4]): row[4] for row in cursor}
+        cell_of = keys // self.size
+        starts = np.flatnonzero(np.r_[True, cell_of[1:] != cell_of[:-1]])
+        stops = np.r_[starts[1:], len(keys)]
+
+        def rows():
+            for start, stop in zip(starts, stops):
+                cell = cells[cell_of[start]]
+                if cell in stored:
+                    registers = _unpack([stored[cell]], self.precision)[0].copy()
+                else:
+                    registers = np.zeros(self.size, dtype=np.uint8)
+                index = keys[start:stop] % self.size
+                registers[index] = np.maximum(registers[index], ranks[start:stop])
+                yield (*cell, _pack(registers))
+
+        conn.executemany(f"INSERT OR REPLACE INTO {SKETCH_TABLE} "
+                         f"({', '.join(CELL_COLUMNS)}, registers) VALUES (?, ?, ?, ?, ?)", rows())
+        self._cell_ids.clear()
+        self._keys, self._ranks = [], []
+        self._compacted = 0
+        return len(starts)
+
+
+def build_sketches(conn, precision=None, chunk_size=100_000):
+    """Пересборка скетчей по всей таблице retail_sales (в открытой транзакции conn)"""
+    if has_sketches(conn):
+        precision = precision or read_precision(conn)
+        conn.execute(f"DROP TABLE IF EXISTS {SKETCH_TABLE}")
+        conn.execute(f"DROP TABLE {SKETCH_META_TABLE}")
+    builder = SketchBuilder(conn, precision)
+    cursor = conn.execute("SELECT substr(date, 1, 7), gender, age, product_category, customer_id "
+                          "FROM retail_sales")
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        builder.add(pd.DataFrame.from_records(rows, columns=CELL_COLUMNS + ['customer_id']))
+    return builder.flush(conn)
+
+
+def load_cells(conn):
+    """Ячейки сводки по (месяц, пол, возраст, категория) со скетчами покупателей.
+
+    Колонки: CELL_COLUMNS, count, sales, items (из rollup.ROLLUP_TABLE) и
+    registers (сжатые скетчи).
+    """
+    measures = pd.read_sql_query(f"""
+        SELECT substr(date, 1, 7) AS month, gender, age, product_category,
+               SUM(transactions) AS count, SUM(total_sales) AS sales, SUM(total_items) AS items
+        FROM {ROLLUP_TABLE}
+        GROUP BY month, gender, age, product_category
+    """, conn)
+    cursor = conn.execute(f"SELECT {', '.join(CELL_COLUMNS)}, registers FROM {SKETCH_TABLE}")
+    sketches = pd.DataFrame.from_records(cursor.fetchall(), columns=CELL_COLUMNS + ['registers'])
+    return measures.merge(sketches, on=CELL_COLUMNS, how='left')
+
+
+def merge_registers(cells, codes, sizes, precision):
+    """Скетчи групп для нескольких группировок за один проход по ячейкам.
+
+    codes - номера групп ячеек для каждой группировки, sizes - число групп
+    в них. Скетч группы - максимум регистров по её ячейкам; скетчи ячеек
+    распаковываются по одному, поэтому память - 2^precision байт на группу,
+    а не на ячейку (ячеек тысячи, групп - десятки).
+    """
+    size = 1 << precision
+    merged = [np.zeros((groups, size), dtype=np.uint8) for groups in sizes]
+    for cell, blob in enumerate(cells['registers']):
+        if not isinstance(blob, bytes):
+            # Ячейка без скетча - нулевые регистры
+            continue
+        registers = np.frombuffer(zlib.decompress(blob), dtype=np.uint8)
+        for cell_groups, target in zip(codes, merged):
+            row = target[cell_groups[cell]]
+            np.maximum(row, registers, out=row)
+    return merged
+
+
+def _group_codes(cells, keys):
+    if not isinstance(keys, dict):
+        keys = {name: cells[name] for name in keys}
+    frame = pd.DataFrame({name: np.asarray(values) for name, values in keys.items()})
+    codes, groups = pd.MultiIndex.from_frame(frame).factorize(sort=True)
+    return keys, codes, groups
+
+
+def group_cells(cells, keys, precision):
+    """COUNT/SUM/AVG и оценка уникальных покупателей по группам ячеек.
+
+    keys - имена колонок cells или {имя: массив значений по ячейкам}.
+    Возвращает DataFrame с ключами и колонками count, sales, items, avg,
+    unique_customers, отсортированный по ключам.
+    """
+    return group_cells_by(cells, [keys], precision)[0]
+
+
+def group_cells_by(cells, groupings, precision):
+    """group_cells для каждой из groupings; скетчи ячеек читаются один раз"""
+    grouped = [_group_codes(cells, keys) for keys in groupings]
+    merged = merge_registers(cells, [codes for _, codes, _ in grouped],
+                             [len(groups) for _, _, groups in grouped], precision)
+    return [_group_frame(cells, keys, codes, groups, registers)
+            for (keys, codes, groups), registers in zip(grouped, merged)]
+
+
+def _group_frame(cells, keys, codes, groups, merged):
+    totals = (cells[['count', 'sales', 'items']].groupby(codes).sum()
+              .reindex(range(len(groups)), fill_value=0))
+    result = pd.DataFrame(list(groups), columns=list(keys))
+    result['count'] = totals['count'].to_numpy()
+    result['sales'] = totals['sales'].to_numpy()
+    result['items'] = totals['items'].to_numpy()
+    result['avg'] = result['sales'] / result['count']
+    # Покупателей в группе не больше, чем транзакций: оценка HLL может быть выше
+    unique = np.minimum(estimate(merged), result['count'].to_numpy())
+    result['unique_customers'] = np.rint(unique).astype(np.int64)
+    return result
+
+
+def _require_precision(conn):
+    precision = read_precision(conn)
+    if precision is None:
+        raise ValueError("В базе нет скетчей покупателей: загрузите данные с --sketch-error")
+    return precision
+
+
+def unique_customers(conn, by=('month',), age_group=age_groups):
+    """Оценка числа уникальных покупателей по любой комбинации измерений.
+
+    by - из 'month', 'month_num', 'gender', 'age', 'age_group',
+    'product_category'. age_group - функция возраст -> группа (по
+    умолчанию группы single_pass.age_groups).
+    """
+    precision = _require_precision(conn)
+    cells = load_cells(conn)
+    keys = {}
+    for name in by:
+        if name == 'month_num':
+            keys[name] = cells['month'].str[5:7]
+        elif name == 'age_group':
+            keys[name] = age_group(cells['age'].to_numpy())
+        else:
+            keys[name] = cells[name]
+    return group_cells(cells, keys, precision)[list(by) + ['unique_customers']]
+
+
+# Отчёты Data_SQL.py с COUNT(DISTINCT customer_id), которые можно оценить по скетчам
+APPROXIMATE_REPORTS = ('age_group_comparison', 'seasonality')
+
+
+def approximate_reports(conn):
+    """age_group_comparison и seasonality по сводке и скетчам, без чтения транзакций.
+
+    Колонки и порядок строк те же, что у запросов Data_SQL.py; оценкой
+    являются unique_customers и revenue_per_customer.
+    """
+    precision = _require_precision(conn)
+    cells = load_cells(conn)
+    by_age, by_month = group_cells_by(
+        cells, [{'age_group': age_groups(cells['age'].to_numpy())},
+                {'month_num': cells['month'].str[5:7]}], precision)
+    return {
+        'age_group_comparison': age_group_comparison_frame(by_age),
+        'seasonality': seasonality_frame(by_month),
+    }
@@ -0,0 +1,236 @@
+"""Потоковые описательные статистики и корреляционная матрица.
+
+RunningStats хранит для набора числовых колонок число строк, средние,
+матрицу смешанных центральных моментов (сумма (x - mean_x)(y - mean_y)),
+минимумы и максимумы. Каждая порция строк сводится к своим моментам и
+объединяется с накопленными по формулам Чана-Голуба-Левека (обобщение
+алгоритма Уэлфорда на порции): вычисление за один проход, численно
+устойчивое (без разности больших сумм квадратов, как в E[x^2] - E[x]^2),
+а в памяти держится только одна порция. Состояния, посчитанные в разных
+потоках, процессах или партициях, объединяются merge() в любом порядке;
+to_dict()/from_dict() передают их между процессами.
+
+Строки, где хотя бы одно значение NULL, не учитываются (как dropna()
+перед расчётом), их число хранится в dropped.
+
+    stats = table_stats('retail_sales.db', workers=4)
+    stats.corr()        # = DataFrame.corr() по всей таблице
+    stats.describe()    # count, mean, std, min, max
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+import profiler
+from partitions import partition_paths
+from query_runner import connect_readonly
+from schema import KEY_COLUMN, TABLE_NAME
+
+CHUNK_ROWS = 100_000
+
+# Признаки корреляционной матрицы Data_SQL.py: имя -> выражение SQL
+CORRELATION_COLUMNS = {
+    'age': "age",
+    'is_male': "CASE WHEN gender = 'Male' THEN 1 ELSE 0 END",
+    'quantity': "quantity",
+    'price_per_unit': "price_per_unit",
+    'total_amount': "total_amount",
+    'category_code': """CASE
+        WHEN product_category = 'Electronics' THEN 1
+        WHEN product_category = 'Clothing' THEN 2
+        WHEN product_category = 'Beauty' THEN 3
+    END""",
+}
+
+
+class RunningStats:
+    """Число строк, средние, смешанные моменты, минимумы и максимумы колонок"""
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        k = len(self.columns)
+        self.count = 0
+        self.dropped = 0
+        self.mean_ = np.zeros(k)
+        self.m2 = np.zeros((k, k))
+        self.min_ = np.full(k, np.inf)
+        self.max_ = np.full(k, -np.inf)
+
+    def update(self, values):
+        """Добавление порции: двумерный массив (строки x колонки)"""
+        values = np.asarray(values, dtype=np.float64).reshape(-1, len(self.columns))
+        complete = ~np.isnan(values).any(axis=1)
+        if not complete.all():
+            self.dropped += int((~complete).sum())
+            values = values[complete]
+        if not len(values):
+            return self
+        chunk = RunningStats(self.columns)
+        chunk.count = len(values)
+        chunk.mean_ = values.mean(axis=0)
+        centered = values - chunk.mean_
+        chunk.m2 = centered.T @ centered
+        chunk.min_ = values.min(axis=0)
+        chunk.max_ = values.max(axis=0)
+        return self.merge(chunk)
+
+    def merge(self, other):
+        """Объединение с состоянием по другой части данных (на месте)"""
+        if other.columns != self.columns:
+            raise ValueError("Состояния посчитаны по разным колонкам")
+        self.dropped += other.dropped
+        if not other.count:
+            return self
+        if not self.count:
+            self.count = other.count
+            self.mean_ = other.mean_.copy()
+            self.m2 = other.m2.copy()
+        else:
+            count = self.count + other.count
+            delta = other.mean_ - self.mean_
+            self.mean_ = self.mean_ + delta * (other.count / count)
+            self.m2 = self.m2 + other.m2 + np.outer(delta, delta) * (self.count * other.count / count)
+            self.count = count
+        self.min_ = np.minimum(self.min_, other.min_)
+        self.max_ = np.maximum(self.max_, other.max_)
+        return self
+
+    def mean(self):
+        return pd.Series(self.mean_ if self.count else np.nan, index=self.columns)
+
+    def var(self, ddof=1):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return pd.Series(np.diag(self.m2) / (self.count - ddof), index=self.columns)
+
+    def std(self, ddof=1):
+        return np.sqrt(self.var(ddof))
+
+    def cov(self, ddof=1):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return pd.DataFrame(self.m2 / (self.count - ddof), index=self.columns,
+                                columns=self.columns)
+
+    def corr(self):
+        """Матрица корреляций Пирсона; для постоянной колонки - NaN, как в pandas"""
+        scale = np.sqrt(np.diag(self.m2))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = self.m2 / np.outer(scale, scale)
+        corr = np.clip(corr, -1.0, 1.0)
+        np.fill_diagonal(corr, np.where(scale > 0, 1.0, np.nan))
+        return pd.DataFrame(corr, index=self.columns, columns=self.columns)
+
+    def describe(self):
+        """count, mean, std, min, max по колонкам (как DataFrame.describe без квантилей)"""
+        empty = np.full(len(self.columns), np.nan)
+        return pd.DataFrame({
+            'count': float(self.count),
+            'mean': self.mean(),
+            'std': self.std(),
+            'min': self.min_ if self.count else empty,
+            'max': self.max_ if self.count else empty,
+        }, index=self.columns).T
+
+    def to_dict(self):
+        """Состояние в виде словаря из списков (JSON, pickle)"""
+        return {'columns': self.columns, 'count': self.count, 'dropped': self.dropped,
+                'mean': self.mean_.tolist(), 'm2': self.m2.tolist(),
+                'min': self.min_.tolist(), 'max': self.max_.tolist()}
+
+    @classmethod
+    def from_dict(cls, state):
+        stats = cls(state['columns'])
+        stats.count = state['count']
+        stats.dropped = state['dropped']
+        stats.mean_ = np.asarray(state['mean'], dtype=np.float64)
+        stats.m2 = np.asarray(state['m2'], dtype=np.float64)
+        stats.min_ = np.asarray(state['min'], dtype=np.float64)
+        stats.max_ = np.asarray(state['max'], dtype=np.float64)
+        return stats
+
+
+def merge_all(states, columns):
+    """Объединение последовательности состояний RunningStats в одно"""
+    total = RunningStats(columns)
+    for state in states:
+        total.merge(state)
+    return total
+
+
+def stats_query(columns=CORRELATION_COLUMNS, where=None, table=TABLE_NAME):
+    """SELECT выражений колонок {имя: SQL} с необязательным условием WHERE"""
+    select = ",\n    ".join(f"{sql} as {name}" for name, sql in columns.items())
+    query = f"SELECT \n    {select}\nFROM {table}"
+    if where:
+        query += f"\nWHERE {where}"
+    return query
+
+
+def query_stats(conn, columns=CORRELATION_COLUMNS, where=None, params=(),
+                chunk_rows=CHUNK_ROWS):
+    """RunningStats по результату запроса, читаемому порциями по chunk_rows строк"""
+    stats = RunningStats(columns)
+    cursor = conn.execute(stats_query(columns, where), params)
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            break
+        # None (NULL) превращается в NaN при преобразовании к float
+        stats.update(np.array(rows, dtype=np.float64))
+    return stats
+
+
+def _key_ranges(conn, parts):
+    """Деление диапазона KEY_COLUMN на parts примерно равных отрезков [lo, hi]"""
+    low, high = conn.execute(
+        f"SELECT MIN({KEY_COLUMN}), MAX({KEY_COLUMN}) FROM {TABLE_NAME}").fetchone()
+    if low is None:
+        return []
+    bounds = np.linspace(low, high + 1, parts + 1).astype(np.int64)
+    return [(int(lo), int(hi) - 1) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+
+def table_stats(db_path, columns=CORRELATION_COLUMNS, workers=None, pool=None,
+                chunk_rows=CHUNK_ROWS):
+    """RunningStats по всей таблице: диапазоны ключа считаются параллельно.
+
+    Каждый поток читает свой отрезок transaction_id (поиск по первичному
+    ключу) через своё read-only соединение - из pool (query_runner.
+    ConnectionPool), если он передан, - и частичные состояния объединяются.
+    """
+    workers = workers or (pool.size if pool is not None else os.cpu_count() or 1)
+
+    def connection():
+        return pool.connection() if pool is not None else closing(connect_readonly(db_path))
+
+    def run(key_range):
+        with connection() as conn:
+            return query_stats(conn, columns, f"{KEY_COLUMN} BETWEEN ? AND ?", key_range,
+                               chunk_rows)
+
+    with profiler.stage('потоковые статистики'):
+        with connection() as conn:
+            ranges = _key_ranges(conn, workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return merge_all(executor.map(run, ranges), columns)
+
+
+def partition_stats(partition_dir, columns=CORRELATION_COLUMNS, months=None, workers=None,
+                    chunk_rows=CHUNK_ROWS):
+    """RunningStats по месячным партициям (partitions.py), по потоку на партицию"""
+    paths = partition_paths(partition_dir)
+    months = list(paths) if months is None else [month for month in months if month in paths]
+
+    def run(month):
+        with closing(connect_readonly(paths[month])) as conn:
+            return query_stats(conn, columns, chunk_rows=chunk_rows)
+
+    if not months:
+        return RunningStats(columns)
+    workers = workers or min(len(months), os.cpu_count() or 1)
+    with profiler.stage('потоковые статистики (партиции)'):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return merge_all(executor.map(run, months), columns)
+
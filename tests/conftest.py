@@ -0,0 +1,23 @@
+"""Общие данные тестов: небольшая синтетическая база (generate_data.py)"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import data_load  # noqa: E402
+import generate_data  # noqa: E402
+
+ROWS = 20_000
+
+
+@pytest.fixture(scope="session")
+def db_path(tmp_path_factory):
+    """База из ROWS синтетических транзакций, загруженная data_load.py"""
+    directory = tmp_path_factory.mktemp("retail_sales")
+    csv_path = str(directory / "retail_sales.csv")
+    generate_data.generate_csv(csv_path, ROWS, seed=7)
+    path = str(directory / "retail_sales.db")
+    data_load.load_csv_streaming(csv_path, path)
+    return path
@@ -0,0 +1,40 @@
+"""Сверка движков агрегатов: DuckDB возвращает те же таблицы, что SQLite"""
+import pandas as pd
+import pytest
+
+import backends
+import columnar
+from Data_SQL import AGGREGATE_QUERIES
+
+
+@pytest.mark.parametrize("use_columnar", [False, True], ids=["sqlite", "parquet"])
+def test_duckdb_matches_sqlite(db_path, tmp_path, use_columnar):
+    pytest.importorskip("duckdb")
+    columnar_dir = None
+    if use_columnar:
+        pytest.importorskip("pyarrow")
+        columnar_dir = str(tmp_path / "columnar")
+        columnar.export_columnar(db_path, columnar_dir)
+    results = backends.parity(db_path, columnar_dir=columnar_dir)
+    differences = {name: difference for name, (_, _, difference) in results.items()
+                   if difference is not None}
+    assert differences == {}
+
+
+def test_rounded_columns():
+    assert backends.rounded_columns(AGGREGATE_QUERIES['age_group_comparison']) == {
+        'total_revenue': 2, 'avg_transaction': 2, 'avg_items': 2,
+        'revenue_per_customer': 2, 'transactions_percentage': 2}
+    assert backends.rounded_columns(AGGREGATE_QUERIES['category_by_age']) == {
+        'category_percentage': 2}
+    assert backends.rounded_columns(AGGREGATE_QUERIES['monthly_sales']) == {}
+
+
+def test_only_rounded_columns_tolerate_last_digit():
+    expected = pd.DataFrame({'avg_sale': [450.125], 'percentage': [16.53]})
+    rounded = {'percentage': 2}
+    backends.assert_parity(expected.assign(percentage=[16.52]), expected, rounded)
+    with pytest.raises(AssertionError):
+        backends.assert_parity(expected.assign(percentage=[16.51]), expected, rounded)
+    with pytest.raises(AssertionError):
+        backends.assert_parity(expected.assign(avg_sale=[450.13]), expected, rounded)
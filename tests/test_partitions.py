@@ -0,0 +1,44 @@
+"""Партиции догоняют основную базу после загрузки, прерванной между коммитами"""
+import sqlite3
+
+import pytest
+
+import data_load
+import generate_data
+import partitions
+
+
+def test_replay_after_interrupted_partition_commit(tmp_path, monkeypatch):
+    csv_path = str(tmp_path / "retail_sales.csv")
+    db_path = str(tmp_path / "retail_sales.db")
+    partition_dir = str(tmp_path / "partitions")
+    generate_data.generate_csv(csv_path, 2000, seed=3)
+
+    commit_partition = partitions._commit_partition
+    committed = []
+
+    def interrupted(conn, month, load_id):
+        if committed:
+            conn.close()
+            raise KeyboardInterrupt
+        commit_partition(conn, month, load_id)
+        committed.append(month)
+
+    monkeypatch.setattr(partitions, "_commit_partition", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        data_load.load_csv_streaming(csv_path, db_path, partition_dir=partition_dir)
+    monkeypatch.undo()
+
+    conn = sqlite3.connect(db_path)
+    try:
+        lagging = partitions.behind(conn, partition_dir)
+        assert lagging and committed[0] not in lagging
+        assert set(partitions.check(db_path, partition_dir)) == set(lagging)
+
+        stats = data_load.load_csv_streaming(csv_path, db_path, mode='incremental',
+                                             partition_dir=partition_dir)
+        assert stats['partitions_replayed'] == sorted(lagging)
+        assert partitions.behind(conn, partition_dir) == {}
+    finally:
+        conn.close()
+    assert partitions.check(db_path, partition_dir) == {}
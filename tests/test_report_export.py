@@ -0,0 +1,47 @@
+"""Лист, не помещающийся в Excel, продолжается в отдельном файле без повторного запроса"""
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import report_export
+
+LIMIT = 100
+QUERY = "SELECT transaction_id, total_amount FROM retail_sales ORDER BY transaction_id LIMIT ?"
+
+
+@pytest.mark.parametrize("overflow_format", report_export.OVERFLOW_FORMATS)
+def test_sheet_continues_in_overflow_file(db_path, tmp_path, monkeypatch, overflow_format):
+    pytest.importorskip("openpyxl")
+    if overflow_format == 'parquet':
+        pytest.importorskip("pyarrow")
+    monkeypatch.setattr(report_export, "EXCEL_MAX_ROWS", LIMIT)
+    path = str(tmp_path / "report.xlsx")
+    sheets = {
+        'fits': (QUERY, (LIMIT - 1,)),
+        'one_over': (QUERY, (LIMIT,)),
+        'large': (QUERY, (1000,)),
+    }
+    outputs = report_export.export_report(sheets, db_path, path, batch_size=30,
+                                          overflow_format=overflow_format)
+
+    assert outputs['fits'] == (path, LIMIT - 1)
+    assert outputs['one_over'][1] == LIMIT
+    assert outputs['large'][1] == 1000
+
+    conn = sqlite3.connect(db_path)
+    try:
+        for name, (query, params) in sheets.items():
+            expected = pd.read_sql_query(query, conn, params=params)
+            frame = pd.read_excel(path, sheet_name=name)
+            if name != 'fits':
+                assert len(frame) == LIMIT - 1
+                frame = frame.iloc[:-1]
+                if overflow_format == 'parquet':
+                    tail = pd.read_parquet(outputs[name][0])
+                else:
+                    tail = pd.read_csv(outputs[name][0])
+                frame = pd.concat([frame, tail], ignore_index=True)
+            pd.testing.assert_frame_equal(frame, expected, check_dtype=False)
+    finally:
+        conn.close()
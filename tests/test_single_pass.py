@@ -0,0 +1,25 @@
+"""Однопроходный движок возвращает те же таблицы, что запросы Data_SQL.py"""
+import sqlite3
+
+import pandas as pd
+
+from backends import assert_parity, rounded_columns
+from Data_SQL import AGGREGATE_QUERIES
+from single_pass import _sql_round, compute_reports
+
+
+def test_sql_round_matches_sqlite_half_way():
+    values = pd.Series([16.525, 1.005, 0.285, -16.525, 2.675])
+    conn = sqlite3.connect(":memory:")
+    expected = [conn.execute("SELECT ROUND(?, 2)", (value,)).fetchone()[0] for value in values]
+    assert _sql_round(values).tolist() == expected
+
+
+def test_compute_reports_matches_sql(db_path):
+    conn = sqlite3.connect(db_path)
+    results = compute_reports(conn)
+    for name, query in AGGREGATE_QUERIES.items():
+        expected = pd.read_sql_query(query, conn)
+        assert_parity(results[name], expected, check_dtype=False)
+        for column in rounded_columns(query):
+            assert results[name][column].tolist() == expected[column].tolist()
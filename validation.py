@@ -0,0 +1,208 @@
+"""Проверка порций CSV при загрузке: отбраковка строк в карантин.
+
+Каждая порция проверяется целиком операциями pandas/NumPy, без циклов по
+строкам и в том же проходе, что и загрузка. Строка, нарушившая хотя бы
+одно правило RULES, не попадает ни в retail_sales, ни в сводку, скетчи и
+партиции, а записывается в таблицу QUARANTINE_TABLE с исходными
+значениями и кодом причины - первого нарушенного правила в порядке RULES.
+Повтор Transaction ID ищется внутри порции и среди порций, уже
+прочитанных в этом запуске (IdRanges: подряд идущие ID хранятся одним
+отрезком, поэтому память не растёт с размером файла); совпадения с
+данными прошлых загрузок по-прежнему решает on_duplicate загрузчика.
+
+    python data_load.py                      # проверка включена по умолчанию
+    python data_load.py --no-validate        # загрузка без проверки
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from schema import COLUMNS, KEY_COLUMN, SCHEMA
+
+QUARANTINE_TABLE = "retail_sales_quarantine"
+
+AGE_RANGE = (18, 100)
+MIN_DATE = "2000-01-01"
+# Формат Date в CSV; другие записи даты (13/01/2023) отбраковываются как invalid_date
+DATE_FORMAT = "%Y-%m-%d"
+GENDERS = ("Male", "Female")
+CATEGORIES = ("Electronics", "Clothing", "Beauty")
+# Допустимое расхождение Total Amount и Quantity * Price per Unit (округление цен)
+AMOUNT_TOLERANCE = 0.01
+
+# Код причины -> описание; строка получает код первого нарушенного правила
+RULES = {
+    'missing_value': "пустое обязательное поле",
+    'invalid_number': "нечисловое или дробное значение в числовой колонке",
+    'invalid_date': f"дата не в формате {DATE_FORMAT}",
+    'duplicate_id': "Transaction ID повторяется в загружаемых данных",
+    'age_out_of_range': f"возраст вне диапазона {AGE_RANGE[0]}-{AGE_RANGE[1]}",
+    'date_out_of_range': f"дата раньше {MIN_DATE} или в будущем",
+    'unknown_gender': f"пол не из {', '.join(GENDERS)}",
+    'unknown_category': f"категория не из {', '.join(CATEGORIES)}",
+    'nonpositive_quantity': "количество меньше 1",
+    'nonpositive_price': "цена не больше 0",
+    'amount_mismatch': "Total Amount не равен Quantity * Price per Unit",
+}
+
+_TYPES = {column: (sql_type.split()[0], pandas_type)
+          for column, sql_type, pandas_type in SCHEMA.values()}
+_NUMERIC = [column for column, (sql_type, _) in _TYPES.items() if sql_type in ("INTEGER", "REAL")]
+
+QUARANTINE_DDL = f"""
+CREATE TABLE IF NOT EXISTS {QUARANTINE_TABLE} (
+    {", ".join(COLUMNS)},
+    reason TEXT NOT NULL,
+    source TEXT NOT NULL,
+    quarantined_at TEXT NOT NULL
+)
+"""
+
+
+def read_dtypes():
+    """dtype для pd.read_csv при проверке: числовые колонки без типа.
+
+    С заданным int64/float64 нечисловое значение в CSV прерывает всю
+    загрузку; без него pandas выводит тип сам (на чистых данных - тот же
+    числовой), а порции с мусором получают object и разбираются в check().
+    """
+    return {name: pandas_type for name, (column, _, pandas_type) in SCHEMA.items()
+            if column not in _NUMERIC}
+
+
+class IdRanges:
+    """Множество целых ID в виде отсортированных непересекающихся отрезков [start, end]"""
+
+    def __init__(self):
+        self.starts = np.empty(0, dtype=np.int64)
+        self.ends = np.empty(0, dtype=np.int64)
+
+    def contains(self, ids):
+        """Маска: какие из ids уже есть в множестве"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(self.starts):
+            return np.zeros(len(ids), dtype=bool)
+        position = np.searchsorted(self.starts, ids, side='right') - 1
+        return (position >= 0) & (ids <= self.ends[np.maximum(position, 0)])
+
+    def add(self, ids):
+        ids = np.sort(np.asarray(ids, dtype=np.int64))
+        if not len(ids):
+            return
+        ids = ids[np.r_[True, ids[1:] != ids[:-1]]]
+        # Отрезки подряд идущих ID порции, затем слияние с уже накопленными
+        breaks = np.flatnonzero(np.diff(ids) != 1) + 1
+        starts = np.concatenate([self.starts, ids[np.r_[0, breaks]]])
+        ends = np.concatenate([self.ends, ids[np.r_[breaks - 1, len(ids) - 1]]])
+        order = np.argsort(starts, kind='stable')
+        starts, ends = starts[order], ends[order]
+        reach = np.maximum.accumulate(ends)
+        first = np.flatnonzero(np.r_[True, starts[1:] > reach[:-1] + 1])
+        self.starts = starts[first]
+        self.ends = np.maximum.reduceat(ends, first)
+
+
+class ChunkValidator:
+    """Проверка порций одной загрузки; отбракованные строки пишутся в карантин"""
+
+    def __init__(self, conn, source):
+        self.source = source
+        self.checked = 0
+        self.rejected = 0
+        self.counts = dict.fromkeys(RULES, 0)
+        self._max_date = datetime.date.today().isoformat()
+        self._seen = IdRanges()
+        conn.execute(QUARANTINE_DDL)
+        self._insert_sql = (f"INSERT INTO {QUARANTINE_TABLE} ({', '.join(COLUMNS)}, reason, "
+                            f"source, quarantined_at) VALUES "
+                            f"({', '.join('?' * (len(COLUMNS) + 2))}, datetime('now'))")
+
+    def check(self, conn, chunk):
+        """Порция CSV -> прошедшие проверку строки, приведённые к схеме (как _normalize_chunk)"""
+        raw = chunk.rename(columns={name: column for name, (column, _, _) in SCHEMA.items()})
+        raw = raw[COLUMNS]
+        reason = pd.Series(None, index=raw.index, dtype=object)
+
+        def reject(code, mask):
+            # Первое нарушенное правило не перезаписывается следующими
+            reason.mask(mask & reason.isna(), code, inplace=True)
+
+        # Пустые поля pd.read_csv уже прочитал как NaN
+        missing = raw.isna()
+        reject('missing_value', missing.any(axis=1))
+
+        values = {}
+        invalid = pd.Series(False, index=raw.index)
+        for column in _NUMERIC:
+            numbers = pd.to_numeric(raw[column], errors='coerce')
+            bad = ~missing[column] & numbers.isna()
+            if _TYPES[column][0] == "INTEGER":
+                bad |= numbers.notna() & (numbers % 1 != 0)
+            invalid |= bad
+            values[column] = numbers
+        reject('invalid_number', invalid)
+
+        dates = pd.to_datetime(raw['date'], format=DATE_FORMAT, errors='coerce')
+        reject('invalid_date', ~missing['date'] & dates.isna())
+        iso_dates = dates.dt.strftime('%Y-%m-%d')
+
+        # Повторы внутри порции: первая из строк, прошедших проверки выше, остаётся
+        ids = values[KEY_COLUMN]
+        reject('duplicate_id', ids.where(reason.isna()).duplicated(keep='first') & ids.notna())
+
+        age = values['age']
+        reject('age_out_of_range', (age < AGE_RANGE[0]) | (age > AGE_RANGE[1]))
+        reject('date_out_of_range', (iso_dates < MIN_DATE) | (iso_dates > self._max_date))
+        reject('unknown_gender', ~raw['gender'].isin(GENDERS))
+        reject('unknown_category', ~raw['product_category'].isin(CATEGORIES))
+        quantity, price = values['quantity'], values['price_per_unit']
+        reject('nonpositive_quantity', quantity < 1)
+        reject('nonpositive_price', price <= 0)
+        reject('amount_mismatch',
+               ~np.isclose(values['total_amount'], quantity * price, rtol=0,
+                           atol=AMOUNT_TOLERANCE))
+
+        # Повторы ID, прочитанных в прошлых порциях этого запуска
+        passed = reason.isna()
+        passed_ids = ids[passed].to_numpy(dtype=np.int64)
+        repeated = self._seen.contains(passed_ids)
+        if repeated.any():
+            duplicate = np.zeros(len(raw), dtype=bool)
+            duplicate[passed.to_numpy()] = repeated
+            reject('duplicate_id', pd.Series(duplicate, index=raw.index))
+            passed = reason.isna()
+        self._seen.add(passed_ids)
+
+        self.checked += len(raw)
+        if not passed.all():
+            self._quarantine(conn, raw[~passed], reason[~passed])
+
+        valid = pd.DataFrame({column: values[column][passed] if column in values
+                              else raw[column][passed] for column in COLUMNS})
+        valid['date'] = iso_dates[passed].astype(object)
+        return valid.astype({column: pandas_type for column, (_, pandas_type) in _TYPES.items()
+                             if column in values})
+
+    def _quarantine(self, conn, rows, reasons):
+        self.rejected += len(rows)
+        for code, count in reasons.value_counts().items():
+            self.counts[code] += int(count)
+        # Исходные значения как есть (в том числе нечисловые); NaN -> NULL
+        records = rows.astype(object).where(rows.notna(), None)
+        records['reason'] = reasons
+        records['source'] = self.source
+        conn.executemany(self._insert_sql, records.itertuples(index=False, name=None))
+
+    def report(self):
+        """Итоги проверки: число строк, отбраковано, {код причины: строк} (ненулевые)"""
+        return {'checked': self.checked, 'rejected': self.rejected,
+                'by_rule': {code: count for code, count in self.counts.items() if count}}
+
+
+def format_report(report):
+    lines = [f"Проверено строк: {report['checked']}, в карантин ({QUARANTINE_TABLE}): "
+             f"{report['rejected']}"]
+    for code, count in report['by_rule'].items():
+        lines.append(f"  {code:<22} {count:>10}  {RULES[code]}")
+    return "\n".join(lines)
@@ -1,60 +1,62 @@
+import argparse
+import hashlib
+import os
 import sqlite3
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
 import numpy as np
-from datetime import datetime
+import pandas as pd
+
+import profiler
+from queries import sales_query, top_sales_query
+from query_cache import read_sql
+from rollup import ROLLUP_TABLE, has_rollup
 
-# Подключение к базе данных
-conn = sqlite3.connect('retail_sales.db')
+# matplotlib и seaborn импортируются внутри функций построения графиков:
+# модуль можно импортировать ради запросов и экспорта, не загружая их.
+# Так же в ветках, которые их используют, импортируются необязательные
+# движки (backends, sketches, streaming_stats) и report_export
+DB_PATH = 'retail_sales.db'
+FIGURE_FORMATS = ('png', 'svg', 'pdf')
+# Совпадают с backends.BACKENDS и report_export.OVERFLOW_FORMATS
+# (продублированы, чтобы не импортировать модули)
+BACKENDS = ('sqlite', 'duckdb')
+OVERFLOW_FORMATS = ('csv.gz', 'parquet')
+AGE_GROUP_COLORS = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFEAA7']
 
-# 1. SQL запросы с условиями фильтрации
-print("="*50)
-print("SQL ЗАПРОСЫ С ФИЛЬТРАЦИЕЙ")
-print("="*50)
+# Базовые наборы данных: каждый читается из базы один раз, все графики
+# и листы Excel строятся из них в памяти
+QUERIES = {}
+
+# Запросы 1-3 - (SQL, параметры) из библиотеки запросов queries.py
+
+# Запросы 1-2 по убыванию суммы: имя -> (колонки, n, фильтры); для вывода на
+# экран топ читается из лидербордов (leaderboard.py), если они есть в базе
+TOP_QUERIES = {}
 
 # Запрос 1: Продажи для женщин старше 50 лет
-query1 = """
-SELECT customer_id, age, gender, product_category, total_amount
-FROM retail_sales
-WHERE gender = 'Female' AND age > 50
-ORDER BY total_amount DESC
-LIMIT 10
-"""
-df_female_over50 = pd.read_sql_query(query1, conn)
-print("\n1. Топ-10 покупок женщин старше 50 лет:")
-print(df_female_over50)
+TOP_QUERIES['female_over50'] = (
+    ('customer_id', 'age', 'gender', 'product_category', 'total_amount'),
+    10, {'gender': 'Female', 'min_age': 51})
 
 # Запрос 2: Покупки в категории Electronics с суммой больше 1000
-query2 = """
-SELECT date, customer_id, product_category, quantity, total_amount
-FROM retail_sales
-WHERE product_category = 'Electronics' AND total_amount > 1000
-ORDER BY total_amount DESC
-"""
-df_electronics_high = pd.read_sql_query(query2, conn)
-print("\n2. Покупки Electronics на сумму > 1000:")
-print(df_electronics_high.head(10))
+TOP_QUERIES['electronics_high'] = (
+    ('date', 'customer_id', 'product_category', 'quantity', 'total_amount'),
+    None, {'category': 'Electronics', 'amount_above': 1000})
 
-# Запрос 3: Молодые покупатели (18-25 лет) в категории Beauty
-query3 = """
-SELECT customer_id, age, gender, quantity, total_amount
-FROM retail_sales
-WHERE product_category = 'Beauty' AND age BETWEEN 18 AND 25
-ORDER BY age
-"""
-df_beauty_young = pd.read_sql_query(query3, conn)
-print("\n3. Молодые покупатели (18-25 лет) в категории Beauty:")
-print(df_beauty_young.head(10))
+QUERIES.update({name: top_sales_query(columns, n, **filters)
+                for name, (columns, n, filters) in TOP_QUERIES.items()})
 
-# 2. SQL запросы с агрегатными функциями
-print("\n" + "="*50)
-print("АГРЕГАЦИОННЫЕ ЗАПРОСЫ")
-print("="*50)
+# Запрос 3: Молодые покупатели (18-25 лет) в категории Beauty
+QUERIES['beauty_young'] = sales_query(
+    ('customer_id', 'age', 'gender', 'quantity', 'total_amount'),
+    order_by='age', category='Beauty', min_age=18, max_age=25)
 
 # Запрос 4: Статистика по возрасту и полу
-query4 = """
-SELECT 
+QUERIES['age_gender_stats'] = """
+SELECT
     gender,
     COUNT(*) as transaction_count,
     AVG(age) as avg_age,
@@ -64,14 +66,12 @@ SELECT
     AVG(total_amount) as avg_transaction
 FROM retail_sales
 GROUP BY gender
+ORDER BY gender
 """
-df_age_gender_stats = pd.read_sql_query(query4, conn)
-print("\n4. Статистика по полу:")
-print(df_age_gender_stats)
 
 # Запрос 5: Продажи по полу в категориях
-query5 = """
-SELECT 
+QUERIES['category_gender'] = """
+SELECT
     product_category,
     gender,
     COUNT(*) as transactions,
@@ -82,13 +82,10 @@ FROM retail_sales
 GROUP BY product_category, gender
 ORDER BY product_category, gender
 """
-df_category_gender = pd.read_sql_query(query5, conn)
-print("\n5. Продажи по полу в категориях:")
-print(df_category_gender)
 
 # Запрос 6: Динамика продаж по месяцам
-query6 = """
-SELECT 
+QUERIES['monthly'] = """
+SELECT
     strftime('%Y-%m', date) as month,
     gender,
     COUNT(*) as transactions,
@@ -96,16 +93,13 @@ SELECT
     AVG(total_amount) as avg_sale
 FROM retail_sales
 GROUP BY month, gender
-ORDER BY month
+ORDER BY month, gender
 """
-df_monthly = pd.read_sql_query(query6, conn)
-print("\n6. Динамика продаж по месяцам:")
-print(df_monthly.head(15))
 
 # Запрос 7: Сравнение по возрастным группам
-query7 = """
-SELECT 
-    CASE 
+QUERIES['age_groups'] = """
+SELECT
+    CASE
         WHEN age < 25 THEN '18-24'
         WHEN age BETWEEN 25 AND 34 THEN '25-34'
         WHEN age BETWEEN 35 AND 44 THEN '35-44'
@@ -120,7 +114,7 @@ SELECT
     AVG(quantity) as avg_items
 FROM retail_sales
 GROUP BY age_group
-ORDER BY 
+ORDER BY
     CASE age_group
         WHEN '18-24' THEN 1
         WHEN '25-34' THEN 2
@@ -129,143 +123,521 @@ ORDER BY
         ELSE 5
     END
 """
-df_age_groups = pd.read_sql_query(query7, conn)
-print("\n7. Сравнение по возрастным группам:")
-print(df_age_groups)
-
-# 3. ВИЗУАЛИЗАЦИЯ ДАННЫХ
-print("\n" + "="*50)
-print("СОЗДАНИЕ ВИЗУАЛИЗАЦИЙ")
-print("="*50)
-
-# Настройка стиля для всех графиков
-plt.style.use('seaborn-v0_8-darkgrid')
-sns.set_palette("husl")
-
-# 1. Продажи по возрасту и полу
-fig, axes = plt.subplots(2, 3, figsize=(18, 12))
-fig.suptitle('Анализ розничных продаж', fontsize=16, fontweight='bold')
-
-# График 1: Распределение продаж по возрасту
-df_all = pd.read_sql_query("SELECT age, gender, total_amount FROM retail_sales", conn)
-for gender in df_all['gender'].unique():
-    data = df_all[df_all['gender'] == gender]
-    axes[0, 0].hist(data['age'], bins=20, alpha=0.6, label=gender, edgecolor='black')
-axes[0, 0].set_xlabel('Возраст')
-axes[0, 0].set_ylabel('Количество транзакций')
-axes[0, 0].set_title('Распределение продаж по возрасту')
-axes[0, 0].legend()
-axes[0, 0].grid(True, alpha=0.3)
-
-# График 2: Продажи по полу в категориях
-df_cat = pd.read_sql_query("""
-    SELECT product_category, gender, SUM(total_amount) as total_sales
-    FROM retail_sales
-    GROUP BY product_category, gender
-""", conn)
-pivot_cat = df_cat.pivot(index='product_category', columns='gender', values='total_sales')
-pivot_cat.plot(kind='bar', ax=axes[0, 1], rot=0)
-axes[0, 1].set_xlabel('Категория товара')
-axes[0, 1].set_ylabel('Общая сумма продаж')
-axes[0, 1].set_title('Продажи по полу в категориях')
-axes[0, 1].legend(title='Пол')
-axes[0, 1].grid(True, alpha=0.3)
-
-# График 3: Динамика продаж по месяцам
-df_monthly_pivot = df_monthly.pivot(index='month', columns='gender', values='total_sales')
-df_monthly_pivot.plot(kind='line', marker='o', ax=axes[0, 2])
-axes[0, 2].set_xlabel('Месяц')
-axes[0, 2].set_ylabel('Общая сумма продаж')
-axes[0, 2].set_title('Динамика продаж по месяцам')
-axes[0, 2].legend(title='Пол')
-axes[0, 2].tick_params(axis='x', rotation=45)
-axes[0, 2].grid(True, alpha=0.3)
-
-# График 4: Сравнение по возрастным группам
-bars = axes[1, 0].bar(df_age_groups['age_group'], df_age_groups['total_sales'],
-                      color=['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFEAA7'])
-axes[1, 0].set_xlabel('Возрастная группа')
-axes[1, 0].set_ylabel('Общая сумма продаж')
-axes[1, 0].set_title('Продажи по возрастным группам')
-for bar in bars:
-    height = bar.get_height()
-    axes[1, 0].text(bar.get_x() + bar.get_width()/2., height,
-                   f'{height:,.0f}', ha='center', va='bottom')
-axes[1, 0].grid(True, alpha=0.3)
-
-# График 5: Средний чек по возрастным группам
-bars2 = axes[1, 1].bar(df_age_groups['age_group'], df_age_groups['avg_transaction'],
-                       color=['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFEAA7'])
-axes[1, 1].set_xlabel('Возрастная группа')
-axes[1, 1].set_ylabel('Средний чек')
-axes[1, 1].set_title('Средний чек по возрастным группам')
-for bar in bars2:
-    height = bar.get_height()
-    axes[1, 1].text(bar.get_x() + bar.get_width()/2., height,
-                   f'{height:.1f}', ha='center', va='bottom')
-axes[1, 1].grid(True, alpha=0.3)
-
-# График 6: Корреляционная матрица
-df_corr = df_all[['age', 'total_amount']].copy()
-df_corr['quantity'] = pd.read_sql_query("SELECT quantity FROM retail_sales", conn)['quantity']
-corr_matrix = df_corr.corr()
-sns.heatmap(corr_matrix, annot=True, cmap='coolwarm', center=0,
-            square=True, ax=axes[1, 2], linewidths=1, cbar_kws={"shrink": 0.8})
-axes[1, 2].set_title('Корреляционная матрица')
-
-plt.tight_layout()
-plt.savefig('retail_sales_analysis.png', dpi=300, bbox_inches='tight')
-plt.show()
-
-# Дополнительная визуализация: Топ продуктов по количеству продаж
-fig2, axes2 = plt.subplots(1, 2, figsize=(15, 6))
-
-# Круговая диаграмма распределения по категориям
-df_category = pd.read_sql_query("""
-    SELECT product_category, SUM(total_amount) as total_sales, COUNT(*) as transactions
-    FROM retail_sales
-    GROUP BY product_category
-""", conn)
-
-colors = ['#FF9999', '#66B2FF', '#99FF99']
-axes2[0].pie(df_category['total_sales'], labels=df_category['product_category'],
-             autopct='%1.1f%%', colors=colors, startangle=90)
-axes2[0].set_title('Распределение продаж по категориям', fontweight='bold')
-
-# Количество транзакций по возрастным группам
-bars3 = axes2[1].bar(df_age_groups['age_group'], df_age_groups['transaction_count'],
-                     color=['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFEAA7'])
-axes2[1].set_xlabel('Возрастная группа')
-axes2[1].set_ylabel('Количество транзакций')
-axes2[1].set_title('Количество транзакций по возрастным группам', fontweight='bold')
-for bar in bars3:
-    height = bar.get_height()
-    axes2[1].text(bar.get_x() + bar.get_width()/2., height,
-                 f'{int(height)}', ha='center', va='bottom')
-axes2[1].grid(True, alpha=0.3)
-
-plt.tight_layout()
-plt.savefig('additional_analysis.png', dpi=300, bbox_inches='tight')
-plt.show()
-
-# Сохраняем все данные в Excel для дальнейшего анализа
-with pd.ExcelWriter('retail_sales_analysis.xlsx', engine='openpyxl') as writer:
-    df_female_over50.to_excel(writer, sheet_name='Женщины_50+', index=False)
-    df_electronics_high.to_excel(writer, sheet_name='Electronics_1000+', index=False)
-    df_beauty_young.to_excel(writer, sheet_name='Beauty_18-25', index=False)
-    df_age_gender_stats.to_excel(writer, sheet_name='Статистика_по_полу', index=False)
-    df_category_gender.to_excel(writer, sheet_name='Продажи_категории_пол', index=False)
-    df_monthly.to_excel(writer, sheet_name='Динамика_помесячно', index=False)
-    df_age_groups.to_excel(writer, sheet_name='Возрастные_группы', index=False)
-    df_category.to_excel(writer, sheet_name='По_категориям', index=False)
-
-print("\n" + "="*50)
-print("ГОТОВО!")
-print("="*50)
-print("Созданы файлы:")
-print("1. retail_sales_analysis.png - Основные графики")
-print("2. additional_analysis.png - Дополнительные графики")
-print("3. retail_sales_analysis.xlsx - Все данные в Excel")
-
-# Закрываем соединение с базой данных
-conn.close()
\ No newline at end of file
+
+# Наборы строк без ограничения размера: в память читается только начало
+# для вывода на экран, в Excel они выгружаются потоково из базы
+ROW_QUERIES = ('female_over50', 'electronics_high', 'beauty_young')
+PREVIEW_ROWS = 10
+
+# Построчные данные для гистограммы возраста и корреляционной матрицы
+QUERIES['transactions'] = "SELECT age, gender, quantity, total_amount FROM retail_sales"
+
+# Без построчных данных (--streaming-stats): гистограмма возраста строится по
+# числу транзакций каждого возраста (полы - в порядке первого появления в
+# таблице, как у unique()), корреляционная матрица считается потоково
+AGE_COUNTS_QUERY = """
+SELECT gender, age, COUNT(*) as transactions
+FROM retail_sales
+GROUP BY gender, age
+ORDER BY MIN(transaction_id)
+"""
+CORRELATION_COLUMNS = {'age': "age", 'total_amount': "total_amount", 'quantity': "quantity"}
+
+# Те же агрегаты по сводной таблице rollup.ROLLUP_TABLE (без COUNT(DISTINCT))
+ROLLUP_QUERIES = {}
+
+ROLLUP_QUERIES['age_gender_stats'] = f"""
+SELECT
+    gender,
+    SUM(transactions) as transaction_count,
+    1.0 * SUM(age * transactions) / SUM(transactions) as avg_age,
+    MIN(age) as min_age,
+    MAX(age) as max_age,
+    SUM(total_sales) as total_sales,
+    SUM(total_sales) / SUM(transactions) as avg_transaction
+FROM {ROLLUP_TABLE}
+GROUP BY gender
+ORDER BY gender
+"""
+
+ROLLUP_QUERIES['category_gender'] = f"""
+SELECT
+    product_category,
+    gender,
+    SUM(transactions) as transactions,
+    SUM(total_items) as total_items,
+    SUM(total_sales) as total_sales,
+    SUM(total_sales) / SUM(transactions) as avg_transaction
+FROM {ROLLUP_TABLE}
+GROUP BY product_category, gender
+ORDER BY product_category, gender
+"""
+
+ROLLUP_QUERIES['monthly'] = f"""
+SELECT
+    strftime('%Y-%m', date) as month,
+    gender,
+    SUM(transactions) as transactions,
+    SUM(total_sales) as total_sales,
+    SUM(total_sales) / SUM(transactions) as avg_sale
+FROM {ROLLUP_TABLE}
+GROUP BY month, gender
+ORDER BY month, gender
+"""
+
+
+@contextmanager
+def stage(name, timings):
+    """Замер времени этапа конвейера: timings[name] = секунды"""
+    started = time.perf_counter()
+    try:
+        with profiler.stage(name):
+            yield
+    finally:
+        timings[name] = time.perf_counter() - started
+        print(f"[время] {name}: {timings[name]:.3f} с")
+
+
+def visual_age_groups(age):
+    """Возрастные группы запроса 7 (CASE в QUERIES['age_groups'])"""
+    age = np.asarray(age)
+    return np.select([age < 25, age <= 34, age <= 44, age <= 54],
+                     ['18-24', '25-34', '35-44', '45-54'], default='55+')
+
+
+def approximate_age_groups(conn):
+    """Запрос 7 по сводке и скетчам покупателей (sketches.py) вместо COUNT(DISTINCT)"""
+    import sketches
+
+    precision = sketches.read_precision(conn)
+    if precision is None:
+        raise ValueError("В базе нет скетчей покупателей: загрузите данные с --sketch-error")
+    cells = sketches.load_cells(conn)
+    groups = sketches.group_cells(cells, {'age_group': visual_age_groups(cells['age'])},
+                                  precision)
+    return pd.DataFrame({
+        'age_group': groups['age_group'],
+        'transaction_count': groups['count'],
+        'unique_customers': groups['unique_customers'],
+        'total_sales': groups['sales'],
+        'avg_transaction': groups['avg'],
+        'total_items': groups['items'],
+        'avg_items': groups['items'] / groups['count'],
+    })
+
+
+def fetch_datasets(conn, approx_distinct=False, streaming_stats=False, names=None,
+                   analytic=None):
+    """Чтение базовых наборов данных (names, по умолчанию все), по одному запросу на набор
+
+    approx_distinct - запрос 7 (age_groups) оценивается по скетчам
+    покупателей вместо COUNT(DISTINCT customer_id). streaming_stats -
+    вместо всех транзакций читаются только число транзакций по возрасту и
+    полу, а корреляционная матрица и описательные статистики считаются за
+    один проход порциями (streaming_stats.py). analytic - соединение
+    backends.connect с колоночным движком: агрегаты и построчные данные
+    читаются через него по таблице фактов, наборы строк 1-3 - из conn.
+    Начало наборов из TOP_QUERIES читается из лидербордов conn, если они есть.
+    """
+    queries = dict(QUERIES)
+    # Агрегаты без COUNT(DISTINCT) считаются по сводной таблице, если она есть
+    if analytic is None and has_rollup(conn):
+        queries.update(ROLLUP_QUERIES)
+    if approx_distinct:
+        queries['age_groups'] = None
+    if streaming_stats:
+        del queries['transactions']
+        queries['age_counts'] = AGE_COUNTS_QUERY
+    if names is not None:
+        queries = {name: query for name, query in queries.items() if name in names}
+    for name in ROW_QUERIES:
+        if name not in queries:
+            continue
+        if name in TOP_QUERIES:
+            # Начало набора по убыванию суммы - топ-n, его читают лидерборды
+            columns, n, filters = TOP_QUERIES[name]
+            queries[name] = top_sales_query(columns, min(n or PREVIEW_ROWS, PREVIEW_ROWS),
+                                            conn, **filters)
+            continue
+        query, params = queries[name]
+        queries[name] = (f"SELECT * FROM ({query}) LIMIT {PREVIEW_ROWS}", params)
+    if analytic is not None:
+        from backends import read_query
+    data = {}
+    for name, query in queries.items():
+        if query is None:
+            data[name] = approximate_age_groups(conn)
+            continue
+        query, params = query if isinstance(query, tuple) else (query, None)
+        if analytic is None or name in ROW_QUERIES:
+            data[name] = read_sql(query, conn, params, name=name)
+        else:
+            data[name] = read_query(query, analytic, params, name)
+    if streaming_stats and (names is None or 'corr_matrix' in names):
+        from streaming_stats import query_stats
+
+        with profiler.stage('потоковые статистики'):
+            stats = query_stats(conn, CORRELATION_COLUMNS)
+        data['corr_matrix'] = stats.corr()
+        data['summary_stats'] = stats.describe()
+    return data
+
+
+def derive_frames(data):
+    """Производные таблицы для графиков - без обращений к базе"""
+    category_gender = data['category_gender']
+    data['category_pivot'] = category_gender.pivot(index='product_category', columns='gender',
+                                                   values='total_sales')
+    data['category'] = (category_gender.groupby('product_category', as_index=False)
+                        [['total_sales', 'transactions']].sum())
+    data['monthly_pivot'] = data['monthly'].pivot(index='month', columns='gender',
+                                                  values='total_sales')
+    if 'transactions' in data:
+        transactions = data['transactions']
+        data['age_counts'] = (transactions.groupby(['gender', 'age'], sort=False).size()
+                              .reset_index(name='transactions'))
+        data['corr_matrix'] = transactions[['age', 'total_amount', 'quantity']].corr()
+    return data
+
+
+def print_datasets(data):
+    print("=" * 50)
+    print("SQL ЗАПРОСЫ С ФИЛЬТРАЦИЕЙ")
+    print("=" * 50)
+
+    print("\n1. Топ-10 покупок женщин старше 50 лет:")
+    print(data['female_over50'])
+
+    print("\n2. Покупки Electronics на сумму > 1000:")
+    print(data['electronics_high'].head(10))
+
+    print("\n3. Молодые покупатели (18-25 лет) в категории Beauty:")
+    print(data['beauty_young'].head(10))
+
+    print("\n" + "=" * 50)
+    print("АГРЕГАЦИОННЫЕ ЗАПРОСЫ")
+    print("=" * 50)
+
+    print("\n4. Статистика по полу:")
+    print(data['age_gender_stats'])
+
+    print("\n5. Продажи по полу в категориях:")
+    print(data['category_gender'])
+
+    print("\n6. Динамика продаж по месяцам:")
+    print(data['monthly'].head(15))
+
+    print("\n7. Сравнение по возрастным группам:")
+    print(data['age_groups'])
+
+    if 'summary_stats' in data:
+        print("\n8. Описательные статистики транзакций:")
+        print(data['summary_stats'].round(3))
+
+
+def _label_bars(ax, bars, fmt):
+    for bar in bars:
+        height = bar.get_height()
+        ax.text(bar.get_x() + bar.get_width() / 2., height,
+                fmt(height), ha='center', va='bottom')
+
+
+def setup_style():
+    """Настройка стиля для всех графиков"""
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    plt.style.use('seaborn-v0_8-darkgrid')
+    sns.set_palette("husl")
+
+
+def plot_main_figure(data):
+    """Основные графики: сетка 2x3"""
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    df_age_counts = data['age_counts']
+    df_age_groups = data['age_groups']
+
+    fig, axes = plt.subplots(2, 3, figsize=(18, 12))
+    fig.suptitle('Анализ розничных продаж', fontsize=16, fontweight='bold')
+
+    # График 1: Распределение продаж по возрасту
+    for gender in df_age_counts['gender'].unique():
+        subset = df_age_counts[df_age_counts['gender'] == gender]
+        axes[0, 0].hist(subset['age'], bins=20, weights=subset['transactions'], alpha=0.6,
+                        label=gender, edgecolor='black')
+    axes[0, 0].set_xlabel('Возраст')
+    axes[0, 0].set_ylabel('Количество транзакций')
+    axes[0, 0].set_title('Распределение продаж по возрасту')
+    axes[0, 0].legend()
+    axes[0, 0].grid(True, alpha=0.3)
+
+    # График 2: Продажи по полу в категориях
+    data['category_pivot'].plot(kind='bar', ax=axes[0, 1], rot=0)
+    axes[0, 1].set_xlabel('Категория товара')
+    axes[0, 1].set_ylabel('Общая сумма продаж')
+    axes[0, 1].set_title('Продажи по полу в категориях')
+    axes[0, 1].legend(title='Пол')
+    axes[0, 1].grid(True, alpha=0.3)
+
+    # График 3: Динамика продаж по месяцам
+    data['monthly_pivot'].plot(kind='line', marker='o', ax=axes[0, 2])
+    axes[0, 2].set_xlabel('Месяц')
+    axes[0, 2].set_ylabel('Общая сумма продаж')
+    axes[0, 2].set_title('Динамика продаж по месяцам')
+    axes[0, 2].legend(title='Пол')
+    axes[0, 2].tick_params(axis='x', rotation=45)
+    axes[0, 2].grid(True, alpha=0.3)
+
+    # График 4: Сравнение по возрастным группам
+    bars = axes[1, 0].bar(df_age_groups['age_group'], df_age_groups['total_sales'],
+                          color=AGE_GROUP_COLORS)
+    axes[1, 0].set_xlabel('Возрастная группа')
+    axes[1, 0].set_ylabel('Общая сумма продаж')
+    axes[1, 0].set_title('Продажи по возрастным группам')
+    _label_bars(axes[1, 0], bars, lambda height: f'{height:,.0f}')
+    axes[1, 0].grid(True, alpha=0.3)
+
+    # График 5: Средний чек по возрастным группам
+    bars2 = axes[1, 1].bar(df_age_groups['age_group'], df_age_groups['avg_transaction'],
+                           color=AGE_GROUP_COLORS)
+    axes[1, 1].set_xlabel('Возрастная группа')
+    axes[1, 1].set_ylabel('Средний чек')
+    axes[1, 1].set_title('Средний чек по возрастным группам')
+    _label_bars(axes[1, 1], bars2, lambda height: f'{height:.1f}')
+    axes[1, 1].grid(True, alpha=0.3)
+
+    # График 6: Корреляционная матрица
+    sns.heatmap(data['corr_matrix'], annot=True, cmap='coolwarm', center=0,
+                square=True, ax=axes[1, 2], linewidths=1, cbar_kws={"shrink": 0.8})
+    axes[1, 2].set_title('Корреляционная матрица')
+
+    fig.tight_layout()
+    return fig
+
+
+def plot_additional_figure(data):
+    """Дополнительная визуализация: категории и транзакции по возрастным группам"""
+    import matplotlib.pyplot as plt
+
+    df_category = data['category']
+    df_age_groups = data['age_groups']
+
+    fig2, axes2 = plt.subplots(1, 2, figsize=(15, 6))
+
+    # Круговая диаграмма распределения по категориям
+    colors = ['#FF9999', '#66B2FF', '#99FF99']
+    axes2[0].pie(df_category['total_sales'], labels=df_category['product_category'],
+                 autopct='%1.1f%%', colors=colors, startangle=90)
+    axes2[0].set_title('Распределение продаж по категориям', fontweight='bold')
+
+    # Количество транзакций по возрастным группам
+    bars3 = axes2[1].bar(df_age_groups['age_group'], df_age_groups['transaction_count'],
+                         color=AGE_GROUP_COLORS)
+    axes2[1].set_xlabel('Возрастная группа')
+    axes2[1].set_ylabel('Количество транзакций')
+    axes2[1].set_title('Количество транзакций по возрастным группам', fontweight='bold')
+    _label_bars(axes2[1], bars3, lambda height: f'{int(height)}')
+    axes2[1].grid(True, alpha=0.3)
+
+    fig2.tight_layout()
+    return fig2
+
+
+# Имя файла -> (функция построения, нужные ей наборы данных, описание)
+FIGURES = {
+    'retail_sales_analysis': (
+        plot_main_figure,
+        ('age_counts', 'category_pivot', 'monthly_pivot', 'age_groups', 'corr_matrix'),
+        'Основные графики',
+    ),
+    'additional_analysis': (
+        plot_additional_figure,
+        ('category', 'age_groups'),
+        'Дополнительные графики',
+    ),
+}
+
+
+def figure_hash(frames, fmt, dpi):
+    """Отпечаток входных данных и параметров вывода графика"""
+    digest = hashlib.sha256(f"{fmt}:{dpi}".encode())
+    for name in sorted(frames):
+        digest.update(name.encode())
+        digest.update(pd.util.hash_pandas_object(frames[name], index=True).to_numpy().tobytes())
+        digest.update(repr(list(frames[name].columns)).encode())
+    return digest.hexdigest()
+
+
+def _render(name, frames, path, fmt, dpi, show=False):
+    import matplotlib.pyplot as plt
+
+    setup_style()
+    fig = FIGURES[name][0](frames)
+    fig.savefig(path, format=fmt, dpi=dpi, bbox_inches='tight')
+    if show:
+        plt.show()
+    plt.close(fig)
+
+
+def _render_headless(name, frames, path, fmt, dpi):
+    """Построение графика в отдельном процессе без оконного интерфейса"""
+    import matplotlib.pyplot as plt
+
+    plt.switch_backend('Agg')
+    _render(name, frames, path, fmt, dpi)
+    return name
+
+
+def render_figures(data, fmt='png', dpi=300, headless=False, workers=None, force=False,
+                   out_dir=''):
+    """Построение всех графиков FIGURES; возвращает {имя: (путь, перерисован ли)}.
+
+    График не перерисовывается, если файл уже есть, а отпечаток его
+    входных данных (рядом, в <файл>.sha256) не изменился. В режиме
+    headless графики строятся параллельно в процессах с бэкендом Agg,
+    иначе - по очереди с показом окна plt.show().
+    """
+    if fmt not in FIGURE_FORMATS:
+        raise ValueError(f"Неизвестный формат графиков: {fmt}")
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+
+    results = {}
+    pending = {}
+    for name, (_, inputs, _) in FIGURES.items():
+        frames = {key: data[key] for key in inputs}
+        path = os.path.join(out_dir, f"{name}.{fmt}")
+        digest = figure_hash(frames, fmt, dpi)
+        try:
+            with open(path + ".sha256", encoding='utf-8') as f:
+                unchanged = f.read().strip() == digest and os.path.exists(path)
+        except FileNotFoundError:
+            unchanged = False
+        results[name] = (path, force or not unchanged)
+        if force or not unchanged:
+            pending[name] = (frames, path, digest)
+
+    if headless:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_render_headless, name, frames, path, fmt, dpi)
+                       for name, (frames, path, _) in pending.items()]
+            for future in futures:
+                future.result()
+    else:
+        for name, (frames, path, _) in pending.items():
+            _render(name, frames, path, fmt, dpi, show=True)
+
+    for name, (_, path, digest) in pending.items():
+        with open(path + ".sha256", 'w', encoding='utf-8') as f:
+            f.write(digest)
+    return results
+
+
+# Наборы данных, нужные export_excel (без построчных данных графиков)
+EXPORT_DATASETS = ('age_gender_stats', 'category_gender', 'monthly', 'age_groups')
+
+
+def export_excel(data, db_path=DB_PATH, path='retail_sales_analysis.xlsx',
+                 overflow_format='csv.gz'):
+    """Сохраняем все данные в Excel для дальнейшего анализа.
+
+    Наборы строк выгружаются потоково прямо из базы (report_export),
+    агрегаты - из уже посчитанных таблиц.
+    """
+    from report_export import export_report
+
+    sheets = {
+        'Женщины_50+': QUERIES['female_over50'],
+        'Electronics_1000+': QUERIES['electronics_high'],
+        'Beauty_18-25': QUERIES['beauty_young'],
+        'Статистика_по_полу': data['age_gender_stats'],
+        'Продажи_категории_пол': data['category_gender'],
+        'Динамика_помесячно': data['monthly'],
+        'Возрастные_группы': data['age_groups'],
+        'По_категориям': data['category'],
+    }
+    return export_report(sheets, db_path, path, overflow_format=overflow_format)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Графики и Excel-отчёт по продажам")
+    parser.add_argument("--db", default=DB_PATH, help="путь к базе данных SQLite")
+    parser.add_argument("--format", choices=FIGURE_FORMATS, default="png",
+                        help="формат файлов с графиками")
+    parser.add_argument("--dpi", type=int, default=300, help="разрешение графиков")
+    parser.add_argument("--headless", action="store_true",
+                        help="без окон: графики строятся параллельно в фоновых процессах")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="число процессов для --headless (по умолчанию - число ядер)")
+    parser.add_argument("--force", action="store_true",
+                        help="перерисовать графики, даже если данные не менялись")
+    parser.add_argument("--overflow-format", choices=OVERFLOW_FORMATS, default="csv.gz",
+                        help="формат выгрузки листов, не помещающихся в Excel")
+    parser.add_argument("--approx-distinct", action="store_true",
+                        help="уникальные покупатели по скетчам HyperLogLog (нужна загрузка "
+                             "с --sketch-error)")
+    parser.add_argument("--streaming-stats", action="store_true",
+                        help="корреляционная матрица за один проход порциями, без чтения "
+                             "всех транзакций в память")
+    parser.add_argument("--backend", choices=BACKENDS, default="sqlite",
+                        help="движок агрегатов (duckdb - колоночный, на всех ядрах)")
+    parser.add_argument("--columnar-dir", default=None,
+                        help="Parquet-копия таблицы (columnar.py) для --backend duckdb")
+    parser.add_argument("--profile", nargs="?", const=profiler.PROFILE_PATH, default=None,
+                        metavar="PATH",
+                        help="профиль запросов и этапов в PATH.txt и PATH.json "
+                             f"(также переменная окружения {profiler.PROFILE_ENV})")
+    args = parser.parse_args(argv)
+    if args.profile:
+        profiler.enable(args.profile)
+    timings = {}
+
+    # Подключение к базе данных
+    conn = sqlite3.connect(args.db)
+    with stage('чтение данных', timings):
+        analytic = None
+        if args.backend != 'sqlite':
+            from backends import connect
+            analytic = connect(args.db, args.backend, args.columnar_dir)
+        data = fetch_datasets(conn, args.approx_distinct, args.streaming_stats,
+                              analytic=analytic)
+    # Закрываем соединения с базой данных: дальше всё считается в памяти
+    conn.close()
+    if analytic is not None:
+        analytic.close()
+
+    with stage('производные таблицы', timings):
+        data = derive_frames(data)
+    print_datasets(data)
+
+    # 3. ВИЗУАЛИЗАЦИЯ ДАННЫХ
+    print("\n" + "=" * 50)
+    print("СОЗДАНИЕ ВИЗУАЛИЗАЦИЙ")
+    print("=" * 50)
+
+    with stage('графики', timings):
+        figures = render_figures(data, fmt=args.format, dpi=args.dpi, headless=args.headless,
+                                 workers=args.workers, force=args.force)
+    with stage('экспорт в Excel', timings):
+        sheets = export_excel(data, args.db, overflow_format=args.overflow_format)
+
+    print("\n" + "=" * 50)
+    print("ГОТОВО!")
+    print("=" * 50)
+    print("Созданы файлы:")
+    for number, (name, (path, rendered)) in enumerate(figures.items(), start=1):
+        note = "" if rendered else " (без изменений)"
+        print(f"{number}. {path} - {FIGURES[name][2]}{note}")
+    print(f"{len(figures) + 1}. retail_sales_analysis.xlsx - Все данные в Excel")
+    for sheet_name, (path, rows) in sheets.items():
+        if path != 'retail_sales_analysis.xlsx':
+            print(f"   лист {sheet_name} ({rows} строк) не помещается в Excel, продолжение: {path}")
+    print("\nВремя по этапам: " + ", ".join(f"{name} {seconds:.2f} с"
+                                             for name, seconds in timings.items()))
+    return timings
+
+
+if __name__ == "__main__":
+    main()